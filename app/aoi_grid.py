@@ -0,0 +1,130 @@
+import math
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+# metres per degree of latitude
+METERS_PER_DEGREE = 111320.0
+# half the side of a poi's square aoi in metres, unless the poi has a 'buffer'
+DEFAULT_BUFFER = 3000
+# pixel spacing of Sentinel-1 GRD (IW, high resolution) in metres
+NATIVE_SCALE = 10
+# longer side of a frame in pixels; larger aois are fetched coarser than NATIVE_SCALE
+MAX_DIMENSION = 4096
+# pixels per side of one thumbnail / download request, well below Earth Engine's request size limits
+TILE_SIZE = 1024
+
+
+def aoi_buffer(poi):
+  return float(poi.get('buffer') or DEFAULT_BUFFER)
+
+
+def aoi_bounds(poi, buffer=None):
+  """[west, south, east, north] of the poi's aoi, the bounds of a buffer metres circle as in Imagery.generate_base_aoi."""
+  buffer = aoi_buffer(poi) if buffer is None else buffer
+  dlat = buffer / METERS_PER_DEGREE
+  dlon = buffer / (METERS_PER_DEGREE * math.cos(math.radians(float(poi['lat']))))
+  return [float(poi['lon']) - dlon, float(poi['lat']) - dlat, float(poi['lon']) + dlon, float(poi['lat']) + dlat]
+
+
+def frame_shape(bounds, scale=NATIVE_SCALE, max_dimension=MAX_DIMENSION):
+  """(height, width) in pixels of `scale` metres over bounds, scaled down so the longer side is at most max_dimension."""
+  west, south, east, north = bounds
+  height = (north - south) * METERS_PER_DEGREE / scale
+  width = (east - west) * METERS_PER_DEGREE * math.cos(math.radians((north + south) / 2)) / scale
+  factor = min(1.0, max_dimension / max(height, width))
+  return (max(1, round(height * factor)), max(1, round(width * factor)))
+
+
+def dimensions(shape):
+  """Earth Engine's 'WIDTHxHEIGHT' for a (height, width) shape."""
+  return f'{shape[1]}x{shape[0]}'
+
+
+def parse_dimensions(value):
+  """(height, width) from 'WIDTHxHEIGHT', None for a single number (Earth Engine keeps the aspect ratio then)."""
+  if isinstance(value, str) and 'x' in value:
+    (width, height) = value.split('x')
+    return (int(height), int(width))
+  return None
+
+
+def polygon(bounds):
+  """Earth Engine region coordinates of [west, south, east, north]."""
+  west, south, east, north = bounds
+  return [[[west, south], [east, south], [east, north], [west, north], [west, south]]]
+
+
+def is_bounds(region):
+  return isinstance(region, (list, tuple)) and len(region) == 4 and all(isinstance(v, (int, float)) for v in region)
+
+
+def split_tiles(shape, tile_size=TILE_SIZE):
+  """(row, col, height, width) windows of at most tile_size pixels per side, covering shape."""
+  return [
+    (row, col, min(tile_size, shape[0] - row), min(tile_size, shape[1] - col))
+    for row in range(0, shape[0], tile_size)
+    for col in range(0, shape[1], tile_size)
+  ]
+
+
+def window_bounds(bounds, shape, window):
+  """[west, south, east, north] of a window, on the pixel edges of shape over bounds."""
+  west, south, east, north = bounds
+  (row, col, height, width) = window
+  px = (east - west) / shape[1]
+  py = (north - south) / shape[0]
+  return [west + col * px, north - (row + height) * py, west + (col + width) * px, north - row * py]
+
+
+def tile_params(params, tile_size=TILE_SIZE):
+  """Split request params whose region is [west, south, east, north] and dimensions 'WIDTHxHEIGHT' into tiles.
+  Returns:
+    tuple: ((height, width), [(window, params)]) with the region of every tile as polygon coordinates,
+      or (None, [(None, params)]) for params that can't be or needn't be split.
+  """
+  shape = parse_dimensions(params.get('dimensions'))
+  if shape is None or not is_bounds(params.get('region')):
+    return (None, [(None, params)])
+  bounds = list(params['region'])
+  return (shape, [
+    (window, dict(params, region=polygon(window_bounds(bounds, shape, window)), dimensions=dimensions(window[2:])))
+    for window in split_tiles(shape, tile_size)
+  ])
+
+
+def _fit(part, height, width):
+  """Nearest resample of a tile that came back in another size than requested."""
+  if part.shape[:2] == (height, width):
+    return part
+  rows = (np.arange(height) * part.shape[0] // height)
+  cols = (np.arange(width) * part.shape[1] // width)
+  return part[np.ix_(rows, cols)]
+
+
+def mosaic(shape, windows, parts):
+  """Paste tiles (arrays, or {band: array} dicts) into one array or dict of shape."""
+  if isinstance(parts[0], dict):
+    return {band: mosaic(shape, windows, [p[band] for p in parts]) for band in parts[0]}
+  first = parts[0]
+  out = np.zeros(tuple(shape) + first.shape[2:], dtype=first.dtype)
+  for (row, col, height, width), part in zip(windows, parts):
+    out[row:row + height, col:col + width] = _fit(part, height, width)
+  return out
+
+
+def fetch_tiled(fetch, params, workers=4, tile_size=TILE_SIZE):
+  """Call fetch(params) once per tile of params (see tile_params), in parallel, and mosaic the results."""
+  (shape, tiles) = tile_params(params, tile_size)
+  if len(tiles) == 1:
+    return fetch(tiles[0][1])
+  with ThreadPoolExecutor(max_workers=max(1, min(workers, len(tiles)))) as pool:
+    parts = list(pool.map(lambda tile: fetch(tile[1]), tiles))
+  return mosaic(shape, [window for window, _ in tiles], parts)
+
+
+def grid_interval(bounds, lines=4):
+  """Gridline spacing in degrees, a 1, 2 or 5 step that gives about `lines` lines across the aoi."""
+  extent = max(bounds[2] - bounds[0], bounds[3] - bounds[1]) / lines
+  power = 10 ** math.floor(math.log10(extent))
+  step = min((s * power for s in (1, 2, 5, 10)), key=lambda s: abs(s - extent))
+  return (step, step)
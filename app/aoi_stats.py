@@ -0,0 +1,114 @@
+import io
+import os
+import datetime
+import ee
+import pandas as pd
+from ee_client import get_client
+from metrics import optional_stage
+from aoi_grid import aoi_buffer
+
+BANDS = ('VV', 'VH', 'VH-VV')
+PERCENTILES = (10, 90)
+# pois per request, keeps the result of one request below getInfo's 5000 features for the usual date ranges
+CHUNK_SIZE = 50
+
+
+def stats_reducer(percentiles=PERCENTILES):
+  """Mean, median and percentiles in one pass, output as <band>_mean, <band>_median and <band>_p<n>."""
+  return ee.Reducer.mean() \
+    .combine(ee.Reducer.median(), sharedInputs=True) \
+    .combine(ee.Reducer.percentile(list(percentiles)), sharedInputs=True)
+
+
+def statistic_names(bands=BANDS, percentiles=PERCENTILES):
+  return [f'{band}_{stat}' for band in bands for stat in ['mean', 'median'] + [f'p{p}' for p in percentiles]]
+
+
+def poi_features(pois):
+  """The pois' aois (as in Imagery.generate_base_aoi) as an ee.FeatureCollection with a 'poi' property."""
+  return ee.FeatureCollection([
+    ee.Feature(ee.Geometry.Point([float(poi['lon']), float(poi['lat'])]).buffer(aoi_buffer(poi)).bounds(), {'poi': poi['name']})
+    for poi in pois
+  ])
+
+
+def reduce_table(col, features, bands=BANDS, scale=10, percentiles=PERCENTILES):
+  """Server-side table with one feature per scene and aoi, holding the statistics of every band.
+  Args:
+    col (object): ee.ImageCollection, filtered by date.
+    features (object): ee.FeatureCollection of aois with a 'poi' property, see poi_features.
+  Returns:
+    object: ee.FeatureCollection without geometries.
+  """
+  reducer = stats_reducer(percentiles)
+
+  def per_image(image):
+    # only the aois the scene covers
+    stats = image.select(list(bands)).reduceRegions(features.filterBounds(image.geometry()), reducer, scale)
+    return stats.map(lambda f: ee.Feature(None, f.toDictionary()).set(
+      'date', image.date().format('YYYY-MM-dd'),
+      'time_start', image.get('system:time_start'),
+      'scene', image.get('system:index')))
+
+  return col.filterBounds(features.geometry()).map(per_image).flatten()
+
+
+def to_frame(features, bands=BANDS, percentiles=PERCENTILES):
+  """getInfo() result of reduce_table as a DataFrame: poi, date, time_start, scene and one column per band statistic."""
+  columns = ['poi', 'date', 'time_start', 'scene'] + statistic_names(bands, percentiles)
+  rows = [f['properties'] for f in features['features']]
+  df = pd.DataFrame(rows, columns=columns)
+  # aois the scene only touches outside its valid pixels have no values
+  df = df.dropna(how='all', subset=columns[4:])
+  return df.sort_values(['poi', 'time_start']).reset_index(drop=True)
+
+
+def aoi_statistics(col, pois, start_date, end_date, bands=BANDS, scale=10, percentiles=PERCENTILES, cache=None, client=None, metrics=None):
+  """Backscatter statistics (in dB) per scene over the aoi of every poi, without rendering any images.
+  Every CHUNK_SIZE pois take one Earth Engine round-trip, the chunks run concurrently.
+  Results for date ranges that ended before today are cached, later scenes could still be added to newer ones.
+  Args:
+    col (object): The base ee.ImageCollection, e.g. Imagery.col_final.
+    pois (list): Poi dicts with 'name', 'lat' and 'lon'.
+    start_date (str): First date, as 'YYYY-MM-dd'.
+    end_date (str): End date (exclusive).
+    cache (FrameCache, optional): Cache for the resulting table. Defaults to None.
+    client (EEClient, optional): Defaults to the process-wide client.
+    metrics (RenderMetrics, optional): Records the 'ee_statistics' stage. Defaults to None.
+  Returns:
+    pandas.DataFrame: See to_frame.
+  """
+  key = None
+  if cache is not None and end_date < datetime.date.today().isoformat():
+    key = cache.key('aoi_stats', pois=[(p['name'], float(p['lat']), float(p['lon']), aoi_buffer(p)) for p in pois], start_date=start_date,
+      end_date=end_date, bands=list(bands), scale=scale, percentiles=list(percentiles))
+    data = cache.get(key)
+    if data is not None:
+      return pd.read_csv(io.BytesIO(data))
+
+  client = client or get_client()
+  col = col.filterDate(start_date, end_date)
+  chunks = [pois[i:i + CHUNK_SIZE] for i in range(0, len(pois), CHUNK_SIZE)]
+  with optional_stage(metrics, 'ee_statistics'):
+    results = client.run(client.gather([
+      client.evaluate(reduce_table(col, poi_features(chunk), bands, scale, percentiles)) for chunk in chunks
+    ]))
+  if metrics is not None:
+    metrics.add('ee_round_trips', len(chunks))
+  df = pd.concat([to_frame(r, bands, percentiles) for r in results], ignore_index=True)
+
+  if key is not None:
+    cache.put(key, df.to_csv(index=False).encode('utf-8'))
+  return df
+
+
+def export_stats(df, path):
+  """Write the table as .csv or .parquet (needs pyarrow or fastparquet)."""
+  ext = os.path.splitext(path)[1].lower()
+  if ext == '.csv':
+    df.to_csv(path, index=False)
+  elif ext == '.parquet':
+    df.to_parquet(path, index=False)
+  else:
+    raise ValueError(f'Unknown statistics format: {path}')
+  return path
@@ -0,0 +1,87 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# a track is one orbit direction and relative orbit: only its scenes share the viewing geometry
+TRACK_PROPERTIES = ('orbitProperties_pass', 'relativeOrbitNumber_start')
+
+
+def scene_tracks(metadata):
+  """Track id ('<pass>_<relative orbit>') per scene of prefetch_metadata(..., properties=TRACK_PROPERTIES)."""
+  return [f'{p}_{o}' for p, o in zip(*(metadata[prop] for prop in TRACK_PROPERTIES))]
+
+
+def smooth(images, size=3):
+  """Box filter over the last two axes to damp speckle before comparing dates."""
+  if size <= 1:
+    return images
+  pad = size // 2
+  padded = np.pad(images, [(0, 0)] * (images.ndim - 2) + [(pad, pad), (pad, pad)], mode='edge')
+  return sliding_window_view(padded, (size, size), axis=(-2, -1)).mean(axis=(-2, -1))
+
+
+def log_ratio(stack, size=3):
+  """Per-pixel change between consecutive dates.
+  Args:
+    stack (numpy.ndarray): (time, band, y, x) backscatter in dB, as delivered by COPERNICUS/S1_GRD.
+    size (int, optional): Box filter size applied first. Defaults to 3.
+  Returns:
+    numpy.ndarray: (time - 1, y, x) absolute log-ratio in dB (the dB difference), averaged over the bands.
+  """
+  smoothed = smooth(np.asarray(stack, dtype=np.float32), size)
+  return np.nanmean(np.abs(np.diff(smoothed, axis=0)), axis=1)
+
+
+def change_scores(changes, threshold=3.0):
+  """Per-date scores of (time - 1, y, x) change maps: mean change in dB and the fraction of pixels above threshold."""
+  flat = changes.reshape(len(changes), -1)
+  return np.nanmean(flat, axis=1), np.nanmean(flat > threshold, axis=1)
+
+
+def rank_dates(dates, fractions, means, top=5):
+  """The dates with the most change, largest first. dates[i] is the later date of change i."""
+  order = np.lexsort((-np.asarray(means), -np.asarray(fractions)))[:top]
+  return [{'date': dates[i], 'changed_fraction': float(fractions[i]), 'mean_change_db': float(means[i])} for i in order]
+
+
+def detect_changes(cube, start_date=None, end_date=None, threshold=3.0, size=3, top=5):
+  """Run change detection over the scenes of a SceneCube.
+  Every scene is compared with the previous scene of the same track (the 'track' of the index, see scene_tracks), a
+  different orbit sees the ground from another angle. Scenes stored without a track are compared among themselves.
+  Works on one scene at a time, so memory stays at one scene per track no matter how many there are.
+  Args:
+    cube (SceneCube): The poi's stored scenes.
+    start_date (str, optional): First date, as 'YYYY-MM-dd'. Defaults to None.
+    end_date (str, optional): End date (exclusive). Defaults to None.
+    threshold (float, optional): Change in dB that counts a pixel as changed. Defaults to 3.0.
+    size (int, optional): Box filter size against speckle. Defaults to 3.
+    top (int, optional): How many dates to rank. Defaults to 5.
+  Returns:
+    dict: 'dates' (later date of each pair), 'mean_change_db', 'changed_fraction', 'ranked' and
+    'max_change' (y, x), the largest change of every pixel over the period. None without two scenes of a track.
+  """
+  if len(cube.select(start_date, end_date)) < 2:
+    return None
+  dates, means, fractions = [], [], []
+  previous = {}
+  max_change = None
+  for scene, array in cube.iter_scenes(start_date, end_date):
+    current = smooth(np.asarray(array, dtype=np.float32), size)
+    track = scene.get('track')
+    if track in previous:
+      change = np.nanmean(np.abs(current - previous[track]), axis=0)
+      mean, fraction = change_scores(change[None], threshold)
+      dates.append(scene['date'])
+      means.append(float(mean[0]))
+      fractions.append(float(fraction[0]))
+      max_change = change if max_change is None else np.fmax(max_change, change)
+    previous[track] = current
+  if len(dates) == 0:
+    return None
+  return {
+    'dates': dates,
+    'mean_change_db': means,
+    'changed_fraction': fractions,
+    'ranked': rank_dates(dates, fractions, means, top),
+    'max_change': max_change,
+    'threshold': threshold,
+  }
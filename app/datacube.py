@@ -0,0 +1,143 @@
+import os
+import json
+import fcntl
+import tempfile
+import contextlib
+import threading
+import numpy as np
+
+
+class SceneCube():
+  """Appendable per-poi store of raw scene values, read lazily through memory maps.
+
+  Every scene is one (band, y, x) float32 .npy file, index.json lists the
+  scenes in time order with their metadata. Together they form a
+  time x band x y x x cube that can be sliced by date without loading the
+  rest into memory, and grown one scene at a time.
+
+
+  grid describes where the pixels come from (aoi, dimensions, crs); opening
+  the cube with a different grid starts it over, since those scenes could
+  not be stacked with the stored ones. Open without a grid to just read.
+  """
+
+  def __init__(self, path, bands=('VV', 'VH'), grid=None):
+    self.path = os.path.abspath(path)
+    self.lock = threading.Lock()
+    if not os.path.exists(self.path):
+      os.makedirs(self.path, exist_ok=True)
+    self.index = self._load_index()
+    if self._outdated(grid):
+      with self._locked():
+        # another process may have started it over in the meantime
+        self.index = self._load_index()
+        if self._outdated(grid):
+          self._reset(bands, grid)
+
+  def _outdated(self, grid):
+    return self.index is None or (grid is not None and grid != self.index.get('grid'))
+
+  @contextlib.contextmanager
+  def _locked(self):
+    """Held around every change of the files, against other threads and processes."""
+    with self.lock, open(os.path.join(self.path, '.lock'), 'w') as lock:
+      fcntl.flock(lock, fcntl.LOCK_EX)
+      yield
+
+  def _load_index(self):
+    index_path = os.path.join(self.path, 'index.json')
+    if not os.path.exists(index_path):
+      return None
+    with open(index_path) as f:
+      return json.load(f)
+
+  def _save_index(self):
+    index_path = os.path.join(self.path, 'index.json')
+    with open(index_path + '.tmp', 'w') as f:
+      json.dump(self.index, f, indent=2)
+    os.replace(index_path + '.tmp', index_path)
+
+  @property
+  def bands(self):
+    return self.index['bands']
+
+  @property
+  def scenes(self):
+    return list(self.index['scenes'])
+
+  def __len__(self):
+    return len(self.index['scenes'])
+
+  def has(self, scene_id):
+    return any(s['id'] == scene_id for s in self.index['scenes'])
+
+  def append(self, scene_id, bands, date, time_start, **meta):
+    """Store one scene from {band: 2d array}. Scenes already in the cube are skipped."""
+    stack = np.stack([np.asarray(bands[b], dtype=np.float32) for b in self.bands])
+    fname = f'{scene_id}.npy'
+    with self._locked():
+      # another process may have appended in the meantime
+      self.index = self._load_index() or self.index
+      if self.has(scene_id):
+        return
+      fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+      with os.fdopen(fd, 'wb') as f:
+        np.save(f, stack)
+      os.replace(tmp, os.path.join(self.path, fname))
+      self.index['scenes'].append({'id': scene_id, 'date': date, 'time_start': time_start, 'file': fname, 'shape': list(stack.shape), **meta})
+      self.index['scenes'].sort(key=lambda s: s['time_start'])
+      self._save_index()
+
+  def set_meta(self, meta):
+    """Add metadata to stored scenes from {scene_id: {key: value}}. Ids not in the cube are ignored."""
+    with self._locked():
+      self.index = self._load_index() or self.index
+      for scene in self.index['scenes']:
+        scene.update(meta.get(scene['id'], {}))
+      self._save_index()
+
+  def select(self, start_date=None, end_date=None):
+    """Metadata of the scenes with start_date <= date < end_date."""
+    return [s for s in self.index['scenes']
+      if (start_date is None or s['date'] >= start_date) and (end_date is None or s['date'] < end_date)]
+
+  def read(self, scene):
+    """Memory-mapped (band, y, x) array of a scene (its metadata dict or id)."""
+    if isinstance(scene, str):
+      scene = next(s for s in self.index['scenes'] if s['id'] == scene)
+    return np.load(os.path.join(self.path, scene['file']), mmap_mode='r')
+
+  def read_bands(self, scene):
+    array = self.read(scene)
+    return {band: array[i] for i, band in enumerate(self.bands)}
+
+  def iter_scenes(self, start_date=None, end_date=None):
+    """Yield (metadata, memory-mapped array) per scene, holding only one scene at a time."""
+    for scene in self.select(start_date, end_date):
+      yield scene, self.read(scene)
+
+  def stack(self, bands=None, start_date=None, end_date=None):
+    """Load a (time, band, y, x) array. Use iter_scenes for long periods."""
+    picks = [self.bands.index(b) for b in (bands or self.bands)]
+    scenes = self.select(start_date, end_date)
+    if len(scenes) == 0:
+      return np.empty((0, len(picks), 0, 0), dtype=np.float32)
+    shapes = {tuple(s['shape'][1:]) for s in scenes}
+    if len(shapes) > 1:
+      raise ValueError(f'Scenes have different sizes: {sorted(shapes)}')
+    out = np.empty((len(scenes), len(picks)) + shapes.pop(), dtype=np.float32)
+    for t, scene in enumerate(scenes):
+      out[t] = self.read(scene)[picks]
+    return out
+
+  def _reset(self, bands, grid):
+    for f in os.listdir(self.path):
+      if f.endswith('.npy') or f == 'index.json':
+        os.remove(os.path.join(self.path, f))
+    self.index = {'bands': list(bands), 'grid': grid, 'scenes': []}
+    self._save_index()
+
+  def clear(self):
+    """Remove all scenes, keeping bands and grid."""
+    with self._locked():
+      self._reset(self.bands, self.index.get('grid'))
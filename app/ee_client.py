@@ -0,0 +1,139 @@
+import random
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+
+# statuses worth another try: quota (429) and transient server errors
+RETRY_STATUS = (429, 500, 502, 503, 504)
+# Earth Engine reports quota and load problems as EEException messages
+RETRY_MESSAGES = ('too many requests', 'quota exceeded', 'too many concurrent', 'rate limit', 'service unavailable', 'deadline exceeded')
+
+
+class EERequestError(Exception):
+
+  def __init__(self, message, status=None):
+    super().__init__(message)
+    self.status = status
+
+
+def is_retryable(exc):
+  if isinstance(exc, EERequestError):
+    return exc.status in RETRY_STATUS
+  if isinstance(exc, (asyncio.TimeoutError, requests.ConnectionError, requests.Timeout)):
+    return True
+  message = str(exc).lower()
+  return any(m in message for m in RETRY_MESSAGES)
+
+
+class EEClient():
+  """Bounded, retrying access to the Earth Engine calls of the pipeline.
+
+  The ee library and the downloads are blocking, so every call runs on a
+  thread pool, driven by an asyncio loop in a background thread. The loop
+  holds a semaphore of `concurrency` calls in flight, waits at most `timeout`
+  seconds per attempt and retries quota and transient errors with exponential
+  backoff and full jitter. Downloads share one pooled requests.Session.
+
+  Coroutines can be awaited on the client's loop or handed over from any
+  thread with submit() (a concurrent.futures.Future) or run() (blocks).
+  A timed out attempt cannot be interrupted, its thread finishes in the background.
+  """
+
+  def __init__(self, concurrency=8, timeout=60, retries=5, backoff=0.5, max_backoff=30, session=None):
+    self.concurrency = concurrency
+    self.timeout = timeout
+    self.retries = retries
+    self.backoff = backoff
+    self.max_backoff = max_backoff
+    if session is None:
+      session = requests.Session()
+      adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+      session.mount('http://', adapter)
+      session.mount('https://', adapter)
+    self.session = session
+    # timed out attempts keep their thread, so leave room next to the semaphore's calls
+    self.executor = ThreadPoolExecutor(max_workers=2 * concurrency, thread_name_prefix='ee-client')
+    self.stats = {'calls': 0, 'retries': 0, 'timeouts': 0, 'failures': 0}
+    self.loop = asyncio.new_event_loop()
+    self.thread = threading.Thread(target=self.loop.run_forever, name='ee-client-loop', daemon=True)
+    self.thread.start()
+    self.semaphore = self.run(self._make_semaphore())
+
+  async def _make_semaphore(self):
+    # created on the loop so it is bound to it
+    return asyncio.Semaphore(self.concurrency)
+
+  def delay(self, attempt):
+    """Full jitter: uniform between 0 and the capped exponential backoff."""
+    return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+  async def call(self, fn, *args):
+    """Run a blocking call with the concurrency limit, timeout and retries."""
+    attempt = 0
+    while True:
+      async with self.semaphore:
+        self.stats['calls'] += 1
+        try:
+          return await asyncio.wait_for(self.loop.run_in_executor(self.executor, fn, *args), self.timeout)
+        except Exception as exc:
+          if isinstance(exc, asyncio.TimeoutError):
+            self.stats['timeouts'] += 1
+          if attempt >= self.retries or not is_retryable(exc):
+            self.stats['failures'] += 1
+            raise
+      # back off outside the semaphore, so other calls can go ahead
+      self.stats['retries'] += 1
+      await asyncio.sleep(self.delay(attempt))
+      attempt += 1
+
+  def _get(self, url):
+    response = self.session.get(url, timeout=self.timeout)
+    if response.status_code != 200:
+      raise EERequestError(f'Request failed ({response.status_code}): {url}', response.status_code)
+    return response.content
+
+  async def evaluate(self, ee_object):
+    """getInfo() of a computed object."""
+    return await self.call(ee_object.getInfo)
+
+  async def get(self, url):
+    """Content of a thumbnail or download url."""
+    return await self.call(self._get, url)
+
+  async def gather(self, coros):
+    return await asyncio.gather(*coros)
+
+  def submit(self, coro):
+    return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+  def run(self, coro):
+    return self.submit(coro).result()
+
+  def close(self):
+    self.loop.call_soon_threadsafe(self.loop.stop)
+    self.thread.join()
+    self.executor.shutdown(wait=False)
+    self.session.close()
+
+
+# shared by everything in the process, see get_client
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+  """The process-wide EEClient, so all requests of a process share one quota budget."""
+  global _client
+  with _client_lock:
+    if _client is None:
+      _client = EEClient()
+    return _client
+
+
+def set_client(client):
+  """Replace the process-wide EEClient, e.g. with other limits."""
+  global _client
+  with _client_lock:
+    _client = client
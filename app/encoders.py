@@ -0,0 +1,267 @@
+import os
+import subprocess
+import numpy as np
+from PIL import Image, ImageSequence, GifImagePlugin
+from limits import check_memory
+
+# palette index left out of the shared palette, marks pixels unchanged since the previous frame
+TRANSPARENT = 255
+
+
+def frame_filename(index, name, file_format='png'):
+  return str(index).zfill(3) + "_" + str(name) + "." + file_format
+
+
+class GifWriter():
+  """Appends frames to an animated gif as they arrive, without keeping them in memory.
+
+  Every frame is quantized to its own 256 color palette and written in full
+  with GifImagePlugin's header / frame chunks (imageio's pillow plugin would
+  collect all frames until close). See OptimizedGifWriter for smaller files.
+  """
+
+  def __init__(self, path, fps):
+    self.path = path
+    self.duration = int(round(1000 / fps))
+    self.file = None
+
+  def append(self, frame):
+    image = Image.fromarray(frame).quantize(colors=256, dither=Image.Dither.NONE)
+    if self.file is None:
+      self.file = open(self.path, 'wb')
+      for chunk in GifImagePlugin.getheader(image, info={'loop': 0, 'optimize': False})[0]:
+        self.file.write(chunk)
+    for chunk in GifImagePlugin.getdata(image, duration=self.duration, include_color_table=True):
+      self.file.write(chunk)
+
+  def close(self):
+    if self.file is not None:
+      self.file.write(b';')
+      self.file.close()
+
+
+class OptimizedGifWriter():
+  """Appends frames to an animated gif that only stores what changed.
+
+  All frames share one global palette of 255 colors, fitted on the first
+  frame (the map furniture and the SAR colors are known by then). Every
+  later frame is cropped to the box of pixels that differ from the
+  previous frame, and unchanged pixels inside the box are written as the
+  transparent index, which leaves long runs for the LZW compression.
+  Frames are written as they arrive with GifImagePlugin's header / frame
+  chunks, so nothing but the previous frame's indices is kept in memory.
+  """
+
+  def __init__(self, path, fps):
+    self.path = path
+    self.duration = int(round(1000 / fps))
+    self.file = None
+    self.palette = None
+    self.previous = None
+
+  def _fit_palette(self, image):
+    palette = image.quantize(colors=TRANSPARENT).getpalette()[:3 * TRANSPARENT]
+    palette += [0] * (3 * TRANSPARENT - len(palette))
+    # the transparent entry repeats color 0, so pixels quantized to it can be moved to 0
+    self.palette = palette + palette[:3]
+    self.palette_image = Image.new('P', (1, 1))
+    self.palette_image.putpalette(self.palette)
+
+  def _indexed(self, indices):
+    image = Image.fromarray(np.ascontiguousarray(indices), mode='P')
+    image.putpalette(self.palette)
+    return image
+
+  def append(self, frame):
+    image = Image.fromarray(frame)
+    if self.palette is None:
+      self._fit_palette(image)
+    indices = np.asarray(image.quantize(palette=self.palette_image, dither=0)).copy()
+    indices[indices == TRANSPARENT] = 0
+
+    if self.previous is None:
+      self.file = open(self.path, 'wb')
+      for chunk in GifImagePlugin.getheader(self._indexed(indices), info={'loop': 0, 'optimize': False})[0]:
+        self.file.write(chunk)
+      (offset, delta) = ((0, 0), indices)
+    else:
+      changed = indices != self.previous
+      if not changed.any():
+        # nothing changed, a single transparent pixel keeps the frame's time slot
+        (offset, delta) = ((0, 0), np.full((1, 1), TRANSPARENT, dtype=np.uint8))
+      else:
+        rows = np.flatnonzero(changed.any(axis=1))
+        cols = np.flatnonzero(changed.any(axis=0))
+        box = (slice(rows[0], rows[-1] + 1), slice(cols[0], cols[-1] + 1))
+        delta = np.where(changed[box], indices[box], TRANSPARENT).astype(np.uint8)
+        offset = (int(cols[0]), int(rows[0]))
+    for chunk in GifImagePlugin.getdata(self._indexed(delta), offset=offset, duration=self.duration, disposal=1, transparency=TRANSPARENT):
+      self.file.write(chunk)
+    self.previous = indices
+
+  def close(self):
+    if self.file is not None:
+      self.file.write(b';')
+      self.file.close()
+
+
+def fit_gif_budget(path, max_bytes, fps, attempts=3):
+  """Scale an optimized gif down until it is at most max_bytes, by re-encoding its own frames.
+  Returns:
+    int: The final size in bytes.
+  """
+  size = os.path.getsize(path)
+  scale = 1.0
+  for _ in range(attempts):
+    if size <= max_bytes:
+      break
+    # the size grows roughly with the pixel count
+    scale *= 0.95 * (max_bytes / size) ** 0.5
+    tmp = path + '.tmp'
+    with Image.open(path) as gif:
+      width, height = (max(1, int(gif.width * scale)), max(1, int(gif.height * scale)))
+      writer = OptimizedGifWriter(tmp, fps)
+      for frame in ImageSequence.Iterator(gif):
+        writer.append(np.asarray(frame.convert('RGB').resize((width, height), Image.LANCZOS)))
+      writer.close()
+    os.replace(tmp, path)
+    size = os.path.getsize(path)
+  return size
+
+
+class WebpWriter():
+  """Writes an animated WebP when closed.
+
+  Pillow can only encode a whole animation at once, so the frames are
+  spooled to lossless WebP files of chunk_frames frames next to the
+  output and re-encoded into the final file on close. Animated WebP files
+  are decoded one frame at a time, so about chunk_frames frames plus one
+  per chunk are held in memory instead of all of them.
+  """
+
+  chunk_frames = 8
+
+  def __init__(self, path, fps, quality=80):
+    self.path = path
+    self.duration = int(round(1000 / fps))
+    self.quality = quality
+    self.frames = []
+    self.chunks = []
+
+  def _spool(self):
+    chunk = f'{self.path}.{len(self.chunks)}.tmp'
+    self.frames[0].save(chunk, format='WEBP', save_all=True, append_images=self.frames[1:], duration=self.duration,
+      lossless=True, quality=0, method=0)
+    self.chunks.append(chunk)
+    self.frames = []
+
+  def append(self, frame):
+    self.frames.append(Image.fromarray(frame))
+    if len(self.frames) == self.chunk_frames:
+      self._spool()
+
+  def close(self):
+    if len(self.frames) > 0:
+      self._spool()
+    if len(self.chunks) > 0:
+      images = [Image.open(chunk) for chunk in self.chunks]
+      try:
+        images[0].save(self.path, format='WEBP', save_all=True, append_images=images[1:], duration=self.duration,
+          loop=0, quality=self.quality, method=4)
+      finally:
+        for image in images:
+          image.close()
+    self.abort()
+
+  def abort(self):
+    self.frames = []
+    for chunk in self.chunks:
+      if os.path.exists(chunk):
+        os.remove(chunk)
+    self.chunks = []
+
+
+class Mp4Writer():
+  """Appends frames to an mp4 video. The video size is taken from the first frame."""
+
+  def __init__(self, path, fps):
+    try:
+      import cv2
+    except ImportError:
+      print("Installing opencv-python ...")
+      subprocess.check_call(["python", "-m", "pip", "install", "opencv-python"])
+      import cv2
+    self.cv2 = cv2
+    self.path = path
+    self.fps = fps
+    self.writer = None
+
+  def append(self, frame):
+    if self.writer is None:
+      height, width = frame.shape[:2]
+      fourcc = self.cv2.VideoWriter_fourcc(*"mp4v")
+      self.writer = self.cv2.VideoWriter(self.path, fourcc, self.fps, (width, height))
+    self.writer.write(self.cv2.cvtColor(frame, self.cv2.COLOR_RGB2BGR))
+
+  def close(self):
+    if self.writer is not None:
+      self.writer.release()
+
+
+class FrameEncoder():
+  """Feeds rendered rgb frames to every requested output, one frame at a time.
+
+  frames_dir keeps a copy of each frame as an image file, named
+  <index>_<scene id>.<file_format> like the old png output, counting
+  from first_index. optimize_gif writes the gif with OptimizedGifWriter,
+  and gif_max_bytes then scales it down on close until it fits.
+  """
+
+  def __init__(self, out_gif=None, out_mp4=None, fps=10, frames_dir=None, file_format='png', first_index=0,
+               out_webp=None, optimize_gif=False, gif_max_bytes=None):
+    self.writers = []
+    if out_gif is not None:
+      self.writers.append(OptimizedGifWriter(out_gif, fps) if optimize_gif else GifWriter(out_gif, fps))
+    if out_mp4 is not None:
+      self.writers.append(Mp4Writer(out_mp4, fps))
+    if out_webp is not None:
+      self.writers.append(WebpWriter(out_webp, fps))
+    self.out_gif = out_gif
+    self.fps = fps
+    self.gif_max_bytes = gif_max_bytes if optimize_gif else None
+    self.frames_dir = frames_dir
+    self.file_format = file_format
+    self.first_index = first_index
+    self.frames = 0
+
+  def append(self, frame, name=None):
+    check_memory()
+    frame = np.ascontiguousarray(frame[:, :, :3])
+    for writer in self.writers:
+      writer.append(frame)
+    if self.frames_dir is not None:
+      fname = frame_filename(self.first_index + self.frames, name, self.file_format)
+      Image.fromarray(frame).save(os.path.join(self.frames_dir, fname))
+    self.frames += 1
+
+  def close(self):
+    for writer in self.writers:
+      writer.close()
+    if self.gif_max_bytes is not None and self.frames > 0:
+      fit_gif_budget(self.out_gif, self.gif_max_bytes, self.fps)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc, tb):
+    if exc_type is None:
+      self.close()
+      return
+    # a failed run leaves no partial animations behind
+    for writer in self.writers:
+      try:
+        getattr(writer, 'abort', writer.close)()
+      except Exception:
+        pass
+      if os.path.exists(writer.path):
+        os.remove(writer.path)
@@ -0,0 +1,118 @@
+import os
+import json
+import hashlib
+import tempfile
+import threading
+
+
+class FrameCache():
+  """Persistent, size-bounded cache for downloaded thumbnails.
+
+  Entries are content-addressed: the file name is a hash of everything that
+  determines the pixels (scene id, region, dimensions, bands, crs and the
+  stretch), so repeat and overlapping requests only download scenes that
+  are new. Least recently used entries are evicted once max_bytes is
+  exceeded; the size is tracked as entries are added and recounted from
+  disk every rescan_interval puts, to include other processes' entries.
+  """
+
+  # request params that determine the pixels of a scene, anything else (e.g. framesPerSecond) is left out of scene_key
+  pixel_params = ('region', 'dimensions', 'bands', 'crs', 'format', 'min', 'max', 'gamma', 'palette')
+  rescan_interval = 256
+
+  def __init__(self, path, max_bytes=2 * 1024 ** 3):
+    self.path = os.path.abspath(path)
+    self.max_bytes = max_bytes
+    self.lock = threading.Lock()
+    # bytes on disk, None until counted
+    self.total = None
+    self.puts = 0
+    if not os.path.exists(self.path):
+      os.makedirs(self.path)
+
+  def key(self, scene_id, **params):
+    payload = json.dumps({'scene': scene_id, **params}, sort_keys=True, default=self._serialize)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+  def scene_key(self, scene_id, params):
+    """Key of a scene's thumbnail or download request params."""
+    return self.key(scene_id, **{k: v for k, v in params.items() if k in self.pixel_params})
+
+  @staticmethod
+  def _serialize(value):
+    # ee objects (e.g. the aoi geometry in vis params) serialize to their expression graph
+    if hasattr(value, 'serialize'):
+      return value.serialize()
+    return repr(value)
+
+  def _file(self, key):
+    return os.path.join(self.path, key[:2], key + '.bin')
+
+  def get(self, key):
+    fname = self._file(key)
+    try:
+      with open(fname, 'rb') as f:
+        data = f.read()
+      # bump mtime so eviction sees this entry as recently used
+      os.utime(fname)
+    except FileNotFoundError:
+      return None
+    return data
+
+  def put(self, key, data):
+    fname = self._file(key)
+    folder = os.path.dirname(fname)
+    if not os.path.exists(folder):
+      os.makedirs(folder, exist_ok=True)
+    # write to a temp file in the same folder and rename, so readers never see partial frames
+    fd, tmp = tempfile.mkstemp(dir=folder, suffix='.tmp')
+    try:
+      replaced = os.path.getsize(fname)
+    except FileNotFoundError:
+      replaced = 0
+    try:
+      with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+      os.replace(tmp, fname)
+    except BaseException:
+      if os.path.exists(tmp):
+        os.remove(tmp)
+      raise
+    with self.lock:
+      self.puts += 1
+      if self.total is not None and self.puts % self.rescan_interval != 0:
+        self.total += len(data) - replaced
+        if self.total <= self.max_bytes:
+          return
+    self.evict()
+
+  def size(self):
+    return sum(size for _, size, _ in self._entries())
+
+  def _entries(self):
+    for root, _, files in os.walk(self.path):
+      for f in files:
+        if not f.endswith('.bin'):
+          continue
+        fname = os.path.join(root, f)
+        try:
+          stat = os.stat(fname)
+        except FileNotFoundError:
+          continue
+        yield fname, stat.st_size, stat.st_mtime
+
+  def evict(self):
+    """Count the entries on disk and remove the least recently used ones above max_bytes."""
+    with self.lock:
+      entries = list(self._entries())
+      total = sum(size for _, size, _ in entries)
+      if total > self.max_bytes:
+        for fname, size, _ in sorted(entries, key=lambda e: e[2]):
+          try:
+            os.remove(fname)
+          except FileNotFoundError:
+            pass
+          total -= size
+          if total <= self.max_bytes:
+            break
+      self.total = total
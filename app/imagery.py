@@ -1,8 +1,26 @@
 import os
 import ee
 import glob
+import json
+import fcntl
+import shutil
+import datetime
+import tempfile
+from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
 from geemap import cartoee
-from imagery_utils import new_get_image_collection_gif
+from imagery_utils import new_get_image_collection_gif, prefetch_metadata, encode_frame_files, fetch_band_array, render_frame, FrameRenderer
+from encoders import frame_filename, FrameEncoder
+from datacube import SceneCube
+from change_detection import detect_changes, scene_tracks, TRACK_PROPERTIES
+from aoi_stats import aoi_statistics
+from metrics import RenderMetrics, REGISTRY
+from limits import check_memory
+from raster import BandStretch
+from frame_cache import FrameCache
+from progress import JobProgress
+from output_store import OutputStore
+from aoi_grid import aoi_buffer, aoi_bounds, frame_shape, dimensions, grid_interval
 
 class Imagery():
 
@@ -19,16 +37,64 @@ class Imagery():
       "va": "center"
       }
 
+  scale_bar_dict1 = {
+      "length": 1,
+      "xy": (0.1, 0.05),
+      "linewidth": 3,
+      "fontsize": 20,
+      "color": "black",
+      "unit": "km",
+      "ha": "center",
+      "va": "bottom"
+      }
+
+  # upper bound for the thumbnail cache shared by all pois
+  cache_max_bytes = 2 * 1024 ** 3
+  # gifs are written with a shared palette and only the changed pixels per frame,
+  # and scaled down if they end up larger than this (None: no limit)
+  gif_max_bytes = None
+  # animations that can be written next to the gif
+  extra_formats = ('webp', 'mp4')
+  # upper bound for the published products of all pois, see output_store.OutputStore
+  store_max_bytes = 5 * 1024 ** 3
+  # frames are plotted with enough dpi to show the aoi's pixels, up to this
+  max_plot_dpi = 200
+
   def __init__(self):
     cartoee.get_image_collection_gif = new_get_image_collection_gif
-    self.poi = None    
+    self.poi = None
+    self.cache = None
+    self.metadata = None
+    self.metrics = None
+    self.stretch = None
+    self.cube = None
+    self.progress = None
+    self.formats = ()
+    # draw scale_bar_dict1 on the frames
+    self.scale_bar = False
+    self.store = None
+    self.product = None
 
-  def set_poi(self, poi, outpath):
+  def set_poi(self, poi, outpath, run_id=None):
     self.poi = poi
+    self.data_path = outpath
     base_path = os.path.join(outpath, 'BaseTimeseries', self.poi['name'])
+    self.poi_path = base_path
     if not os.path.exists(base_path):
-      os.makedirs(base_path) 
+      os.makedirs(base_path)
+    # separate folder per run so concurrent requests for one poi don't share files,
+    # without a run_id a temporary one that discard_run removes again
+    self.temporary_run = run_id is None
+    if run_id is None:
+      base_path = tempfile.mkdtemp(dir=base_path, prefix='run-')
+    else:
+      base_path = os.path.join(base_path, run_id)
+      os.makedirs(base_path, exist_ok=True)
     self.outpath = base_path
+    self.cache = FrameCache(os.path.join(outpath, 'FrameCache'), self.cache_max_bytes)
+    self.store = OutputStore(os.path.join(outpath, 'Products'), self.store_max_bytes)
+    self.product = None
+    self.cube = None
 
   def get_collection(self):
     collection = ee.ImageCollection('COPERNICUS/S1_GRD')
@@ -44,72 +110,431 @@ class Imagery():
     latitude = self.poi['lat']
     longitude = self.poi['lon']
     base_point = ee.Geometry.Point([float(longitude), float(latitude)])
-    base_buffer = base_point.buffer(3000)
+    # the poi's 'buffer' in metres, 3 km by default
+    base_buffer = base_point.buffer(aoi_buffer(self.poi))
     return base_buffer.bounds()
 
+  def aoi_bounds(self):
+    """[west, south, east, north] of generate_base_aoi, computed locally."""
+    return aoi_bounds(self.poi)
+
+  def frame_shape(self):
+    """(height, width) of the downloads: the aoi in native 10 m Sentinel-1 pixels, coarser for very large aois."""
+    return frame_shape(self.aoi_bounds())
+
   def get_filtered_col(self, col, base_name):
     base_aoi = self.generate_base_aoi()
     filtered_col = col.filterBounds(base_aoi)
     clipped_col = filtered_col.map(lambda image: image.clip(base_aoi))
     return clipped_col
 
-  def cleanup_poi_data(self):
-    files = glob.glob(f'{self.outpath}/*')
-    for f in files:
-      os.remove(f)
+  def gif_path(self):
+    """The published gif once the run is in the output store, before that the one in the run folder."""
+    return os.path.join(self.product or self.outpath, self.poi['name'] + ".gif")
 
-  def generate_timeseries_gif(self, max_frames):
+  def output_paths(self):
+    """{format: path} of the animations of the last run that exist."""
+    paths = {f: self.gif_path()[:-len('gif')] + f for f in ('gif',) + self.formats}
+    return {f: p for f, p in paths.items() if os.path.exists(p)}
 
-    # cleanup
-    self.cleanup_poi_data()
-    
-    # filter
-    col_final_recent = self.col_final.filterDate(self.poi['start_date'], self.poi['end_date']) 
-    col_filtered = self.get_filtered_col(col_final_recent, self.poi['name']).sort("system:time_start")
-    
-    # base aoi
-    aoi = self.generate_base_aoi()
-    minmax = col_filtered.first().reduceRegion(ee.Reducer.minMax(), aoi)
-    maxVV = minmax.getNumber("VV_max").getInfo()
-    minVV = minmax.getNumber("VV_min").getInfo()
-    maxVH = minmax.getNumber("VH_max").getInfo()
-    minVH = minmax.getNumber("VH_min").getInfo()
-    maxVH_VV = minmax.getNumber("VH-VV_max").getInfo()
-    minVH_VV = minmax.getNumber("VH-VV_min").getInfo()
-    w = 0.4
-    h = 0.4
-    region = [self.poi['lon']+w, self.poi['lat']-h, self.poi['lon']-w, self.poi['lat']+h]
-    
-    # out file stuff
-    filename = self.poi['name']+".gif"
-    out_gif = os.path.join(self.outpath, filename)
-    
-    # some gif params
+  def product_key(self, **params):
+    """Output store key of the poi, its date range, the formats and params."""
+    return OutputStore.key(self.poi, formats=sorted(self.formats), gif_max_bytes=self.gif_max_bytes, scale_bar=self.scale_bar, **params)
+
+  def find_product(self, key):
+    """Serve an earlier run's product, only for date ranges that ended before today (later scenes could still be added)."""
+    if self.poi['end_date'] >= datetime.date.today().isoformat():
+      return None
+    self.product = self.store.get(self.poi, key)
+    return self.product
+
+  def publish(self, key, **params):
+    """Move the run's animations into the output store, gif_path and output_paths point there afterwards."""
+    self.product = self.store.publish(self.poi, key, list(self.output_paths().values()), params=params)
+    return self.product
+
+  def discard_run(self):
+    """Remove a temporary run folder (set_poi without run_id), its products are in the store by now."""
+    if self.temporary_run:
+      shutil.rmtree(self.outpath, ignore_errors=True)
+
+  def filtered_timeseries(self):
+    col_final_recent = self.col_final.filterDate(self.poi['start_date'], self.poi['end_date'])
+    return self.get_filtered_col(col_final_recent, self.poi['name']).sort("system:time_start")
+
+  def vis_params(self, minmax):
+    # region as bounds, so large aois are fetched as tiles (see aoi_grid.fetch_tiled)
     visParams = {
     'bands': ['VV', 'VH', 'VH-VV'],
-    'min': [minVV, minVH, minVH_VV],
-    'max': [maxVV, maxVH, maxVH_VV],
-    'dimensions': 500,
+    'dimensions': dimensions(self.frame_shape()),
     'framesPerSecond': 2,
-    'region': aoi,
+    'region': self.aoi_bounds(),
     'crs': "EPSG:4326"}
+    # without a server-side stretch the raw values are stretched locally
+    if minmax is not None:
+      visParams['min'] = [minmax["VV_min"], minmax["VH_min"], minmax["VH-VV_min"]]
+      visParams['max'] = [minmax["VV_max"], minmax["VH_max"], minmax["VH-VV_max"]]
+    return visParams
+
+  def plot_region(self):
+    west, south, east, north = self.aoi_bounds()
+    return [east, south, west, north]
+
+  def plot_args(self):
+    """Gridlines and dpi to suit the aoi's extent and resolution."""
+    # the axes take about 8 of the 10 inch figure
+    dpi = int(min(self.max_plot_dpi, max(100, self.frame_shape()[1] / 8)))
+    args = {'grid_interval': grid_interval(self.aoi_bounds()), 'dpi_plot': dpi, 'north_arrow_dict': self.north_arrow_dict1}
+    if self.scale_bar:
+      args['scale_bar_dict'] = self.scale_bar_dict1
+    return args
+
+  def generate_timeseries_gif(self, max_frames, workers=1, incremental=False, decimation='auto', stretch=None, formats=()):
+    # webp / mp4 versions written next to the gif
+    self.formats = tuple(f for f in formats if f in self.extra_formats)
+    # timings of this request, exported to data/metrics when done
+    self.metrics = RenderMetrics(request_id=os.path.basename(self.outpath), poi=self.poi['name'])
+    # frame progress and a preview, read by the web app while the job runs
+    self.progress = JobProgress(self.outpath)
+    # incremental updates render every scene on its own with the stretch of the first run, see update_timeseries_gif
+    params = {'max_frames': max_frames, 'incremental': incremental, 'decimation': None if incremental else decimation,
+      'stretch': stretch.to_dict() if isinstance(stretch, BandStretch) else stretch}
+    key = self.product_key(**params)
+    self.product = None
+    err = True
+    try:
+      if incremental and stretch is not None:
+        (err, msg) = (True, 'A custom contrast stretch can not be combined with reusing frames from earlier runs. Please choose one of them!')
+      elif self.find_product(key) is not None:
+        (err, msg) = (False, None)
+      else:
+        if incremental:
+          (err, msg) = self.update_timeseries_gif(max_frames, workers)
+        else:
+          (err, msg) = self.render_timeseries_gif(max_frames, workers, decimation, stretch)
+        if not err:
+          self.publish(key, **params)
+    finally:
+      self.progress.stage('failed' if err else 'done')
+      self.metrics.finish(error=err)
+      REGISTRY.write_prometheus(os.path.join(self.data_path, 'metrics'))
+    return (err, msg)
+
+  def report_stage(self, name):
+    if self.progress is not None:
+      self.progress.stage(name)
+
+  def render_timeseries_gif(self, max_frames, workers=1, decimation='auto', stretch=None):
+    """Render the gif for the poi's date range.
+    stretch is a BandStretch (or its to_dict()) to download the raw VV/VH values once and stretch them locally.
+    Those downloads are cached independent of the stretch, so rendering again with another stretch or band
+    composite only costs the metadata round-trip. The fitted stretch is kept in self.stretch.
+    """
+    if isinstance(stretch, dict):
+      stretch = BandStretch.from_dict(stretch)
+    self.stretch = stretch
+    self.report_stage('metadata')
+
+    # filter
+    col_filtered = self.filtered_timeseries()
+
+    # scene list, dates and (for the poi's first run) the stretch in one round-trip
+    minmax = self.load_poi_stretch() if stretch is None else None
+    stretch_region = self.generate_base_aoi() if stretch is None and minmax is None else None
+    self.metadata = prefetch_metadata(col_filtered, stretch_region=stretch_region, date_format='YYYY-MM-dd', metrics=self.metrics)
+    if self.metadata['count'] == 0:
+      return (True, 'No Sentinel-1 scenes found for this location and time span. Please choose a longer period!')
+    if minmax is not None:
+      self.metadata['minmax'] = minmax
+    elif stretch_region is not None:
+      self.save_poi_stretch(self.metadata['minmax'])
 
     # get all images and create gif
     return cartoee.get_image_collection_gif(
       ee_ic = col_filtered,
       out_dir = self.outpath,
       out_gif = self.poi['name'] + ".gif",
-      vis_params = visParams,
-      region = region,
+      vis_params = self.vis_params(self.metadata.get('minmax')),
+      region = self.plot_region(),
       fps = 2,
-      mp4 = False,
-      grid_interval = (0.2, 0.2),
+      mp4 = 'mp4' in self.formats,
+      webp = 'webp' in self.formats,
+      optimize_gif = True,
+      gif_max_bytes = self.gif_max_bytes,
       plot_title = self.poi['name'],
       date_format = 'YYYY-MM-dd',
       fig_size = (10, 10),
-      dpi_plot = 100,
       file_format = "png",
-      north_arrow_dict = self.north_arrow_dict1,
       verbose = True,
-      max_frames = max_frames
-    )
\ No newline at end of file
+      max_frames = max_frames,
+      workers = workers,
+      cache = self.cache,
+      metrics = self.metrics,
+      metadata = self.metadata,
+      decimation = decimation,
+      stretch = stretch,
+      on_bands = self.store_scene if stretch is not None else None,
+      on_progress = self.progress.frame if self.progress is not None else None,
+      **self.plot_args()
+    )
+
+  def grid(self):
+    """Where the poi's pixels come from, stored with everything that is only valid for them."""
+    return {'lat': float(self.poi['lat']), 'lon': float(self.poi['lon']), 'buffer': aoi_buffer(self.poi), 'dimensions': dimensions(self.frame_shape()), 'crs': 'EPSG:4326'}
+
+  def load_poi_stretch(self):
+    """The server-side min/max stretch of the poi, fixed by its first run, or None.
+    Every date window renders a scene with the same vis params then, so overlapping and rolling windows hit the thumbnail cache.
+    """
+    try:
+      with open(os.path.join(self.poi_path, 'stretch.json')) as f:
+        saved = json.load(f)
+    except (OSError, ValueError):
+      return None
+    return saved['minmax'] if saved.get('grid') == self.grid() else None
+
+  def save_poi_stretch(self, minmax):
+    # concurrent first runs each write their own temp file, the last one wins
+    fd, tmp = tempfile.mkstemp(dir=self.poi_path, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+      json.dump({'grid': self.grid(), 'minmax': minmax}, f, indent=2)
+    os.replace(tmp, os.path.join(self.poi_path, 'stretch.json'))
+
+  def reset_poi_stretch(self):
+    """Forget the poi's saved min/max stretch, the next run fits it again on its first scene.
+    The poi's published products were rendered with the old one and are removed as well.
+    Returns:
+      bool: Whether there was a saved stretch.
+    """
+    try:
+      os.remove(os.path.join(self.poi_path, 'stretch.json'))
+      existed = True
+    except FileNotFoundError:
+      existed = False
+    self.store.remove(self.poi)
+    return existed
+
+  def open_cube(self):
+    """The poi's SceneCube of raw VV/VH values, under BaseTimeseries/<name>/cube."""
+    if self.cube is None:
+      self.cube = SceneCube(os.path.join(self.poi_path, 'cube'), bands=['VV', 'VH'], grid=self.grid())
+    return self.cube
+
+  def store_scene(self, scene_id, date, time_start, bands):
+    cube = self.open_cube()
+    if all(b in bands for b in cube.bands):
+      cube.append(scene_id, bands, date, time_start)
+
+  def update_cube(self, workers=4, max_scenes=None):
+    """Download the raw values of the scenes in the date range that are not in the cube yet.
+    Every scene is stored with its track (orbit direction and relative orbit), see change_detection.scene_tracks.
+    Args:
+      workers (int, optional): Parallel downloads. Defaults to 4.
+      max_scenes (int, optional): With more scenes in the date range, only evenly spaced ones are downloaded. Defaults to None (all).
+    Returns:
+      int: The number of scenes added.
+    """
+    cube = self.open_cube()
+    col_filtered = self.filtered_timeseries()
+    metadata = prefetch_metadata(col_filtered, date_format='YYYY-MM-dd', metrics=self.metrics, properties=TRACK_PROPERTIES)
+    images = col_filtered.toList(metadata['count'])
+    vis_params = self.vis_params(None)
+    tracks = scene_tracks(metadata)
+    # scenes stored while rendering have no track yet
+    untracked = {s['id'] for s in cube.scenes if 'track' not in s}
+    if untracked:
+      cube.set_meta({name: {'track': track} for name, track in zip(metadata['names'], tracks) if name in untracked})
+    picks = range(metadata['count'])
+    if max_scenes is not None and metadata['count'] > max_scenes:
+      picks = sorted(set(int(i * metadata['count'] / max_scenes) for i in range(max_scenes)))
+    missing = [i for i in picks if not cube.has(metadata['names'][i])]
+
+    def download(i):
+      check_memory()
+      bands = fetch_band_array(ee.Image(images.get(i)), cube.bands, vis_params, cache=self.cache, scene_id=metadata['names'][i])
+      cube.append(metadata['names'][i], bands, metadata['dates'][i], metadata['times'][i], track=tracks[i])
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+      list(pool.map(download, missing))
+    return len(missing)
+
+  def render_cube_gif(self, stretch=None, max_frames=None):
+    """Render the gif for the poi's date range from the cube alone, without any Earth Engine calls.
+    With more scenes than max_frames, evenly spaced scenes are used. Without a stretch the poi's min/max stretch
+    (see load_poi_stretch) is applied locally, so the frames look like those rendered by Earth Engine; for a poi
+    without one it is fitted on the first scene and saved. The extra formats of self.formats are written next to the gif.
+    """
+    cube = self.open_cube()
+    fit_poi_stretch = False
+    if stretch is None:
+      minmax = self.load_poi_stretch()
+      fit_poi_stretch = minmax is None
+      stretch = BandStretch() if fit_poi_stretch else BandStretch.from_minmax(minmax)
+    stretch = BandStretch.from_dict(stretch) if isinstance(stretch, dict) else stretch
+    scenes = cube.select(self.poi['start_date'], self.poi['end_date'])
+    if len(scenes) == 0:
+      return (True, 'No stored scenes for this location and time span.')
+    if max_frames is not None and len(scenes) > max_frames:
+      scenes = [scenes[i] for i in sorted(set(int(i * len(scenes) / max_frames) for i in range(max_frames)))]
+    base = self.gif_path()[:-len('gif')]
+    with FrameEncoder(out_gif=self.gif_path(), out_mp4=base + 'mp4' if 'mp4' in self.formats else None,
+        out_webp=base + 'webp' if 'webp' in self.formats else None, fps=2, optimize_gif=True, gif_max_bytes=self.gif_max_bytes) as encoder:
+      for scene in scenes:
+        bands = cube.read_bands(scene)
+        frame = render_frame(stretch.apply(bands), self.plot_region(), title=f"{self.poi['name']} {scene['date']}", **self.plot_args())
+        encoder.append(frame, scene['id'])
+    if fit_poi_stretch:
+      self.save_poi_stretch(stretch.to_minmax())
+    self.stretch = stretch
+    return (False, None)
+
+  def changes_path(self):
+    return os.path.join(self.outpath, self.poi['name'] + "_changes.png")
+
+  def detect_changes(self, threshold=3.0, top=5, workers=4, max_scenes=None):
+    """Compare consecutive scenes of each track in the poi's date range and rank the dates by how much changed.
+    Missing scenes are downloaded into the cube first. The largest change per pixel is saved as a png next to the gif.
+    Args:
+      threshold (float, optional): Change in dB that counts a pixel as changed. Defaults to 3.0.
+      top (int, optional): How many dates to rank. Defaults to 5.
+      workers (int, optional): Parallel downloads for update_cube. Defaults to 4.
+      max_scenes (int, optional): Download at most this many evenly spaced scenes, see update_cube. Defaults to None (all).
+    Returns:
+      dict: The report of change_detection.detect_changes with the map path instead of the array, or None with fewer than two scenes.
+    """
+    self.update_cube(workers, max_scenes)
+    report = detect_changes(self.open_cube(), self.poi['start_date'], self.poi['end_date'], threshold=threshold, top=top)
+    if report is None:
+      return None
+    renderer = FrameRenderer(self.plot_region(), cmap='magma', **self.plot_args())
+    try:
+      frame = renderer.render(report.pop('max_change'), title=f"{self.poi['name']} largest change (dB)")
+    finally:
+      renderer.close()
+    Image.fromarray(frame).save(self.changes_path())
+    report['map'] = self.changes_path()
+    with open(os.path.join(self.outpath, 'changes.json'), 'w') as f:
+      json.dump(report, f, indent=2)
+    return report
+
+  def aoi_statistics(self):
+    """Mean, median and percentile backscatter per scene over the poi's aoi in one round-trip, see aoi_stats."""
+    return aoi_statistics(self.col_final, [self.poi], self.poi['start_date'], self.poi['end_date'], cache=self.cache, metrics=self.metrics)
+
+  def load_manifest(self, product_path):
+    manifest_path = os.path.join(product_path, 'manifest.json')
+    if not os.path.exists(manifest_path):
+      return None
+    with open(manifest_path) as f:
+      manifest = json.load(f)
+    # a different location, aoi size or an earlier start needs a full rebuild
+    if manifest['lat'] != float(self.poi['lat']) or manifest['lon'] != float(self.poi['lon']):
+      return None
+    if manifest.get('buffer') != aoi_buffer(self.poi) or manifest.get('dimensions') != dimensions(self.frame_shape()):
+      return None
+    if self.poi['start_date'] < manifest['start_date']:
+      return None
+    return manifest
+
+  def save_manifest(self, product_path, manifest):
+    manifest_path = os.path.join(product_path, 'manifest.json')
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+      json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+  def update_timeseries_gif(self, max_frames, workers=1):
+    """Render only the scenes newer than the last run for this poi, then rebuild the gif from all frames in the date range.
+    The rendered scenes and the stretch are kept in BaseTimeseries/<name>/incremental/manifest.json.
+    Frames are never decimated, date ranges with more than max_frames scenes are refused before anything is downloaded.
+    """
+    product_path = os.path.join(self.poi_path, 'incremental')
+    frames_path = os.path.join(product_path, 'frames')
+    if not os.path.exists(frames_path):
+      os.makedirs(frames_path)
+
+    # one update per poi at a time
+    with open(os.path.join(product_path, '.lock'), 'w') as lock:
+      fcntl.flock(lock, fcntl.LOCK_EX)
+
+      self.report_stage('metadata')
+      col_filtered = self.filtered_timeseries()
+      aoi = self.generate_base_aoi()
+      manifest = self.load_manifest(product_path)
+
+      if manifest is None:
+        for f in glob.glob(f'{frames_path}/*'):
+          os.remove(f)
+        self.metadata = prefetch_metadata(col_filtered, stretch_region=aoi, date_format='YYYY-MM-dd', metrics=self.metrics)
+        if self.metadata['count'] == 0:
+          return (True, 'No Sentinel-1 scenes found for this location and time span. Please choose a longer period!')
+        manifest = {
+          'lat': float(self.poi['lat']),
+          'lon': float(self.poi['lon']),
+          'buffer': aoi_buffer(self.poi),
+          'dimensions': dimensions(self.frame_shape()),
+          'start_date': self.poi['start_date'],
+          'stretch': self.metadata['minmax'],
+          'scenes': []
+        }
+      else:
+        # keep the stretch of the earlier frames and only ask for newer scenes
+        if len(manifest['scenes']) > 0:
+          col_filtered = col_filtered.filter(ee.Filter.gt('system:time_start', manifest['scenes'][-1]['time_start']))
+        self.metadata = prefetch_metadata(col_filtered, date_format='YYYY-MM-dd', metrics=self.metrics)
+
+      # drop frames that fell out of the rolling window
+      for scene in [s for s in manifest['scenes'] if s['date'] < self.poi['start_date']]:
+        frame = os.path.join(frames_path, scene['frame'])
+        if os.path.exists(frame):
+          os.remove(frame)
+      manifest['scenes'] = [s for s in manifest['scenes'] if s['date'] >= self.poi['start_date']]
+      manifest['start_date'] = self.poi['start_date']
+
+      kept = len([s for s in manifest['scenes'] if s['date'] < self.poi['end_date']])
+      if kept + self.metadata['count'] > max_frames:
+        self.save_manifest(product_path, manifest)
+        return (True, f'The time span is too long. We would need to process {kept + self.metadata["count"]} single frames. Please choose a shorter period!')
+
+      if self.metadata['count'] > 0:
+        first_frame = max([int(s['frame'].split('_')[0]) for s in manifest['scenes']] + [-1]) + 1
+        (err, msg) = cartoee.get_image_collection_gif(
+          ee_ic = col_filtered,
+          out_dir = frames_path,
+          out_gif = None,
+          vis_params = self.vis_params(manifest['stretch']),
+          region = self.plot_region(),
+          plot_title = self.poi['name'],
+          date_format = 'YYYY-MM-dd',
+          fig_size = (10, 10),
+          file_format = "png",
+          verbose = True,
+          max_frames = max_frames,
+          workers = workers,
+          cache = self.cache,
+          metrics = self.metrics,
+          metadata = self.metadata,
+          save_frames = True,
+          first_frame = first_frame,
+          on_progress = self.progress.frame if self.progress is not None else None,
+          **self.plot_args()
+        )
+        if err:
+          return (err, msg)
+        for i, name in enumerate(self.metadata['names']):
+          manifest['scenes'].append({
+            'id': name,
+            'date': self.metadata['dates'][i],
+            'time_start': self.metadata['times'][i],
+            'frame': frame_filename(first_frame + i, name)
+          })
+      self.save_manifest(product_path, manifest)
+
+      frames = [s['frame'] for s in manifest['scenes'] if s['date'] < self.poi['end_date']]
+      if len(frames) == 0:
+        return (True, 'No Sentinel-1 scenes found for this location and time span. Please choose a longer period!')
+      self.report_stage('encoding')
+      with self.metrics.stage('encode'):
+        encode_frame_files([os.path.join(frames_path, f) for f in frames], self.gif_path(), fps=2, mp4='mp4' in self.formats,
+          webp='webp' in self.formats, optimize_gif=True, gif_max_bytes=self.gif_max_bytes)
+    return (False, None)
\ No newline at end of file
@@ -1,9 +1,530 @@
 import os
-import subprocess
+import math
+import time
+import calendar
+import datetime
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from io import BytesIO
 import ee
-from geemap import png_to_gif
-import matplotlib.pyplot as plt
-from geemap.cartoee import get_map, add_gridlines, add_scale_bar_lite, add_north_arrow
+import numpy as np
+from PIL import Image
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import cartopy.crs as ccrs
+from geemap.cartoee import add_gridlines, add_scale_bar_lite, add_north_arrow
+from encoders import FrameEncoder
+from ee_client import get_client
+from metrics import optional_stage
+from limits import render_slots, check_memory
+from raster import structured_to_bands, source_bands
+from aoi_grid import fetch_tiled
+
+# the last FrameRenderer of each thread, reused while the plot settings stay the same
+_renderers = threading.local()
+# called in every render process of render_frames before its first frame, e.g. by the benchmarks to install fake_ee
+render_initializer = None
+
+
+def prefetch_metadata(ee_ic, stretch_region=None, date_format="YYYY-MM-dd", metrics=None, client=None, properties=()):
+    """Fetch everything the renderer needs to know about a collection in a single getInfo() call.
+    Args:
+        ee_ic (object): ee.ImageCollection
+        stretch_region (object, optional): ee.Geometry to compute the min/max stretch of the first image over. Defaults to None.
+        date_format (str, optional): A pattern, as described at http://joda-time.sourceforge.net/apidocs/org/joda/time/format/DateTimeFormat.html. Defaults to "YYYY-MM-dd".
+        metrics (RenderMetrics, optional): Records the 'ee_metadata' stage. Defaults to None.
+        client (EEClient, optional): Runs the getInfo() call. Defaults to the process-wide client.
+        properties (tuple, optional): More image properties to fetch per scene, every image needs them. Defaults to ().
+    Returns:
+        dict: 'count', 'names' (system:index), 'dates' (formatted system:time_start), 'times' (system:time_start in ms),
+        'minmax' (<band>_min / <band>_max, only with a stretch_region), a list per extra property and
+        'round_trips_saved' compared to fetching each value separately.
+    """
+    count = ee_ic.size()
+    info = {
+        "count": count,
+        "names": ee_ic.aggregate_array("system:index"),
+        "dates": ee_ic.aggregate_array("system:time_start").map(lambda d: ee.Date(d).format(date_format)),
+        "times": ee_ic.aggregate_array("system:time_start"),
+    }
+    for prop in properties:
+        info[prop] = ee_ic.aggregate_array(prop)
+    if stretch_region is not None:
+        # an empty collection has no first image to reduce
+        info["minmax"] = ee.Algorithms.If(
+            count.gt(0),
+            ee_ic.first().reduceRegion(ee.Reducer.minMax(), stretch_region),
+            ee.Dictionary({}),
+        )
+
+    client = client or get_client()
+    with optional_stage(metrics, "ee_metadata"):
+        metadata = client.run(client.evaluate(ee.Dictionary(info)))
+    if metrics is not None:
+        metrics.add("ee_round_trips")
+    metadata["count"] = int(metadata["count"])
+    # size, index list, date list and one list per extra property, plus one getNumber() per stretch value
+    separate = 3 + len(properties) + len(metadata.get("minmax", {}))
+    metadata["round_trips_saved"] = separate - 1
+    return metadata
+
+
+# labels used in frame titles and messages
+DECIMATION_LABELS = {
+    "sample": "evenly sampled scenes",
+    "weekly": "weekly median",
+    "monthly": "monthly median",
+}
+
+
+def choose_decimation(metadata, max_frames, strategy="auto"):
+    """Pick how to fit a collection into max_frames frames.
+    Args:
+        metadata (dict): Result of prefetch_metadata.
+        max_frames (int): The frame budget.
+        strategy (str, optional): 'auto', 'sample', 'weekly' or 'monthly'. 'auto' takes the shortest composite
+            period whose number of periods fits, and falls back to sampling. Defaults to "auto".
+    Returns:
+        str: The strategy, or None when the collection already fits.
+    """
+    if metadata["count"] <= max_frames:
+        return None
+    if strategy != "auto":
+        return strategy
+    days = (max(metadata["times"]) - min(metadata["times"])) / 86400000
+    if math.floor(days / 7) + 1 <= max_frames:
+        return "weekly"
+    if math.floor(days / 30.4) + 2 <= max_frames:
+        return "monthly"
+    return "sample"
+
+
+def _add_months(date, months):
+    month = date.month - 1 + months
+    year = date.year + month // 12
+    month = month % 12 + 1
+    return date.replace(year=year, month=month, day=min(date.day, calendar.monthrange(year, month)[1]))
+
+
+def composite_span(metadata, max_frames, strategy):
+    """Weeks or months per composite, so that 'weekly' / 'monthly' never need more than max_frames periods.
+    1 unless the strategy was chosen explicitly for a span that is too long for it.
+    """
+    first = min(metadata["times"])
+    last = max(metadata["times"]) + 1
+    if strategy == "weekly":
+        periods = math.ceil((last - first) / (7 * 86400000))
+    else:
+        start = datetime.datetime.fromtimestamp(first / 1000, datetime.timezone.utc)
+        end = datetime.datetime.fromtimestamp(last / 1000, datetime.timezone.utc)
+        periods = 1
+        while _add_months(start, periods) < end:
+            periods += 1
+    return max(1, math.ceil(periods / max_frames))
+
+
+def decimation_label(strategy, span=1):
+    if span == 1:
+        return DECIMATION_LABELS[strategy]
+    return f"{span}-{'week' if strategy == 'weekly' else 'month'} median"
+
+
+def decimate_collection(ee_ic, metadata, max_frames, strategy, span=None):
+    """Reduce a collection to at most max_frames images on the server.
+    'sample' keeps evenly spaced scenes, 'weekly' / 'monthly' replace the scenes with one median composite per
+    period (periods without scenes are left out). Periods are widened to several weeks / months when the span
+    has more periods than max_frames, see composite_span. Composites get the period start as system:time_start,
+    the number of scenes in the 'scenes' property and a system:index made of the strategy, the period start, the
+    date of the last scene in it and the number of scenes, e.g. 'W1_20211201_20211206_3', so that the same
+    period of different strategies, spans or a partial last period never share a frame cache entry.
+    Args:
+        ee_ic (object): ee.ImageCollection, sorted by system:time_start.
+        metadata (dict): Result of prefetch_metadata for ee_ic.
+        max_frames (int): The frame budget.
+        strategy (str): 'sample', 'weekly' or 'monthly'.
+        span (int, optional): Weeks / months per composite. Defaults to composite_span().
+    Returns:
+        object: ee.ImageCollection
+    """
+    count = metadata["count"]
+    if strategy == "sample":
+        images = ee_ic.toList(count)
+        picks = sorted(set(int(i * count / max_frames) for i in range(max_frames)))
+        return ee.ImageCollection.fromImages(ee.List([images.get(i) for i in picks]))
+
+    if strategy not in ("weekly", "monthly"):
+        raise ValueError(f"Unknown decimation strategy: {strategy}")
+    span = span or composite_span(metadata, max_frames, strategy)
+    unit = "week" if strategy == "weekly" else "month"
+    prefix = f"{unit[0].upper()}{span}_"
+    start = ee.Date(min(metadata["times"]))
+    end = ee.Date(max(metadata["times"]) + 1)
+    periods = ee.List.sequence(0, end.difference(start, unit).divide(span).ceil().subtract(1))
+
+    def composite(i):
+        period_start = start.advance(ee.Number(i).multiply(span), unit)
+        scenes = ee_ic.filterDate(period_start, period_start.advance(span, unit))
+        last_scene = ee.Date(scenes.aggregate_max("system:time_start"))
+        return scenes.median().set(
+            "system:time_start", period_start.millis(),
+            "system:index", ee.String(prefix).cat(period_start.format("YYYYMMdd"))
+                .cat("_").cat(last_scene.format("YYYYMMdd"))
+                .cat("_").cat(scenes.size().format()),
+            "scenes", scenes.size(),
+        )
+
+    composites = ee.ImageCollection.fromImages(periods.map(composite))
+    return composites.filter(ee.Filter.gt("scenes", 0)).limit(max_frames, "system:time_start")
+
+
+def fetch_thumbnail(image, vis_params, region, dims=1000, cache=None, scene_id=None, metrics=None, frame=None, client=None, tile_workers=4):
+    """Download the rendered thumbnail of an ee.Image as a numpy array.
+    This mirrors what geemap.cartoee.get_map does before plotting, without touching matplotlib, so it can run in a thread.
+    With vis_params['region'] as [W,S,E,N] and vis_params['dimensions'] as 'WIDTHxHEIGHT', thumbnails larger than
+    aoi_grid.TILE_SIZE are fetched as tiles in parallel and mosaicked locally, see aoi_grid.fetch_tiled.
+    Args:
+        image (object): ee.Image
+        vis_params (dict): Visualization parameters as a dictionary.
+        region (list | tuple): Geospatial region of the image to render in format [E,S,W,N].
+        dims (int, optional): Thumbnail dimensions, overridden by vis_params['dimensions']. Defaults to 1000.
+        cache (FrameCache, optional): Cache to read the thumbnail from and store it in. Defaults to None.
+        scene_id (str, optional): The image's system:index, required to use the cache. Defaults to None.
+        metrics (RenderMetrics, optional): Records the 'ee_thumb_url' and 'download' stages. Defaults to None.
+        frame (int, optional): Frame index the timings are recorded for. Defaults to None.
+        client (EEClient, optional): Runs the url request and the download. Defaults to the process-wide client.
+        tile_workers (int, optional): Parallel tile downloads. Defaults to 4.
+    Returns:
+        numpy.ndarray: The thumbnail pixels.
+    """
+    xs = sorted([region[0], region[2]])
+    ys = sorted([region[1], region[3]])
+    args = {
+        "format": "png",
+        "region": [[[xs[0], ys[0]], [xs[1], ys[0]], [xs[1], ys[1]], [xs[0], ys[1]], [xs[0], ys[0]]]],
+        "dimensions": dims,
+    }
+    args.update(vis_params)
+    return fetch_tiled(lambda params: _thumbnail(image, params, cache, scene_id, metrics, frame, client), args, workers=tile_workers)
+
+
+def _thumbnail(image, args, cache, scene_id, metrics, frame, client):
+    key = None
+    content = None
+    if cache is not None and scene_id is not None:
+        key = cache.scene_key(scene_id, args)
+        content = cache.get(key)
+        if metrics is not None:
+            metrics.add("cache_misses" if content is None else "cache_hits")
+
+    if content is None:
+        client = client or get_client()
+        with optional_stage(metrics, "ee_thumb_url", frame):
+            url = client.run(client.call(image.getThumbUrl, args))
+        with optional_stage(metrics, "download", frame):
+            content = client.run(client.get(url))
+        if metrics is not None:
+            metrics.add("ee_round_trips")
+            metrics.add("thumbnail_bytes", len(content))
+        if key is not None:
+            cache.put(key, content)
+
+    thumbnail = np.array(Image.open(BytesIO(content)))
+    # grayscale + alpha thumbnails are expanded to rgb + alpha
+    if thumbnail.ndim == 3 and thumbnail.shape[-1] == 2:
+        thumbnail = np.concatenate([np.repeat(thumbnail[:, :, 0:1], 3, axis=2), thumbnail[:, :, -1:]], axis=2)
+    return thumbnail
+
+
+class FrameRenderer():
+    """Draws thumbnails onto one reusable cartopy figure.
+    The figure, GeoAxes, gridlines, north arrow and scale bar are built for the first frame only;
+    later frames just swap the image data and the title text before the canvas is redrawn.
+    The overlays sit on top of the image, so every frame is a full redraw of the existing artists
+    rather than a blit of the image alone. Does not use pyplot, so renderers in different threads are independent.
+    Args:
+        region (list | tuple): Geospatial region of the image to render in format [E,S,W,N].
+        See new_get_image_collection_gif for the remaining arguments.
+    """
+
+    def __init__(
+      self,
+      region,
+      cmap=None,
+      proj=None,
+      grid_interval=None,
+      fig_size=(10, 10),
+      dpi_plot=100,
+      north_arrow_dict={},
+      scale_bar_dict={}
+    ):
+        self.region = region
+        self.cmap = cmap
+        self.proj = proj if proj is not None else ccrs.PlateCarree()
+        self.grid_interval = grid_interval
+        self.north_arrow_dict = north_arrow_dict
+        self.scale_bar_dict = scale_bar_dict
+        self.fig = Figure(figsize=fig_size, dpi=dpi_plot)
+        self.canvas = FigureCanvasAgg(self.fig)
+        self.ax = self.fig.add_subplot(1, 1, 1, projection=self.proj)
+        self.image = None
+        self.title = None
+
+    def _imshow(self, thumbnail):
+        view_extent = (self.region[2], self.region[0], self.region[1], self.region[3])
+        return self.ax.imshow(
+            np.squeeze(thumbnail),
+            extent=view_extent,
+            origin="upper",
+            transform=ccrs.PlateCarree(),
+            zorder=1,
+            cmap=self.cmap,
+        )
+
+    def _add_overlays(self):
+        # Add grid
+        if self.grid_interval is not None:
+            add_gridlines(self.ax, interval=self.grid_interval, linestyle=":")
+        # Add scale bar
+        if len(self.scale_bar_dict) > 0:
+            add_scale_bar_lite(self.ax, **self.scale_bar_dict)
+        # Add north arrow
+        if len(self.north_arrow_dict) > 0:
+            add_north_arrow(self.ax, **self.north_arrow_dict)
+
+    def render(self, thumbnail, title="", timings=None):
+        """Plot a thumbnail and return the figure as an rgb array read from the canvas buffer.
+        Args:
+            thumbnail (numpy.ndarray): The pixels returned by fetch_thumbnail.
+            title (str, optional): Plot title. Defaults to "".
+            timings (dict, optional): Receives the seconds spent in 'plot' and 'rasterize'. Defaults to None.
+        Returns:
+            numpy.ndarray: (height, width, 3) uint8 frame.
+        """
+        start = time.perf_counter()
+        if self.image is None:
+            # first frame: the overlays need the extent set by the image
+            self.image = self._imshow(thumbnail)
+            self._add_overlays()
+        elif isinstance(self.proj, ccrs.PlateCarree):
+            self.image.set_data(np.squeeze(thumbnail))
+        else:
+            # cartopy regrids images shown in another projection, so the image artist has to be rebuilt
+            self.image.remove()
+            self.image = self._imshow(thumbnail)
+
+        # Add title
+        label = title + "\n" if len(title) > 0 else ""
+        if self.title is None:
+            self.title = self.ax.set_title(label=label, fontsize=15)
+        else:
+            self.title.set_text(label)
+
+        # Rasterize plot
+        drawn = time.perf_counter()
+        self.canvas.draw()
+        frame = np.asarray(self.canvas.buffer_rgba())[:, :, :3].copy()
+        if timings is not None:
+            timings["plot"] = drawn - start
+            timings["rasterize"] = time.perf_counter() - drawn
+        return frame
+
+    def close(self):
+        self.fig.clear()
+        self.image = None
+        self.title = None
+
+
+def fetch_band_array(image, bands, vis_params, cache=None, scene_id=None, metrics=None, frame=None, client=None, tile_workers=4):
+    """Download the raw values of an ee.Image's bands as float arrays, so they can be stretched locally.
+    Large regions are downloaded as tiles, as in fetch_thumbnail.
+    Args:
+        image (object): ee.Image
+        bands (list): The bands to download.
+        vis_params (dict): Only 'region', 'dimensions' and 'crs' are used.
+        cache (FrameCache, optional): Cache to read the arrays from and store them in. Defaults to None.
+        scene_id (str, optional): The image's system:index, required to use the cache. Defaults to None.
+        metrics (RenderMetrics, optional): Records the 'ee_download_url' and 'download' stages. Defaults to None.
+        frame (int, optional): Frame index the timings are recorded for. Defaults to None.
+        client (EEClient, optional): Runs the url request and the download. Defaults to the process-wide client.
+        tile_workers (int, optional): Parallel tile downloads. Defaults to 4.
+    Returns:
+        dict: {band: numpy.ndarray}
+    """
+    args = {"bands": list(bands), "format": "NPY"}
+    for param in ("region", "dimensions", "crs"):
+        if param in vis_params:
+            args[param] = vis_params[param]
+    return fetch_tiled(lambda params: _band_arrays(image, params, cache, scene_id, metrics, frame, client), args, workers=tile_workers)
+
+
+def _band_arrays(image, args, cache, scene_id, metrics, frame, client):
+    key = None
+    content = None
+    if cache is not None and scene_id is not None:
+        key = cache.scene_key(scene_id, args)
+        content = cache.get(key)
+        if metrics is not None:
+            metrics.add("cache_misses" if content is None else "cache_hits")
+
+    if content is None:
+        client = client or get_client()
+        with optional_stage(metrics, "ee_download_url", frame):
+            url = client.run(client.call(image.getDownloadURL, args))
+        with optional_stage(metrics, "download", frame):
+            content = client.run(client.get(url))
+        if metrics is not None:
+            metrics.add("ee_round_trips")
+            metrics.add("thumbnail_bytes", len(content))
+        if key is not None:
+            cache.put(key, content)
+
+    return structured_to_bands(np.load(BytesIO(content)))
+
+
+def render_frame(thumbnail, region, title="", timings=None, **plot_args):
+    """Render one frame with this thread's FrameRenderer, which is reused as long as region and plot_args stay the same.
+    Args:
+        thumbnail (numpy.ndarray): The pixels returned by fetch_thumbnail.
+        region (list | tuple): Geospatial region of the image to render in format [E,S,W,N].
+        title (str, optional): Plot title. Defaults to "".
+        timings (dict, optional): Receives the seconds spent in 'plot' and 'rasterize'. Defaults to None.
+        **plot_args: Passed on to FrameRenderer.
+    Returns:
+        numpy.ndarray: (height, width, 3) uint8 frame.
+    """
+    key = repr((list(region), sorted(plot_args.items())))
+    with render_slots:
+        if getattr(_renderers, "key", None) != key:
+            release_renderer()
+            _renderers.renderer = FrameRenderer(region, **plot_args)
+            _renderers.key = key
+        try:
+            return _renderers.renderer.render(thumbnail, title=title, timings=timings)
+        except BaseException:
+            # the figure may be half drawn, start over with the next frame
+            release_renderer()
+            raise
+
+
+def release_renderer():
+    """Close this thread's cached FrameRenderer and free its figure."""
+    if getattr(_renderers, "renderer", None) is not None:
+        _renderers.renderer.close()
+    _renderers.renderer = None
+    _renderers.key = None
+
+
+def _render_timed(thumbnail, region, **plot_args):
+    # picklable wrapper for the render processes, returns the frame and its timings
+    timings = {}
+    frame = render_frame(thumbnail, region, timings=timings, **plot_args)
+    return frame, timings
+
+
+def render_frames(
+  images,
+  titles,
+  vis_params,
+  region,
+  on_frame,
+  workers=1,
+  verbose=True,
+  cache=None,
+  scene_ids=None,
+  metrics=None,
+  fetch=None,
+  **plot_args
+):
+    """Download and render a list of images, handing each frame to on_frame in order.
+    With workers > 1 the downloads overlap on a thread pool and the plotting runs in a process pool,
+    where every process keeps its own FrameRenderer. At most 2 x workers frames are downloaded or rendered ahead
+    of the next one to deliver, so memory does not grow with the number of frames. on_frame is always called in
+    index order from the calling thread, as soon as the frame is ready.
+    Args:
+        images (list): ee.Image objects (anything with getThumbUrl).
+        titles (list): Plot title for each image.
+        vis_params (dict): Visualization parameters as a dictionary.
+        region (list | tuple): Geospatial region of the image to render in format [E,S,W,N].
+        on_frame (callable): Called as on_frame(index, frame) with the rgb array of each rendered frame.
+        workers (int, optional): Number of download threads and render processes. Defaults to 1.
+        verbose (bool, optional): Whether or not to print text when the program is running. Defaults to True.
+        cache (FrameCache, optional): Thumbnail cache shared between requests. Defaults to None.
+        scene_ids (list, optional): system:index of each image, used as part of the cache key. Defaults to None.
+        metrics (RenderMetrics, optional): Records per-frame download, plot, rasterize and encode timings. Defaults to None.
+        fetch (callable, optional): Replaces fetch_thumbnail, called as fetch(image, scene_id, frame) and returning
+            the pixels to plot. Defaults to None.
+        **plot_args: Passed on to render_frame.
+    """
+    count = len(images)
+    if scene_ids is None:
+        scene_ids = [None] * count
+    if fetch is None:
+        def fetch(image, scene_id, frame):
+            return fetch_thumbnail(image, vis_params, region, cache=cache, scene_id=scene_id, metrics=metrics, frame=frame)
+
+    def deliver(i, rendered):
+        # a job over its memory limit stops here, also when it renders in this process
+        check_memory()
+        (frame, timings) = rendered
+        if metrics is not None:
+            for stage, seconds in timings.items():
+                metrics.record(stage, seconds, i)
+        with optional_stage(metrics, "encode", i):
+            on_frame(i, frame)
+
+    if workers <= 1:
+        for i, image in enumerate(images):
+            if verbose:
+                print(f"Downloading {i+1}/{count}: {scene_ids[i]} ...")
+            thumbnail = fetch(image, scene_ids[i], i)
+            deliver(i, _render_timed(thumbnail, region, title=titles[i], **plot_args))
+        return
+
+    # spawn keeps the render processes clear of the download threads' locks
+    ctx = multiprocessing.get_context("spawn")
+    downloads = ThreadPoolExecutor(max_workers=workers)
+    renders = ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=render_initializer)
+    # frames in flight ahead of the next one to deliver
+    window = 2 * workers
+    fetches = {}
+    plots = {}
+    submitted = 0
+    downloaded = 0
+    delivered = 0
+    try:
+        while delivered < count:
+            while submitted < count and submitted < delivered + window:
+                fetches[downloads.submit(fetch, images[submitted], scene_ids[submitted], submitted)] = submitted
+                submitted += 1
+            if delivered in plots and plots[delivered].done():
+                deliver(delivered, plots.pop(delivered).result())
+                delivered += 1
+                continue
+            pending = list(fetches) + ([plots[delivered]] if delivered in plots else [])
+            (done, _) = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future not in fetches:
+                    continue
+                i = fetches.pop(future)
+                downloaded += 1
+                if verbose:
+                    print(f"Downloaded {downloaded}/{count}: {scene_ids[i]}")
+                thumbnail = future.result()
+                # the render slots are shared with every other request of this process
+                render_slots.acquire()
+                try:
+                    plots[i] = renders.submit(_render_timed, thumbnail, region, title=titles[i], **plot_args)
+                except BaseException:
+                    render_slots.release()
+                    raise
+                plots[i].add_done_callback(lambda _: render_slots.release())
+    finally:
+        # on failure, drop the queued work instead of finishing it
+        for future in list(fetches) + list(plots.values()):
+            future.cancel()
+        downloads.shutdown(wait=True)
+        renders.shutdown(wait=True)
 
 def new_get_image_collection_gif(
   ee_ic,
@@ -24,13 +545,26 @@ def new_get_image_collection_gif(
   north_arrow_dict={},
   scale_bar_dict={},
   verbose=True,
-  max_frames=10
+  max_frames=10,
+  workers=1,
+  cache=None,
+  metadata=None,
+  save_frames=False,
+  first_frame=0,
+  decimation=None,
+  metrics=None,
+  stretch=None,
+  on_bands=None,
+  on_progress=None,
+  webp=False,
+  optimize_gif=False,
+  gif_max_bytes=None
 ):
     """Download all the images in an image collection and use them to generate a gif/video.
     Args:
         ee_ic (object): ee.ImageCollection
-        out_dir (str): The output directory of images and video.
-        out_gif (str): The name of the gif file.
+        out_dir (str): The output directory of the gif, video and (with save_frames) images.
+        out_gif (str): The name of the gif file, None to only render frames.
         vis_params (dict): Visualization parameters as a dictionary.
         region (list | tuple): Geospatial region of the image to render in format [E,S,W,N].
         fps (int, optional): Video frames per second. Defaults to 10.
@@ -40,129 +574,160 @@ def new_get_image_collection_gif(
         date_format (str, optional): A pattern, as described at http://joda-time.sourceforge.net/apidocs/org/joda/time/format/DateTimeFormat.html. Defaults to "YYYY-MM-dd".
         fig_size (tuple, optional): Size of the figure.
         dpi_plot (int, optional): The resolution in dots per inch of the plot.
-        file_format (str, optional): Either 'png' or 'jpg'.
+        file_format (str, optional): Either 'png' or 'jpg', for frames kept with save_frames.
         north_arrow_dict (dict, optional): Parameters for the north arrow. See https://geemap.org/cartoee/#geemap.cartoee.add_north_arrow. Defaults to {}.
         scale_bar_dict (dict, optional): Parameters for the scale bar. See https://geemap.org/cartoee/#geemap.cartoee.add_scale_bar. Defaults. to {}.
         verbose (bool, optional): Whether or not to print text when the program is running. Defaults to True.
+        max_frames (int, optional): Frame budget. Longer collections are decimated, or refused without decimation. Defaults to 10.
+        workers (int, optional): Number of parallel downloads and render processes. Defaults to 1 (sequential).
+        cache (FrameCache, optional): Thumbnail cache, so repeat requests only download new scenes. Defaults to None.
+        metadata (dict, optional): Result of prefetch_metadata for ee_ic, fetched here if not given. Defaults to None.
+        save_frames (bool, optional): Also write every frame to out_dir as an image file. Defaults to False.
+        first_frame (int, optional): Index of the first saved frame file, to continue an existing sequence. Defaults to 0.
+        decimation (str, optional): How to fit long collections into max_frames, see choose_decimation.
+            None refuses collections longer than max_frames. Defaults to None.
+        metrics (RenderMetrics, optional): Collects stage and per-frame timings. Defaults to None.
+        stretch (BandStretch, optional): Download raw band values instead of server-rendered thumbnails and stretch
+            them locally. Unfitted stretches are fitted on the first scene. Defaults to None.
+        on_bands (callable, optional): With a stretch, called as on_bands(scene_id, date, time_start, bands) with the raw
+            values of every scene, e.g. to store them. Not called for decimated collections. Defaults to None.
+        on_progress (callable, optional): Called as on_progress(done, total, frame) once the frame count is known
+            (done 0, frame None) and after every encoded frame. Defaults to None.
+        webp (bool, optional): Whether to create an animated WebP next to the gif. Defaults to False.
+        optimize_gif (bool, optional): Write the gif with a shared palette and only the changed pixels per frame,
+            see encoders.OptimizedGifWriter. Defaults to False.
+        gif_max_bytes (int, optional): With optimize_gif, scale the gif down until it is at most this large. Defaults to None.
+    Returns:
+        tuple: (error, message). The message names the decimation strategy if one was applied.
     """
     out_dir = os.path.abspath(out_dir)
     if not os.path.exists(out_dir):
         os.makedirs(out_dir)
 
-    out_gif = os.path.join(out_dir, out_gif)
-
-    count = int(ee_ic.size().getInfo())
-    names = ee_ic.aggregate_array("system:index").getInfo()
-    images = ee_ic.toList(count)
+    if out_gif is not None:
+        out_gif = os.path.abspath(os.path.join(out_dir, out_gif))
 
-    dates = ee_ic.aggregate_array("system:time_start")
-    dates = dates.map(lambda d: ee.Date(d).format(date_format)).getInfo()
+    if metadata is None:
+        metadata = prefetch_metadata(ee_ic, date_format=date_format, metrics=metrics)
+    if verbose:
+        print(f"Fetched collection metadata, saved {metadata['round_trips_saved']} Earth Engine round-trips")
 
     # avoid too many frames
-    if count > max_frames:
-        return (True, f'The time span is too long. We would need to process {count} single frames. Please choose a shorter period!')
-
-    # list of file name
-    img_list = []
-
-    for i, date in enumerate(dates):
-        image = ee.Image(images.get(i))
-        name = str(names[i])
-        #name = name + "." + file_format
-        name = str(i).zfill(3) + "_" + name + "." + file_format
-        out_img = os.path.join(out_dir, name)
-        img_list.append(out_img)
-
+    message = None
+    strategy = choose_decimation(metadata, max_frames, decimation) if decimation is not None else None
+    if strategy is not None:
+        scenes = metadata["count"]
+        span = composite_span(metadata, max_frames, strategy) if strategy != "sample" else 1
+        label = decimation_label(strategy, span)
+        ee_ic = decimate_collection(ee_ic, metadata, max_frames, strategy, span)
+        metadata = prefetch_metadata(ee_ic, date_format=date_format, metrics=metrics)
+        message = f'{scenes} scenes were reduced to {metadata["count"]} frames ({label}).'
+        if span > 1:
+            message += f' The time span has more {DECIMATION_LABELS[strategy].split()[0]} periods than {max_frames} frames, so {span} were combined per frame.'
         if verbose:
-            print(f"Downloading {i+1}/{count}: {name} ...")
+            print(message)
+        if len(plot_title) > 0:
+            plot_title = f"{plot_title} ({label})"
+    elif metadata["count"] > max_frames:
+        return (True, f'The time span is too long. We would need to process {metadata["count"]} single frames. Please choose a shorter period!')
 
-        # Size plot
-        plt.figure(figsize=fig_size)
+    count = metadata["count"]
+    names = metadata["names"]
+    dates = metadata["dates"]
+    images = ee_ic.toList(count)
 
-        # Plot image
-        ax = get_map(image, region=region, vis_params=vis_params, cmap=cmap, proj=proj)
+    titles = [plot_title + " " + date if len(plot_title) > 0 else "" for date in dates]
+    image_list = [ee.Image(images.get(i)) for i in range(count)]
+    scene_ids = [str(n) for n in names]
 
-        # Add grid
-        if grid_interval is not None:
-            add_gridlines(ax, interval=grid_interval, linestyle=":")
+    fetch = None
+    if stretch is not None:
+        download_bands = source_bands(stretch.bands)
 
-        # Add title
-        if len(plot_title) > 0:
-            ax.set_title(label=plot_title + " " + date + "\n", fontsize=15)
+        def fetch(image, scene_id, frame):
+            bands = fetch_band_array(image, download_bands, vis_params, cache=cache, scene_id=scene_id, metrics=metrics, frame=frame)
+            if on_bands is not None and strategy is None:
+                on_bands(scene_id, dates[frame], metadata["times"][frame], bands)
+            with optional_stage(metrics, "stretch", frame):
+                return stretch.apply(bands)
 
-        # Add scale bar
-        if len(scale_bar_dict) > 0:
-            add_scale_bar_lite(ax, **scale_bar_dict)
-        # Add north arrow
-        if len(north_arrow_dict) > 0:
-            add_north_arrow(ax, **north_arrow_dict)
+        if stretch.limits is None and count > 0:
+            # fit once up front so parallel downloads all use the same limits
+            stretch.fit(fetch_band_array(image_list[0], download_bands, vis_params, cache=cache, scene_id=scene_ids[0], metrics=metrics))
 
-        # Save plot
-        plt.savefig(fname=out_img, dpi=dpi_plot)
+    out_mp4 = out_gif.replace(".gif", ".mp4") if mp4 and out_gif is not None else None
+    out_webp = out_gif.replace(".gif", ".webp") if webp and out_gif is not None else None
 
-        plt.clf()
-        plt.close()
+    if on_progress is not None:
+        on_progress(0, count, None)
 
-    out_gif = os.path.abspath(out_gif)
-    png_to_gif(out_dir, out_gif, fps)
-    if verbose:
-        print(f"GIF saved to {out_gif}")
-
-    if mp4:
-
-        video_filename = out_gif.replace(".gif", ".mp4")
+    def on_frame(i, frame):
+        encoder.append(frame, names[i])
+        if on_progress is not None:
+            on_progress(i + 1, count, frame)
 
-        try:
-            import cv2
-        except ImportError:
-            print("Installing opencv-python ...")
-            subprocess.check_call(["python", "-m", "pip", "install", "opencv-python"])
-            import cv2
-
-        # Video file name
-        output_video_file_name = os.path.join(out_dir, video_filename)
-
-        frame = cv2.imread(img_list[0])
-        height, width, _ = frame.shape
-        frame_size = (width, height)
-        fps_video = fps
-
-        # Make mp4
-        fourcc = cv2.VideoWriter_fourcc(*"mp4v")
-
-        # Function
-        def convert_frames_to_video(
-            input_list, output_video_file_name, fps_video, frame_size
-        ):
-
-            """Convert frames to video
-            Args:
-                input_list (list): Downloaded Image Name List.
-                output_video_file_name (str): The name of the video file in the image directory.
-                fps_video (int): Video frames per second.
-                frame_size (tuple): Frame size.
-            """
-            out = cv2.VideoWriter(output_video_file_name, fourcc, fps_video, frame_size)
-            num_frames = len(input_list)
-
-            for i in range(num_frames):
-                img_path = input_list[i]
-                img = cv2.imread(img_path)
-                out.write(img)
-
-            out.release()
-            cv2.destroyAllWindows()
-
-        # Use function
-        convert_frames_to_video(
-            input_list=img_list,
-            output_video_file_name=output_video_file_name,
-            fps_video=fps_video,
-            frame_size=frame_size,
+    # frames go straight from the canvas into the gif/mp4 writers
+    with FrameEncoder(
+        out_gif=out_gif,
+        out_mp4=out_mp4,
+        fps=fps,
+        frames_dir=out_dir if save_frames else None,
+        file_format=file_format,
+        first_index=first_frame,
+        out_webp=out_webp,
+        optimize_gif=optimize_gif,
+        gif_max_bytes=gif_max_bytes,
+    ) as encoder:
+        render_frames(
+            images=image_list,
+            titles=titles,
+            vis_params=vis_params,
+            region=region,
+            on_frame=on_frame,
+            workers=workers,
+            verbose=verbose,
+            cache=cache,
+            scene_ids=scene_ids,
+            metrics=metrics,
+            fetch=fetch,
+            cmap=cmap,
+            proj=proj,
+            grid_interval=grid_interval,
+            fig_size=fig_size,
+            dpi_plot=dpi_plot,
+            north_arrow_dict=north_arrow_dict,
+            scale_bar_dict=scale_bar_dict,
         )
 
-        if verbose:
-            print(f"MP4 saved to {output_video_file_name}")
+    if verbose:
+        if out_gif is not None:
+            print(f"GIF saved to {out_gif}")
+        if out_mp4 is not None:
+            print(f"MP4 saved to {out_mp4}")
+        if out_webp is not None:
+            print(f"WebP saved to {out_webp}")
 
     # return success
-    return (False, None)
\ No newline at end of file
+    return (False, message)
+
+
+def encode_frame_files(img_list, out_gif, fps=10, mp4=False, verbose=True, webp=False, optimize_gif=False, gif_max_bytes=None):
+    """Build a gif (and optionally an mp4 / WebP) from frames saved earlier, reading one file at a time.
+    Args:
+        img_list (list): Frame image files, in animation order.
+        out_gif (str): The gif file to write.
+        fps (int, optional): Frames per second. Defaults to 10.
+        mp4 (bool, optional): Whether to also create an mp4 video next to the gif.
+        verbose (bool, optional): Whether or not to print text when the program is running. Defaults to True.
+        webp (bool, optional): Whether to also create an animated WebP next to the gif. Defaults to False.
+        optimize_gif (bool, optional): See new_get_image_collection_gif. Defaults to False.
+        gif_max_bytes (int, optional): See new_get_image_collection_gif. Defaults to None.
+    """
+    out_mp4 = out_gif.replace(".gif", ".mp4") if mp4 else None
+    out_webp = out_gif.replace(".gif", ".webp") if webp else None
+    with FrameEncoder(out_gif=out_gif, out_mp4=out_mp4, fps=fps, out_webp=out_webp, optimize_gif=optimize_gif, gif_max_bytes=gif_max_bytes) as encoder:
+        for img in img_list:
+            with Image.open(img) as frame:
+                encoder.append(np.asarray(frame.convert("RGB")))
+    if verbose:
+        print(f"GIF saved to {out_gif}")
@@ -0,0 +1,234 @@
+import os
+import re
+import gc
+import time
+import uuid
+import shutil
+import logging
+import hashlib
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from progress import JobProgress
+from limits import set_memory_limit, env_size, MemoryWatchdog
+
+# job ids (JobQueue.submit) and temporary runs (Imagery.set_poi) in BaseTimeseries/<poi>/
+RUN_FOLDER = re.compile(r'[0-9a-f]{12}|run-\w+')
+
+# per worker process, set up by init_worker
+_imagery = None
+_memory_limit = None
+
+
+def init_worker(outpath, memory_limit=None):
+  global _imagery, _memory_limit
+  # before anything large is loaded, so the limit also covers the imports
+  set_memory_limit(memory_limit)
+  _memory_limit = memory_limit
+  import geemap as gee
+  from imagery import Imagery
+  store_size = env_size('SARVEILLANCE_STORE_SIZE')
+  if store_size is not None:
+    Imagery.store_max_bytes = store_size
+  gee.ee_initialize()
+  # the heavy imports and the base collection are paid once per worker, before its first job
+  _imagery = Imagery()
+  _imagery.get_collection()
+  # structured stage timings as json lines
+  log_path = os.path.join(outpath, 'metrics')
+  if not os.path.exists(log_path):
+    os.makedirs(log_path, exist_ok=True)
+  handler = logging.FileHandler(os.path.join(log_path, 'render.log'))
+  handler.setFormatter(logging.Formatter('%(message)s'))
+  logger = logging.getLogger('sarveillance.metrics')
+  logger.addHandler(handler)
+  logger.setLevel(logging.INFO)
+
+
+def run_timeseries_job(job_id, poi, outpath, max_frames, workers, incremental=False, decimation='auto', stretch=None, changes=False, formats=()):
+  """Render one timeseries in a worker process, returns (err, msg, gif path, timings, change report).
+  The gif path is the published one in the output store, progress and the change map stay in the job's folder.
+  """
+  from imagery_utils import release_renderer
+  _imagery.set_poi(poi, outpath, run_id=job_id)
+  # the worker and its render processes together
+  watchdog = MemoryWatchdog(_memory_limit)
+  try:
+    with watchdog:
+      (err, msg) = _imagery.generate_timeseries_gif(max_frames=max_frames, workers=workers, incremental=incremental, decimation=decimation, stretch=stretch, formats=formats)
+      report = None
+      if changes and not err:
+        _imagery.report_stage('changes')
+        with _imagery.metrics.stage('changes'):
+          report = _imagery.detect_changes(workers=max(4, workers), max_scenes=max_frames)
+        _imagery.report_stage('done')
+    return (err, msg, _imagery.gif_path(), _imagery.metrics.summary(), report)
+  except Exception as e:
+    if not isinstance(e, MemoryError) and not watchdog.tripped:
+      raise
+    _imagery.report_stage('failed')
+    return (True, 'The job ran out of its memory limit. Please choose a shorter period or fewer frames.', None, None, None)
+  finally:
+    # the worker runs many jobs, leave nothing of this one behind
+    release_renderer()
+    _imagery.cube = None
+    _imagery.metadata = None
+    gc.collect()
+
+
+class Job():
+
+  def __init__(self, job_id, key, poi, future, folder):
+    self.id = job_id
+    self.key = key
+    self.poi = poi
+    self.future = future
+    # the run's output folder, see Imagery.set_poi
+    self.folder = folder
+
+  @property
+  def progress(self):
+    """The state the job last published, see progress.JobProgress."""
+    return JobProgress.read(self.folder)
+
+  @property
+  def status(self):
+    if self.future.running():
+      return 'running'
+    if not self.future.done():
+      return 'queued'
+    if self.future.cancelled() or self.future.exception() is not None:
+      return 'failed'
+    return 'done'
+
+  @property
+  def result(self):
+    """(err, msg, gif path, timings, change report) once the job has finished."""
+    if self.future.cancelled():
+      return (True, 'The job was cancelled.', None, None, None)
+    exc = self.future.exception()
+    if isinstance(exc, BrokenProcessPool):
+      return (True, 'The job\'s worker process stopped unexpectedly (e.g. out of memory). Please try again.', None, None, None)
+    if exc is not None:
+      return (True, f'Timeseries generation failed: {exc}', None, None, None)
+    return self.future.result()
+
+
+class JobQueue():
+  """Runs timeseries jobs on a bounded pool of worker processes.
+
+  Every job renders into its own folder and publishes the result to the
+  output store (see output_store.OutputStore). A request identical to one that
+  is still queued or running (same poi, dates and frame limit) gets the
+  existing job back instead of starting a second one. Incremental jobs
+  update the poi's shared incremental product, see Imagery.update_timeseries_gif.
+  memory_limit is the memory of one job: it bounds the resident memory of a worker
+  and its render processes together (see limits.MemoryWatchdog), a job that needs
+  more fails on its own instead of taking the container down. The address space of
+  every worker is capped at a multiple of it as a backstop (see limits.set_memory_limit). A worker that dies anyway (killed
+  by the kernel, a crash) fails the jobs of the pool, and the next submit
+  starts a new pool.
+  """
+
+  # what the worker processes run, see init_worker and run_timeseries_job
+  initializer = staticmethod(init_worker)
+  target = staticmethod(run_timeseries_job)
+
+  # finished jobs kept for lookups, older ones are dropped together with their folders
+  max_finished = 100
+  # seconds before run folders of jobs that are not tracked (e.g. of an earlier process) are removed
+  run_retention = 24 * 3600
+
+  def __init__(self, outpath, max_workers=2, render_workers=1, memory_limit=None):
+    self.outpath = outpath
+    self.max_workers = max_workers
+    self.render_workers = render_workers
+    self.memory_limit = memory_limit
+    self.executor = self._start_pool()
+    self.jobs = {}
+    self.inflight = {}
+    self.lock = threading.Lock()
+    self.collect_runs()
+
+  @staticmethod
+  def job_key(poi, max_frames, incremental=False, decimation='auto', stretch=None, changes=False, formats=()):
+    parts = [poi['name'], round(float(poi['lat']), 6), round(float(poi['lon']), 6), poi.get('buffer'), poi['start_date'], poi['end_date'], max_frames, incremental, decimation, stretch, changes, sorted(formats)]
+    return hashlib.sha1('|'.join(str(p) for p in parts).encode('utf-8')).hexdigest()
+
+  def _start_pool(self):
+    # separate processes, so plotting in one job does not hold the GIL for the others
+    return ProcessPoolExecutor(
+      max_workers=self.max_workers,
+      mp_context=multiprocessing.get_context('spawn'),
+      initializer=self.initializer,
+      initargs=(self.outpath, self.memory_limit))
+
+  def submit(self, poi, max_frames, incremental=False, decimation='auto', stretch=None, changes=False, formats=()):
+    key = self.job_key(poi, max_frames, incremental, decimation, stretch, changes, formats)
+    args = (dict(poi), self.outpath, max_frames, self.render_workers, incremental, decimation, stretch, changes, tuple(formats))
+    with self.lock:
+      job = self.inflight.get(key)
+      if job is not None and not job.future.done():
+        return job
+      job_id = uuid.uuid4().hex[:12]
+      try:
+        future = self.executor.submit(self.target, job_id, *args)
+      except BrokenProcessPool:
+        # a worker died, the pool has failed all of its jobs and takes no new ones
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.executor = self._start_pool()
+        self.inflight = {}
+        future = self.executor.submit(self.target, job_id, *args)
+      job = Job(job_id, key, dict(poi), future, os.path.join(self.outpath, 'BaseTimeseries', poi['name'], job_id))
+      self.jobs[job_id] = job
+      self.inflight[key] = job
+    # outside the lock: a future that is already done runs the callback right here, and _finished takes the lock
+    future.add_done_callback(lambda _: self._finished(job))
+    return job
+
+  def _finished(self, job):
+    with self.lock:
+      if self.inflight.get(job.key) is job:
+        del self.inflight[job.key]
+      finished = [j for j in self.jobs.values() if j.future.done()]
+      dropped = finished[:max(0, len(finished) - self.max_finished)]
+      for old in dropped:
+        del self.jobs[old.id]
+    # the animations are in the output store, the folder only holds progress and the change report
+    for old in dropped:
+      shutil.rmtree(old.folder, ignore_errors=True)
+    self.collect_runs()
+
+  def collect_runs(self):
+    """Remove run folders in BaseTimeseries/<poi>/ that no tracked job uses and that were not touched for
+    run_retention seconds: job folders of earlier processes and temporary runs that were never discarded
+    (see Imagery.set_poi). Returns the number of folders removed.
+    """
+    base = os.path.join(self.outpath, 'BaseTimeseries')
+    with self.lock:
+      tracked = {j.folder for j in self.jobs.values()}
+    now = time.time()
+    removed = 0
+    for poi in (os.listdir(base) if os.path.isdir(base) else []):
+      poi_path = os.path.join(base, poi)
+      if not os.path.isdir(poi_path):
+        continue
+      for name in os.listdir(poi_path):
+        folder = os.path.join(poi_path, name)
+        if not (RUN_FOLDER.fullmatch(name) and os.path.isdir(folder)) or folder in tracked:
+          continue
+        try:
+          used = max([os.path.getmtime(folder)] + [e.stat().st_mtime for e in os.scandir(folder)])
+        except FileNotFoundError:
+          continue
+        if now - used > self.run_retention:
+          shutil.rmtree(folder, ignore_errors=True)
+          removed += 1
+    return removed
+
+  def get(self, job_id):
+    return self.jobs.get(job_id)
+
+  def shutdown(self):
+    self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,153 @@
+import os
+import re
+import signal
+import resource
+import threading
+import multiprocessing
+
+_UNITS = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3, 't': 1024 ** 4}
+
+
+def parse_size(value):
+  """Bytes from a size like '2g', '512M' or '1048576'. None or '' stay None."""
+  if value is None or str(value).strip() == '':
+    return None
+  match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([kmgt]?)i?b?\s*', str(value).lower())
+  if match is None:
+    raise ValueError(f'Invalid size: {value}')
+  return int(float(match.group(1)) * _UNITS[match.group(2)])
+
+
+def env_size(name, default=None):
+  return parse_size(os.environ.get(name, default))
+
+
+def env_int(name, default):
+  value = os.environ.get(name)
+  return int(value) if value else default
+
+
+# frames plotted at the same time in this process, over all requests and threads
+render_slots = threading.BoundedSemaphore(env_int('SARVEILLANCE_RENDER_SLOTS', os.cpu_count() or 1))
+
+# the address space cap is this many times the memory budget: thread stacks, shared libraries and memory-mapped
+# cube files take address space without being resident, a cap at the budget itself fails jobs far below it
+ADDRESS_SPACE_FACTOR = 4
+
+# the MemoryWatchdog of the job running in this process, see check_memory
+_active_watchdog = None
+
+
+def set_memory_limit(max_bytes):
+  """Cap the address space of this process at ADDRESS_SPACE_FACTOR x max_bytes, a backstop that makes a runaway
+  allocation fail with a MemoryError instead of getting the whole container OOM-killed. The memory budget itself
+  is kept by MemoryWatchdog. None leaves the limit unchanged. Processes started afterwards inherit the cap each
+  on their own.
+  """
+  if max_bytes is None:
+    return
+  max_bytes *= ADDRESS_SPACE_FACTOR
+  (_, hard) = resource.getrlimit(resource.RLIMIT_AS)
+  if hard != resource.RLIM_INFINITY:
+    max_bytes = min(max_bytes, hard)
+  resource.setrlimit(resource.RLIMIT_AS, (max_bytes, hard))
+
+
+def current_rss(pid='self'):
+  """Resident set size of a process in bytes (Linux), unlike ru_maxrss not just the peak. 0 once it is gone."""
+  try:
+    with open(f'/proc/{pid}/statm') as f:
+      return int(f.read().split()[1]) * resource.getpagesize()
+  except (FileNotFoundError, ProcessLookupError):
+    return 0
+
+
+def descendants(pid=None):
+  """Pids of all processes below pid (this process by default), from the parent pids in /proc/<pid>/stat."""
+  children = {}
+  for entry in os.listdir('/proc'):
+    if not entry.isdigit():
+      continue
+    try:
+      with open(f'/proc/{entry}/stat') as f:
+        # the command name in parentheses may contain spaces, the parent pid is the 2nd field after it
+        ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+    except (FileNotFoundError, ProcessLookupError, IndexError, ValueError):
+      continue
+    children.setdefault(ppid, []).append(int(entry))
+  found = []
+  pending = [pid or os.getpid()]
+  while pending:
+    below = children.get(pending.pop(), [])
+    found += below
+    pending += below
+  return found
+
+
+def tree_rss(pid=None):
+  """Resident set size of a process and all processes below it, in bytes."""
+  pid = pid or os.getpid()
+  return current_rss(pid) + sum(current_rss(child) for child in descendants(pid))
+
+
+def check_memory():
+  """Raise a MemoryError once the active MemoryWatchdog found the job above its limit.
+  Called between frames and downloads, so a job that renders in its own process stops there."""
+  watchdog = _active_watchdog
+  if watchdog is not None and watchdog.tripped:
+    raise MemoryError(f'The job used {watchdog.peak} bytes, more than its limit of {watchdog.max_bytes}')
+
+
+class MemoryWatchdog():
+  """Keeps a job and the processes it starts below max_bytes of resident memory together.
+
+  An address space limit (set_memory_limit) is inherited by every child
+  process, so a job with render processes could use it once per process.
+  While active, the watchdog sums the resident memory of this process and
+  its descendants every interval seconds. Once the sum is above max_bytes
+  it sets tripped, which makes check_memory fail the job in its own
+  threads, and kills the child processes started with multiprocessing,
+  which fails the job's pending renders. None for max_bytes makes it a no-op.
+  """
+
+  def __init__(self, max_bytes, interval=0.5):
+    self.max_bytes = max_bytes
+    self.interval = interval
+    self.tripped = False
+    self.peak = 0
+    self.stopped = threading.Event()
+    self.thread = None
+
+  def check(self):
+    rss = tree_rss()
+    self.peak = max(self.peak, rss)
+    if rss <= self.max_bytes:
+      return False
+    children = multiprocessing.active_children()
+    for child in children:
+      try:
+        os.kill(child.pid, signal.SIGKILL)
+      except ProcessLookupError:
+        pass
+    self.tripped = True
+    return True
+
+  def _watch(self):
+    while not self.stopped.wait(self.interval):
+      self.check()
+
+  def __enter__(self):
+    global _active_watchdog
+    if self.max_bytes is not None:
+      _active_watchdog = self
+      self.thread = threading.Thread(target=self._watch, name='memory-watchdog', daemon=True)
+      self.thread.start()
+    return self
+
+  def __exit__(self, exc_type, exc, tb):
+    global _active_watchdog
+    self.stopped.set()
+    if self.thread is not None:
+      self.thread.join()
+    if _active_watchdog is self:
+      _active_watchdog = None
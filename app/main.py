@@ -1,139 +1,278 @@
 import os
 import sys
-import ee
-import sys
+import time
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import geemap as gee
-from geemap import cartoee
-import pandas as pd
-from imagery_utils import new_get_image_collection_gif
+from imagery import Imagery
+from poi_catalog import POICatalog
+from shared_scenes import poi_scenes, group_pois, update_shared_cubes
+from aoi_stats import aoi_statistics, export_stats
 
-base_name = sys.argv[1]
-start_date= sys.argv[2]
-end_date = sys.argv[3] 
-outpath = sys.argv[4]
 
 class SAREXPLORER():
-  scale_bar_dict1 = {
-      "length": 1, 
-      "xy": (0.1, 0.05), 
-      "linewidth": 3,
-      "fontsize": 20,
-      "color": "black",
-      "unit": "km",
-      "ha": "center",
-      "va": "bottom"
-      }
-
-  north_arrow_dict1 = {
-      "text": "N",
-      "xy": (0.1, 0.3),
-      "arrow_length": 0.15,
-      "text_color": "white",
-      "arrow_color": "white",
-      "fontsize": 20,
-      "width": 5,
-      "headwidth": 15,
-      "ha": "center",
-      "va": "center"
-      }
-
-
-  def __init__(self):
+
+  def __init__(self, outpath, parallel=4, max_frames=30, workers=1, incremental=False, decimation='auto', catalog=None, share_scenes=False, buffer=None,
+    formats=(), scale_bar=False, refit_stretch=False):
     self.gee = gee
-    self.bases = []
+    self.bases = None
     self.col_final = None
     self.dirname = os.path.dirname(__file__)
-    self.outpath = self.dirname+"/Data/"
-
+    # csv, GeoJSON or npz poi catalog, see POICatalog.load
+    self.poi_path = catalog or os.path.join(self.dirname, '..', 'poi', 'poi_df.csv')
+    self.outpath = os.path.abspath(os.path.expanduser(outpath))
+    # pois rendered at the same time
+    self.parallel = parallel
+    self.max_frames = max_frames
+    # download threads / render processes per poi
+    self.workers = workers
+    # only render scenes newer than the previous run
+    self.incremental = incremental
+    # how to fit long time spans into max_frames
+    self.decimation = decimation
+    # download each scene once for groups of nearby pois, see shared_scenes
+    self.share_scenes = share_scenes
+    # half the side of every poi's square aoi in metres, None for aoi_grid.DEFAULT_BUFFER
+    self.buffer = buffer
+    # webp / mp4 written next to every gif, and a scale bar on the frames
+    self.formats = tuple(formats)
+    self.scale_bar = scale_bar
+    # fit every poi's saved min/max stretch again, see Imagery.reset_poi_stretch
+    self.refit_stretch = refit_stretch
 
-  def run(self):
+  def run(self, base_names, start_date, end_date):
     self.auth()
     self.get_bases()
     self.get_collection()
-    self.create_imagery()
+    return self.create_imagery(base_names, start_date, end_date)
 
   def auth(self):
     #self.gee.ee.Authenticate()
     self.gee.ee_initialize()
 
   def get_bases(self):
-    self.bases = pd.read_csv("bases_df.csv")
+    self.bases = POICatalog.load(self.poi_path)
 
   def get_collection(self):
-    collection = ee.ImageCollection('COPERNICUS/S1_GRD')
-    collection_both = collection.filter(ee.Filter.listContains('transmitterReceiverPolarisation', 'VV')).filter(ee.Filter.eq('instrumentMode', 'IW'))
-    composite_col = collection_both.map(lambda image: image.select("VH").subtract(image.select("VH")).rename("VH-VV"))
-    self.col_final = collection_both.map(self.band_adder)
-
-  def band_adder(self, image):
-    vh_vv = image.select("VH").subtract(image.select("VH")).rename("VH-VV")
-    return image.addBands(vh_vv)
-
-  def generate_base_aoi(self, base_name):
-    base_gdf = self.bases.loc[self.bases.Name == base_name]
-    latitude = base_gdf.iloc[0]["lat"]
-    longitude = base_gdf.iloc[0]["lon"]
-    base_point = ee.Geometry.Point([float(longitude), float(latitude)])
-    base_buffer = base_point.buffer(3000)
-    base_bounds = base_buffer.bounds()
-    return base_bounds
-
-  def get_filtered_col(self, col, base_name):
-    base_aoi = self.generate_base_aoi(base_name)
-    filtered_col = col.filterBounds(base_aoi)
-    clipped_col = filtered_col.map(lambda image: image.clip(base_aoi))
-    return clipped_col
-
-  def generate_timeseries_gif(self, base_name, start_date, end_date, outpath):
-    col_final_recent = self.col_final.filterDate(start_date, end_date) #.sort("system:time_start")
-    col_filtered = self.get_filtered_col(col_final_recent, base_name).sort("system:time_start")
-    aoi = self.generate_base_aoi(base_name)
-    minmax = col_filtered.first().reduceRegion(ee.Reducer.minMax(), aoi)
-    max = minmax.getNumber("VV_max").getInfo()
-    min = minmax.getNumber("VV_min").getInfo()
-    base_gdf = self.bases.loc[self.bases.Name == base_name]
-    lat = base_gdf.iloc[0]["lat"]
-    lon = base_gdf.iloc[0]["lon"]
-    w = 0.4
-    h = 0.4
-    region = [lon+w, lat-h, lon-w, lat+h]
-    out_dir = os.path.expanduser(outpath)
-    filename = base_name+".gif"
-    out_gif = os.path.join(out_dir, filename)
-    if not os.path.exists(out_dir):
-      os.makedirs(out_dir)
-    visParams = {
-    'bands': ['VV', 'VH', 'VH-VV'],
-    'min': min,
-    'max': max,
-    'dimensions': 500,
-    'framesPerSecond': 2,
-    'region': aoi,
-    'crs': "EPSG:32637"}
-    return cartoee.get_image_collection_gif(
-      ee_ic = col_filtered, #.sort("system:time_start"),
-      out_dir = os.path.expanduser(outpath+"BaseTimeseries/"+base_name+"/"),
-      out_gif = base_name + ".gif",
-      vis_params = visParams,
-      region = region,
-      fps = 2,
-      mp4 = True,
-      grid_interval = (0.2, 0.2),
-      plot_title = base_name,
-      date_format = 'YYYY-MM-dd',
-      fig_size = (10, 10),
-      dpi_plot = 100,
-      file_format = "png",
-      north_arrow_dict = self.north_arrow_dict1,
-      scale_bar_dict = self.scale_bar_dict1,
-      verbose = True,
-    )
-
-  def create_imagery(self):
-    base_name_list = self.bases['Name'].tolist()
-    self.generate_timeseries_gif(base_name, start_date, end_date, outpath)
+    # one collection shared by every poi
+    imagery = Imagery()
+    imagery.get_collection()
+    self.col_final = imagery.col_final
+
+  def create_poi(self, base_name, start_date, end_date):
+    base = self.bases.get(base_name)
+    if base is None:
+      raise ValueError(f'Unknown base name: {base_name}')
+    return {
+      'name': base_name,
+      'lat': base['lat'],
+      'lon': base['lon'],
+      'start_date': start_date,
+      'end_date': end_date,
+      'buffer': self.buffer
+    }
+
+  def generate_timeseries_gif(self, base_name, start_date, end_date):
+    imagery = Imagery()
+    imagery.col_final = self.col_final
+    imagery.scale_bar = self.scale_bar
+    imagery.set_poi(self.create_poi(base_name, start_date, end_date), self.outpath)
+    if self.refit_stretch:
+      imagery.reset_poi_stretch()
+    try:
+      (err, msg) = imagery.generate_timeseries_gif(max_frames=self.max_frames, workers=self.workers, incremental=self.incremental, decimation=self.decimation,
+        formats=self.formats)
+    finally:
+      imagery.discard_run()
+    return (err, msg, imagery.gif_path() if not err else None)
+
+  def generate_group_gifs(self, base_names, start_date, end_date):
+    """Render a group of nearby pois from their cubes, filled with one download per scene for the whole group."""
+    imageries = []
+    for base_name in base_names:
+      imagery = Imagery()
+      imagery.col_final = self.col_final
+      imagery.scale_bar = self.scale_bar
+      imagery.formats = self.formats
+      imagery.set_poi(self.create_poi(base_name, start_date, end_date), self.outpath)
+      if self.refit_stretch:
+        imagery.reset_poi_stretch()
+      imageries.append(imagery)
+    shared = update_shared_cubes(imageries, workers=max(4, self.workers))
+    print(f"{', '.join(base_names)}: {shared['downloads']} downloads for {shared['scenes']} scenes")
+    results = []
+    for imagery in imageries:
+      try:
+        key = imagery.product_key(source='cube', max_frames=self.max_frames)
+        if imagery.find_product(key) is not None:
+          (err, msg) = (False, None)
+        else:
+          (err, msg) = imagery.render_cube_gif(max_frames=self.max_frames)
+          if not err:
+            imagery.publish(key, source='cube', max_frames=self.max_frames)
+      finally:
+        imagery.discard_run()
+      results.append((imagery.poi['name'], err, msg, imagery.gif_path() if not err else None))
+    return results
+
+  def create_statistics(self, base_names, start_date, end_date, out_file):
+    """Backscatter statistics of all (or the given) pois as one table, without rendering, see aoi_stats."""
+    if not base_names:
+      base_names = self.bases.names.tolist()
+    pois = [self.create_poi(base_name, start_date, end_date) for base_name in base_names]
+    start = time.perf_counter()
+    df = aoi_statistics(self.col_final, pois, start_date, end_date)
+    if not os.path.exists(self.outpath):
+      os.makedirs(self.outpath)
+    path = export_stats(df, os.path.join(self.outpath, out_file))
+    print(f"{len(df)} rows for {df['poi'].nunique()} of {len(pois)} POIs in {time.perf_counter() - start:.1f}s, saved to {path}")
+    return df
+
+  def create_shared_imagery(self, base_names, start_date, end_date):
+    pois = [self.create_poi(base_name, start_date, end_date) for base_name in base_names]
+    groups = group_pois(pois, poi_scenes(self.col_final, pois, start_date, end_date))
+    print(f"{len(pois)} POIs in {len(groups)} groups of shared scenes")
+
+    def timed(group):
+      names = [poi['name'] for poi in group]
+      start = time.perf_counter()
+      try:
+        results = self.generate_group_gifs(names, start_date, end_date)
+      except Exception as e:
+        results = [(name, True, f'{type(e).__name__}: {e}', None) for name in names]
+      # the group's time is split evenly between its pois
+      seconds = (time.perf_counter() - start) / len(group)
+      return [r + (seconds,) for r in results]
+
+    results = []
+    with ThreadPoolExecutor(max_workers=self.parallel) as pool:
+      futures = [pool.submit(timed, group) for group in groups]
+      for future in as_completed(futures):
+        results.extend(future.result())
+        print(f"[{len(results)}/{len(base_names)}] finished {', '.join(r[0] for r in future.result())}")
+
+    self.print_summary(results)
+    return results
+
+  def create_imagery(self, base_names, start_date, end_date):
+    if not base_names:
+      base_names = self.bases.names.tolist()
+    if self.share_scenes:
+      return self.create_shared_imagery(base_names, start_date, end_date)
+
+    def timed(base_name):
+      start = time.perf_counter()
+      try:
+        (err, msg, gif) = self.generate_timeseries_gif(base_name, start_date, end_date)
+      except Exception as e:
+        (err, msg, gif) = (True, f'{type(e).__name__}: {e}', None)
+      return (base_name, err, msg, gif, time.perf_counter() - start)
+
+    results = []
+    with ThreadPoolExecutor(max_workers=self.parallel) as pool:
+      futures = [pool.submit(timed, base_name) for base_name in base_names]
+      for future in as_completed(futures):
+        results.append(future.result())
+        print(f"[{len(results)}/{len(futures)}] finished {results[-1][0]}")
+
+    self.print_summary(results)
+    return results
+
+  def print_summary(self, results):
+    width = max([len(r[0]) for r in results] + [4])
+    print()
+    print(f"{'POI'.ljust(width)}  {'status':6}  {'time':>8}  result")
+    for (base_name, err, msg, gif, seconds) in sorted(results, key=lambda r: r[0]):
+      status = 'FAILED' if err else 'ok'
+      detail = msg if err else f"{gif} {msg or ''}".strip()
+      print(f"{base_name.ljust(width)}  {status:6}  {seconds:7.1f}s  {detail}")
+    failed = sum(1 for r in results if r[1])
+    print(f"\n{len(results) - failed} succeeded, {failed} failed")
+
+
+def parse_args(argv):
+  if len(argv) > 0 and argv[0] == 'stats':
+    parser = argparse.ArgumentParser(prog='main.py stats', description='Backscatter statistics per scene over the AOI of every (or the given) POI, without rendering.')
+    parser.add_argument('start_date')
+    parser.add_argument('end_date')
+    parser.add_argument('outpath')
+    parser.add_argument('--names', nargs='+', default=None, help='only these POIs')
+    parser.add_argument('--catalog', default=None, help='POI catalog (csv with Name/lat/lon columns, GeoJSON points or npz)')
+    parser.add_argument('--out', default='aoi_stats.csv', help='file name in outpath, .csv or .parquet')
+    parser.add_argument('--buffer', type=float, default=None, help='half the side of the AOI around each POI in metres (default 3000)')
+    args = parser.parse_args(argv[1:])
+    args.stats = True
+    return args
+
+  if len(argv) > 0 and argv[0] == 'batch':
+    parser = argparse.ArgumentParser(prog='main.py batch', description='Render timeseries for all (or the given) POIs of a catalog, poi/poi_df.csv by default.')
+    parser.add_argument('start_date')
+    parser.add_argument('end_date')
+    parser.add_argument('outpath')
+    parser.add_argument('--names', nargs='+', default=None, help='only render these POIs')
+    parser.add_argument('--parallel', type=int, default=4, help='POIs rendered at the same time')
+    parser.add_argument('--workers', type=int, default=1, help='download threads / render processes per POI')
+    parser.add_argument('--max-frames', type=int, default=30)
+    parser.add_argument('--incremental', action='store_true', help='only render scenes newer than the previous run')
+    parser.add_argument('--log-metrics', action='store_true', help='print per-stage timings as json lines to stderr')
+    parser.add_argument('--decimation', default='auto', choices=['auto', 'sample', 'weekly', 'monthly', 'none'],
+      help='how to fit long time spans into --max-frames (none: fail instead)')
+    parser.add_argument('--catalog', default=None, help='POI catalog (csv with Name/lat/lon columns, GeoJSON points or npz)')
+    parser.add_argument('--share-scenes', action='store_true',
+      help='download every scene once for groups of POIs covered by the same scenes and crop them locally (long time spans are sampled, not composited)')
+    parser.add_argument('--buffer', type=float, default=None,
+      help='half the side of the AOI around each POI in metres (default 3000), resolution follows from the 10 m pixels')
+    parser.add_argument('--formats', nargs='*', default=[], choices=['webp', 'mp4'], help='also write these next to every gif')
+    parser.add_argument('--scale-bar', action='store_true', help='draw a 1 km scale bar on the frames')
+    parser.add_argument('--refit-stretch', action='store_true',
+      help="fit each POI's saved min/max stretch again on the first scene of this run, replacing its earlier products")
+    args = parser.parse_args(argv[1:])
+    if args.share_scenes and args.decimation not in ('auto', 'sample'):
+      parser.error(f'--decimation {args.decimation} does not work with --share-scenes, its long time spans are always sampled')
+    args.stats = False
+    return args
+
+  # single poi: main.py base_name start_date end_date outpath
+  parser = argparse.ArgumentParser(prog='main.py')
+  parser.add_argument('base_name')
+  parser.add_argument('start_date')
+  parser.add_argument('end_date')
+  parser.add_argument('outpath')
+  args = parser.parse_args(argv)
+  args.names = [args.base_name]
+  args.parallel = 1
+  args.workers = 1
+  args.max_frames = 30
+  args.incremental = False
+  args.decimation = 'auto'
+  args.log_metrics = False
+  args.catalog = None
+  args.share_scenes = False
+  args.buffer = None
+  # as before the batch mode: an mp4 next to the gif and a scale bar on the frames
+  args.formats = ['mp4']
+  args.scale_bar = True
+  args.refit_stretch = False
+  args.stats = False
+  return args
+
 
 if __name__ == '__main__':
-  cartoee.get_image_collection_gif = new_get_image_collection_gif
-  sar = SAREXPLORER()
-  sar.run()
\ No newline at end of file
+  args = parse_args(sys.argv[1:])
+  if args.stats:
+    sar = SAREXPLORER(args.outpath, catalog=args.catalog, buffer=args.buffer)
+    sar.auth()
+    sar.get_bases()
+    sar.get_collection()
+    sar.create_statistics(args.names, args.start_date, args.end_date, args.out)
+    sys.exit(0)
+  if args.log_metrics:
+    logging.basicConfig(format='%(message)s')
+    logging.getLogger('sarveillance.metrics').setLevel(logging.INFO)
+  sar = SAREXPLORER(args.outpath, parallel=args.parallel, max_frames=args.max_frames, workers=args.workers, incremental=args.incremental,
+    decimation=None if args.decimation == 'none' else args.decimation, catalog=args.catalog,
+    share_scenes=args.share_scenes, buffer=args.buffer, formats=args.formats, scale_bar=args.scale_bar,
+    refit_stretch=args.refit_stretch)
+  results = sar.run(args.names, args.start_date, args.end_date)
+  sys.exit(1 if any(r[1] for r in results) else 0)
@@ -53,8 +53,11 @@ function notifyHost(data) {
 }
 
 // custom component code
+var map = null;
+var nearbyLayer = null;
+
 (function () {
-  var map = L.map('map').setView([51.004, 37.111], 5);
+  map = L.map('map').setView([51.004, 37.111], 5);
 
   // osm layer (topo)
   var osm = L.tileLayer('https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png', {
@@ -79,6 +82,7 @@ function notifyHost(data) {
   L.control.scale({ imperial: true, metric: true, position: 'bottomleft' }).addTo(map);
 
   var layerGroup = L.layerGroup().addTo(map);
+  nearbyLayer = L.layerGroup().addTo(map);
 
   map.on('click', function (ev) {
     layerGroup.clearLayers();
@@ -91,6 +95,16 @@ function notifyHost(data) {
   });
 })();
 
+// draw the known pois near the clicked point, sent as args.nearby
+function showNearby(args) {
+  nearbyLayer.clearLayers();
+  (args.nearby || []).forEach((poi) => {
+    L.circleMarker([poi.lat, poi.lon], { radius: 6, color: '#ff7800', weight: 2 })
+      .bindTooltip(poi.name + ' (' + poi.distance_km.toFixed(1) + ' km)')
+      .addTo(nearbyLayer);
+  });
+}
+
 // ----------------------------------------------------
 // Finally, initialize component passing in pipeline
-initialize([]);
+initialize([showNearby]);
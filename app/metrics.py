@@ -0,0 +1,178 @@
+import os
+import re
+import json
+import time
+import atexit
+import logging
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+logger = logging.getLogger('sarveillance.metrics')
+
+
+class RenderMetrics():
+  """Stage and frame timings of one render request.
+
+  Every stage is also logged as one json line on the sarveillance.metrics
+  logger, and finish() adds the totals to the process-wide REGISTRY.
+  """
+
+  def __init__(self, request_id=None, **labels):
+    self.request_id = request_id
+    self.labels = labels
+    self.stages = defaultdict(float)
+    self.stage_counts = defaultdict(int)
+    self.counters = defaultdict(float)
+    self.frames = defaultdict(dict)
+    self.started = time.perf_counter()
+    self.lock = threading.Lock()
+
+  @contextmanager
+  def stage(self, name, frame=None, **fields):
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.record(name, time.perf_counter() - start, frame, **fields)
+
+  def record(self, name, seconds, frame=None, **fields):
+    with self.lock:
+      self.stages[name] += seconds
+      self.stage_counts[name] += 1
+      if frame is not None:
+        self.frames[frame][name] = self.frames[frame].get(name, 0.0) + seconds
+    logger.info(json.dumps({'request': self.request_id, 'stage': name, 'frame': frame, 'seconds': round(seconds, 4), **self.labels, **fields}))
+
+  def add(self, name, value=1):
+    with self.lock:
+      self.counters[name] += value
+
+  def summary(self):
+    return {
+      'request': self.request_id,
+      'total_seconds': time.perf_counter() - self.started,
+      'stages': {name: {'seconds': self.stages[name], 'count': self.stage_counts[name]} for name in self.stages},
+      'counters': dict(self.counters),
+      'frames': [self.frames[i] for i in sorted(self.frames)],
+    }
+
+  def finish(self, error=False):
+    summary = self.summary()
+    logger.info(json.dumps({'request': self.request_id, 'event': 'finished', 'error': error,
+      'seconds': round(summary['total_seconds'], 4), **self.labels}))
+    REGISTRY.observe(self, summary['total_seconds'], error)
+    return summary
+
+
+class MetricsRegistry():
+  """Process-wide totals, exported in the Prometheus text format."""
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.requests = defaultdict(int)
+    self.request_seconds = 0.0
+    self.stage_seconds = defaultdict(float)
+    self.stage_counts = defaultdict(int)
+    self.counters = defaultdict(float)
+    # files written by this process, removed again when it exits
+    self.paths = set()
+
+  def observe(self, metrics, seconds, error=False):
+    with self.lock:
+      self.requests['error' if error else 'ok'] += 1
+      self.request_seconds += seconds
+      for name, value in metrics.stages.items():
+        self.stage_seconds[name] += value
+        self.stage_counts[name] += metrics.stage_counts[name]
+      for name, value in metrics.counters.items():
+        self.counters[name] += value
+
+  def prometheus(self):
+    pid = os.getpid()
+    lines = [
+      '# HELP sarveillance_requests_total Render requests by outcome.',
+      '# TYPE sarveillance_requests_total counter',
+    ]
+    with self.lock:
+      for status, value in sorted(self.requests.items()):
+        lines.append(f'sarveillance_requests_total{{pid="{pid}",status="{status}"}} {value}')
+      lines += [
+        '# HELP sarveillance_request_seconds_total Wall time spent in render requests.',
+        '# TYPE sarveillance_request_seconds_total counter',
+        f'sarveillance_request_seconds_total{{pid="{pid}"}} {self.request_seconds:.6f}',
+        '# HELP sarveillance_stage_seconds_total Time spent per pipeline stage.',
+        '# TYPE sarveillance_stage_seconds_total counter',
+      ]
+      for name, value in sorted(self.stage_seconds.items()):
+        lines.append(f'sarveillance_stage_seconds_total{{pid="{pid}",stage="{name}"}} {value:.6f}')
+      lines += [
+        '# HELP sarveillance_stage_calls_total Calls per pipeline stage.',
+        '# TYPE sarveillance_stage_calls_total counter',
+      ]
+      for name, value in sorted(self.stage_counts.items()):
+        lines.append(f'sarveillance_stage_calls_total{{pid="{pid}",stage="{name}"}} {value}')
+      for name, value in sorted(self.counters.items()):
+        lines.append(f'# TYPE sarveillance_{name}_total counter')
+        lines.append(f'sarveillance_{name}_total{{pid="{pid}"}} {value:g}')
+    return '\n'.join(lines) + '\n'
+
+  def write_prometheus(self, folder):
+    """Write this process' metrics to <folder>/sarveillance_<pid>.prom, e.g. for the node_exporter textfile collector.
+    The file is removed when the process exits, files of processes that died without cleaning up on the next write.
+    """
+    if not os.path.exists(folder):
+      os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, f'sarveillance_{os.getpid()}.prom')
+    with open(path + '.tmp', 'w') as f:
+      f.write(self.prometheus())
+    os.replace(path + '.tmp', path)
+    with self.lock:
+      if not self.paths:
+        atexit.register(self.remove_files)
+      self.paths.add(path)
+    remove_stale(folder)
+    return path
+
+  def remove_files(self):
+    with self.lock:
+      for path in self.paths:
+        try:
+          os.remove(path)
+        except FileNotFoundError:
+          pass
+      self.paths.clear()
+
+
+def pid_alive(pid):
+  try:
+    os.kill(pid, 0)
+  except ProcessLookupError:
+    return False
+  except PermissionError:
+    pass
+  return True
+
+
+def remove_stale(folder):
+  """Remove the .prom files of processes that no longer run, so the textfile collector stops exporting them."""
+  for name in os.listdir(folder):
+    match = re.fullmatch(r'sarveillance_(\d+)\.prom', name)
+    if match and not pid_alive(int(match.group(1))):
+      try:
+        os.remove(os.path.join(folder, name))
+      except FileNotFoundError:
+        pass
+
+
+REGISTRY = MetricsRegistry()
+
+
+@contextmanager
+def optional_stage(metrics, name, frame=None, **fields):
+  """metrics.stage() that does nothing when metrics is None."""
+  if metrics is None:
+    yield
+  else:
+    with metrics.stage(name, frame, **fields):
+      yield
@@ -0,0 +1,150 @@
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+
+
+class OutputStore():
+  """Finished products (gif, webp, mp4), one folder per poi, date range and render parameters.
+
+  Runs render into their own folder and publish the result with a single
+  rename of a complete staging folder, so readers see a product either
+  whole or not at all, and requests for different dates or parameters
+  never touch each other's files. Published products are never modified;
+  a second run for the same key just keeps the first one. Products that
+  were not read for the longest time are removed once the store is larger
+  than max_bytes.
+
+  Layout: <path>/<poi>/<key>/ with the files and a product.json.
+  """
+
+  # products younger than this are never collected, they may be served right now
+  min_age = 60
+
+  def __init__(self, path, max_bytes=5 * 1024 ** 3):
+    self.path = os.path.abspath(path)
+    self.max_bytes = max_bytes
+    self.staging = os.path.join(self.path, '.staging')
+    self.lock = threading.Lock()
+    os.makedirs(self.staging, exist_ok=True)
+
+  @staticmethod
+  def key(poi, **params):
+    payload = json.dumps({
+      'name': poi['name'],
+      'lat': round(float(poi['lat']), 6),
+      'lon': round(float(poi['lon']), 6),
+      'start_date': poi['start_date'],
+      'end_date': poi['end_date'],
+      'buffer': poi.get('buffer'),
+      **params,
+    }, sort_keys=True, default=repr)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:24]
+
+  @staticmethod
+  def _folder_name(name):
+    return re.sub(r'[^\w.-]+', '_', str(name)).strip('_') or 'poi'
+
+  def product_path(self, poi, key):
+    return os.path.join(self.path, self._folder_name(poi['name']), key)
+
+  def get(self, poi, key):
+    """The folder of a published product, or None."""
+    folder = self.product_path(poi, key)
+    manifest = os.path.join(folder, 'product.json')
+    try:
+      # bump mtime so gc sees the product as recently used
+      os.utime(manifest)
+    except FileNotFoundError:
+      return None
+    return folder
+
+  def publish(self, poi, key, files, **meta):
+    """Move files into the store as one product and return its folder.
+    If the product was published in the meantime, the existing one is kept and the files are deleted.
+    """
+    staging = tempfile.mkdtemp(dir=self.staging)
+    try:
+      for f in files:
+        os.replace(f, os.path.join(staging, os.path.basename(f)))
+      with open(os.path.join(staging, 'product.json'), 'w') as f:
+        json.dump({'poi': poi, 'key': key, 'files': [os.path.basename(f) for f in files], 'published': time.time(), **meta}, f, indent=2, default=str)
+      folder = self.product_path(poi, key)
+      os.makedirs(os.path.dirname(folder), exist_ok=True)
+      try:
+        os.rename(staging, folder)
+      except OSError:
+        if not os.path.exists(os.path.join(folder, 'product.json')):
+          raise
+        shutil.rmtree(staging, ignore_errors=True)
+    except BaseException:
+      shutil.rmtree(staging, ignore_errors=True)
+      raise
+    self.gc()
+    return folder
+
+  def remove(self, poi):
+    """Remove every product of the poi (by name), e.g. after its saved stretch changed. Returns how many were removed."""
+    poi_path = os.path.join(self.path, self._folder_name(poi['name']))
+    if not os.path.isdir(poi_path):
+      return 0
+    removed = 0
+    with self.lock:
+      for key in os.listdir(poi_path):
+        # rename first, so the product disappears at once for readers
+        trash = tempfile.mkdtemp(dir=self.staging)
+        try:
+          os.rename(os.path.join(poi_path, key), os.path.join(trash, 'product'))
+          removed += 1
+        except OSError:
+          continue
+        finally:
+          shutil.rmtree(trash, ignore_errors=True)
+    return removed
+
+  def products(self):
+    """(folder, bytes, last used) of every published product."""
+    found = []
+    for poi in os.listdir(self.path):
+      poi_path = os.path.join(self.path, poi)
+      if poi == '.staging' or not os.path.isdir(poi_path):
+        continue
+      for key in os.listdir(poi_path):
+        folder = os.path.join(poi_path, key)
+        try:
+          used = os.path.getmtime(os.path.join(folder, 'product.json'))
+          size = sum(e.stat().st_size for e in os.scandir(folder) if e.is_file())
+        except (FileNotFoundError, NotADirectoryError):
+          continue
+        found.append((folder, size, used))
+    return found
+
+  def size(self):
+    return sum(size for _, size, _ in self.products())
+
+  def gc(self):
+    """Remove least recently used products until the store fits into max_bytes. Returns the bytes freed."""
+    with self.lock:
+      products = sorted(self.products(), key=lambda p: p[2])
+      total = sum(size for _, size, _ in products)
+      freed = 0
+      now = time.time()
+      for folder, size, used in products:
+        if total - freed <= self.max_bytes:
+          break
+        if now - used < self.min_age:
+          continue
+        # rename first, so the product disappears at once for readers
+        trash = tempfile.mkdtemp(dir=self.staging)
+        try:
+          os.rename(folder, os.path.join(trash, 'product'))
+        except OSError:
+          continue
+        finally:
+          shutil.rmtree(trash, ignore_errors=True)
+        freed += size
+      return freed
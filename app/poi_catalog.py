@@ -0,0 +1,185 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+
+EARTH_RADIUS_KM = 6371.0088
+# km per degree of latitude (and of longitude at the equator)
+KM_PER_DEGREE = 2 * np.pi * EARTH_RADIUS_KM / 360
+
+
+def haversine_km(lat, lon, lats, lons):
+  lat, lon, lats, lons = map(np.radians, (lat, lon, lats, lons))
+  a = np.sin((lats - lat) / 2) ** 2 + np.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+  return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+class POICatalog():
+  """Places of interest held as columns (name, lat, lon and any extra columns) with two indexes.
+
+  Names are looked up through a dict of row numbers. For spatial queries the
+  rows are sorted by a grid of cell_size degree cells, every cell keeps the
+  slice of its rows, so bounding box and nearest site queries only look at
+  the cells around the query instead of the whole catalog. Cell columns wrap
+  around at the antimeridian, so queries near +-180 degrees see both sides.
+  Names are unique, the first row wins when loading duplicates.
+  """
+
+  # rings of cells nearest() searches before comparing against every row
+  max_rings = 16
+
+  def __init__(self, names, lats, lons, cell_size=0.5, **columns):
+    names = np.asarray(names, dtype=object)
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    _, first = np.unique(names, return_index=True)
+    keep = np.sort(first)
+    self.cell_size = cell_size
+    self.names = names[keep]
+    self.lats = lats[keep]
+    self.lons = lons[keep]
+    self.columns = {k: np.asarray(v)[keep] for k, v in columns.items()}
+    self.index = {name: row for row, name in enumerate(self.names)}
+    # cell columns around the globe, the last one is narrower if cell_size does not divide 360
+    self.columns_count = int(np.ceil(360 / cell_size))
+    self._build_grid()
+
+  def _cells(self, lats, lons):
+    # columns count from -180 degrees, longitudes outside [-180, 180) wrap around
+    cx = np.floor(((np.asarray(lons, dtype=np.float64) + 180) % 360) / self.cell_size).astype(np.int64)
+    return cx, np.floor(np.asarray(lats) / self.cell_size).astype(np.int64)
+
+  def _build_grid(self):
+    cx, cy = self._cells(self.lats, self.lons)
+    self.order = np.lexsort((cy, cx))
+    keys = np.stack([cx[self.order], cy[self.order]], axis=1)
+    cells, starts = np.unique(keys, axis=0, return_index=True)
+    ends = np.append(starts[1:], len(self.order))
+    self.grid = {(int(x), int(y)): (int(s), int(e)) for (x, y), s, e in zip(cells, starts, ends)}
+    self.max_abs_lat = float(np.abs(self.lats).max()) if len(self.lats) else 0.0
+    self.rings = int(max(np.ptp(cx), np.ptp(cy))) + 1 if len(self.lats) else 0
+
+  @classmethod
+  def from_csv(cls, path, name='Name', lat='lat', lon='lon', cell_size=0.5):
+    """Load a csv with a name, latitude and longitude column, other columns are kept as well."""
+    df = pd.read_csv(path)
+    df = df.loc[:, ~df.columns.str.startswith('Unnamed')]
+    extra = {c: df[c].to_numpy() for c in df.columns if c not in (name, lat, lon)}
+    return cls(df[name].astype(str).to_numpy(), df[lat].to_numpy(), df[lon].to_numpy(), cell_size, **extra)
+
+  @classmethod
+  def from_geojson(cls, path, name='name', cell_size=0.5):
+    """Load the Point features of a GeoJSON FeatureCollection, named by their `name` (or `Name`) property."""
+    with open(path) as f:
+      features = [f for f in json.load(f)['features'] if (f.get('geometry') or {}).get('type') == 'Point']
+    names = [str(f['properties'].get(name, f['properties'].get(name.capitalize()))) for f in features]
+    coords = np.array([f['geometry']['coordinates'][:2] for f in features], dtype=np.float64).reshape(-1, 2)
+    return cls(names, coords[:, 1], coords[:, 0], cell_size)
+
+  @classmethod
+  def from_npz(cls, path, cell_size=0.5):
+    data = np.load(path, allow_pickle=True)
+    columns = {k[len('col_'):]: data[k] for k in data.files if k.startswith('col_')}
+    return cls(data['names'], data['lats'], data['lons'], cell_size, **columns)
+
+  @classmethod
+  def load(cls, path, cell_size=0.5):
+    """Load a .csv, .geojson / .json or .npz catalog."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.csv':
+      return cls.from_csv(path, cell_size=cell_size)
+    if ext in ('.geojson', '.json'):
+      return cls.from_geojson(path, cell_size=cell_size)
+    if ext == '.npz':
+      return cls.from_npz(path, cell_size=cell_size)
+    raise ValueError(f'Unknown poi catalog format: {path}')
+
+  def save_npz(self, path):
+    """Save the columns as one .npz, which loads faster than a large csv."""
+    np.savez(path, names=self.names.astype(str), lats=self.lats, lons=self.lons, **{f'col_{k}': v for k, v in self.columns.items()})
+
+  def __len__(self):
+    return len(self.names)
+
+  def __contains__(self, name):
+    return name in self.index
+
+  def row(self, row, distance_km=None):
+    poi = {'name': str(self.names[row]), 'lat': float(self.lats[row]), 'lon': float(self.lons[row])}
+    for k, v in self.columns.items():
+      poi[k] = v[row].item() if hasattr(v[row], 'item') else v[row]
+    if distance_km is not None:
+      poi['distance_km'] = float(distance_km)
+    return poi
+
+  def get(self, name):
+    """The poi named name as a dict, or None."""
+    row = self.index.get(name)
+    return None if row is None else self.row(row)
+
+  def _rows_in_cells(self, cells):
+    slices = [self.grid[c] for c in cells if c in self.grid]
+    if len(slices) == 0:
+      return np.empty(0, dtype=np.int64)
+    return np.concatenate([self.order[s:e] for s, e in slices])
+
+  def bbox(self, west, south, east, north):
+    """Pois inside a bounding box, in degrees with longitudes in [-180, 180]. A box with west > east crosses the antimeridian."""
+    spans = [(west, east)] if west <= east else [(west, 180.0), (-180.0, east)]
+    (y0, y1) = np.sort(self._cells([south, north], [0, 0])[1])
+    columns = set()
+    for (w, e) in spans:
+      if e - w >= 360:
+        columns.update(range(self.columns_count))
+        continue
+      (x0, x1) = self._cells([0, 0], [w, e])[0]
+      # x1 < x0 where the span ends at +180, which wraps to column 0
+      x1 = x1 if x1 >= x0 else self.columns_count - 1
+      columns.update(range(x0, x1 + 1))
+    cells = [(x, y) for x in columns for y in range(y0, y1 + 1)] if len(columns) * (y1 - y0 + 1) < len(self.grid) else list(self.grid)
+    rows = self._rows_in_cells(cells)
+    lons = self.lons[rows]
+    inside = np.zeros(len(rows), dtype=bool)
+    for (w, e) in spans:
+      inside |= (lons >= w) & (lons <= e)
+    inside &= (self.lats[rows] >= south) & (self.lats[rows] <= north)
+    return [self.row(r) for r in np.sort(rows[inside])]
+
+  def nearest(self, lat, lon, k=5, max_km=None):
+    """The k pois closest to a point, nearest first, with their 'distance_km'.
+    Searches rings of grid cells around the point, wrapping around at the antimeridian, until no cell further
+    out can hold anything closer, and falls back to all rows after max_rings rings.
+    """
+    if len(self) == 0:
+      return []
+    cx, cy = [int(c) for c in self._cells(lat, lon)]
+    # a row outside ring r is at least r cells away in latitude or in longitude
+    km_per_cell = self.cell_size * KM_PER_DEGREE * max(np.cos(np.radians(self.max_abs_lat)), 1e-3)
+    rows = np.empty(0, dtype=np.int64)
+    distances = np.empty(0)
+    searched = set()
+    for r in range(min(self.rings, self.max_rings) + 1):
+      if r == 0:
+        ring = [(cx, cy)]
+      else:
+        ring = [(cx + dx, cy + dy) for dx in range(-r, r + 1) for dy in (-r, r)] + \
+          [(cx + dx, cy + dy) for dx in (-r, r) for dy in range(-r + 1, r)]
+      # once a ring is wider than the globe its columns repeat, each cell is only searched once
+      ring = {(x % self.columns_count, y) for x, y in ring} - searched
+      searched |= ring
+      found = self._rows_in_cells(ring)
+      if len(found):
+        rows = np.concatenate([rows, found])
+        distances = np.concatenate([distances, haversine_km(lat, lon, self.lats[found], self.lons[found])])
+      bound = r * km_per_cell
+      if (max_km is not None and bound > max_km) or (len(rows) >= k and np.partition(distances, k - 1)[k - 1] <= bound):
+        return self._closest(rows, distances, k, max_km)
+    # far from the catalog's cells (or in a very sparse part): check every row
+    rows = np.arange(len(self))
+    return self._closest(rows, haversine_km(lat, lon, self.lats, self.lons), k, max_km)
+
+  def _closest(self, rows, distances, k, max_km):
+    picks = np.argsort(distances, kind='stable')[:k]
+    if max_km is not None:
+      picks = picks[distances[picks] <= max_km]
+    return [self.row(rows[i], distances[i]) for i in picks]
@@ -0,0 +1,60 @@
+import os
+import json
+import time
+from PIL import Image
+
+
+class JobProgress():
+  """Progress of one rendering run, published as files in its output folder so another process can show it.
+
+  progress.json holds the stage, frames done and total; preview.jpg is the
+  latest rendered frame. Both are replaced atomically. The preview is
+  written for the first frame right away and then at most every
+  preview_interval seconds, so it costs little next to the rendering.
+  """
+
+  def __init__(self, folder, preview_interval=1.0):
+    self.folder = folder
+    self.preview_interval = preview_interval
+    self.state = {'stage': 'starting', 'done': 0, 'total': None, 'preview': None, 'updated': time.time()}
+    self.last_preview = None
+
+  def _replace(self, name, write):
+    path = os.path.join(self.folder, name)
+    tmp = path + '.tmp'
+    write(tmp)
+    os.replace(tmp, path)
+    return path
+
+  def _save(self):
+    self.state['updated'] = time.time()
+
+    def write(tmp):
+      with open(tmp, 'w') as f:
+        json.dump(self.state, f)
+    self._replace('progress.json', write)
+
+  def stage(self, name, total=None):
+    self.state['stage'] = name
+    if total is not None:
+      self.state['total'] = total
+      self.state['done'] = 0
+    self._save()
+
+  def frame(self, done, total, frame=None):
+    """Record that done of total frames are rendered, frame being the latest (an rgb array)."""
+    self.state.update(stage='rendering', done=done, total=total)
+    now = time.monotonic()
+    if frame is not None and (self.last_preview is None or now - self.last_preview >= self.preview_interval):
+      self.last_preview = now
+      self.state['preview'] = self._replace('preview.jpg', lambda tmp: Image.fromarray(frame[:, :, :3]).save(tmp, format='jpeg', quality=85))
+    self._save()
+
+  @staticmethod
+  def read(folder):
+    """The last published state of the run in folder, or None before it started."""
+    try:
+      with open(os.path.join(folder, 'progress.json')) as f:
+        return json.load(f)
+    except (OSError, ValueError):
+      return None
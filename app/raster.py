@@ -0,0 +1,81 @@
+import numpy as np
+
+# bands that are computed locally from the downloaded ones
+DERIVED_BANDS = {
+  'VH-VV': lambda bands: bands['VH'] - bands['VV'],
+}
+
+
+def structured_to_bands(array):
+  """Split the structured array of an NPY download into {band: float32 2d array}."""
+  return {name: np.asarray(array[name], dtype=np.float32) for name in array.dtype.names}
+
+
+def source_bands(bands):
+  """The bands that have to be downloaded to compute the given bands."""
+  needed = []
+  for band in bands:
+    for source in (['VV', 'VH'] if band in DERIVED_BANDS else [band]):
+      if source not in needed:
+        needed.append(source)
+  return needed
+
+
+def band_stack(bands, names):
+  """Stack the named bands into a (len(names), y, x) array, computing derived bands on the fly."""
+  return np.stack([bands[name] if name in bands else DERIVED_BANDS[name](bands) for name in names])
+
+
+class BandStretch():
+  """Turns raw SAR backscatter into rgb pixels on the client.
+
+  limits are (mins, maxs) per output band. Without limits they are fitted
+  on the first scene: its min/max ('minmax') or the given percentiles
+  ('percentile'), like the server-side stretch but without a round-trip.
+  """
+
+  def __init__(self, bands=('VV', 'VH', 'VH-VV'), mode='minmax', percentiles=(2, 98), limits=None):
+    if mode not in ('minmax', 'percentile'):
+      raise ValueError(f'Unknown stretch mode: {mode}')
+    self.bands = list(bands)
+    self.mode = mode
+    self.percentiles = percentiles
+    self.limits = limits
+
+  @classmethod
+  def from_dict(cls, spec):
+    return cls(**spec)
+
+  def to_dict(self):
+    return {'bands': self.bands, 'mode': self.mode, 'percentiles': list(self.percentiles), 'limits': self.limits}
+
+  @classmethod
+  def from_minmax(cls, minmax, bands=('VV', 'VH', 'VH-VV')):
+    """The same stretch as Earth Engine's min/max vis params from a reduceRegion minMax ('<band>_min', '<band>_max')."""
+    return cls(bands, limits=([minmax[f'{b}_min'] for b in bands], [minmax[f'{b}_max'] for b in bands]))
+
+  def to_minmax(self):
+    return {f'{b}_{bound}': float(v) for bound, values in zip(('min', 'max'), self.limits) for b, v in zip(self.bands, values)}
+
+  def fit(self, bands):
+    stack = band_stack(bands, self.bands).reshape(len(self.bands), -1)
+    if self.mode == 'minmax':
+      mins, maxs = np.nanmin(stack, axis=1), np.nanmax(stack, axis=1)
+    else:
+      mins, maxs = np.nanpercentile(stack, self.percentiles, axis=1)
+    self.limits = (mins.tolist(), maxs.tolist())
+    return self
+
+  def apply(self, bands):
+    """Stretch {band: array} to a (y, x, 4) uint8 rgba image, no-data pixels are transparent."""
+    if self.limits is None:
+      self.fit(bands)
+    stack = band_stack(bands, self.bands)
+    mins = np.asarray(self.limits[0], dtype=np.float32)[:, None, None]
+    maxs = np.asarray(self.limits[1], dtype=np.float32)[:, None, None]
+    scaled = (stack - mins) / np.maximum(maxs - mins, np.finfo(np.float32).eps)
+    valid = np.all(np.isfinite(stack), axis=0)
+    rgb = (np.clip(np.nan_to_num(scaled), 0, 1) * 255).astype(np.uint8)
+    if len(rgb) == 1:
+      rgb = np.repeat(rgb, 3, axis=0)
+    return np.dstack([*rgb, valid.astype(np.uint8) * 255])
@@ -0,0 +1,143 @@
+import math
+import ee
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from imagery_utils import prefetch_metadata, fetch_band_array
+from aoi_grid import aoi_bounds, frame_shape, dimensions
+from ee_client import get_client
+from limits import check_memory
+from change_detection import scene_tracks, TRACK_PROPERTIES
+
+# the merged VV/VH float32 download of a group is kept below this, it is fetched in tiles but held in memory at once
+MAX_DOWNLOAD_PIXELS = 32 * 1024 ** 2 // 8
+# share of a poi's scenes the group must already download for the poi to join it
+MIN_SHARED_SCENES = 0.5
+
+
+def merged_bounds(pois):
+  bounds = np.array([aoi_bounds(poi) for poi in pois])
+  return [float(bounds[:, 0].min()), float(bounds[:, 1].min()), float(bounds[:, 2].max()), float(bounds[:, 3].max())]
+
+
+def single_shape(poi):
+  """(height, width) of a single poi download, as in Imagery.frame_shape."""
+  return frame_shape(aoi_bounds(poi))
+
+
+def pixel_size(poi):
+  """(east-west, north-south) degrees per pixel of a single poi download."""
+  west, south, east, north = aoi_bounds(poi)
+  (height, width) = single_shape(poi)
+  return ((east - west) / width, (north - south) / height)
+
+
+def poi_scenes(col, pois, start_date, end_date, client=None):
+  """{poi name: set of system:index} of the scenes that cover each poi's aoi in the date range, in one round-trip."""
+  col = col.filterDate(start_date, end_date)
+  info = {
+    poi['name']: col.filterBounds(ee.Geometry.Rectangle(aoi_bounds(poi))).aggregate_array('system:index')
+    for poi in pois
+  }
+  client = client or get_client()
+  names = client.run(client.evaluate(ee.Dictionary(info)))
+  return {name: set(ids) for name, ids in names.items()}
+
+
+def group_pois(pois, scenes):
+  """Split pois into groups that are covered by the same scenes and whose merged aoi fits into one download at the
+  single poi resolution. Greedy: every poi joins the first group that already downloads at least MIN_SHARED_SCENES of
+  its scenes and still fits, in west to east order.
+  Args:
+    pois (list): poi dicts.
+    scenes (dict): {poi name: set of scene ids}, see poi_scenes.
+  Returns:
+    list: Lists of pois.
+  """
+  groups = []
+  for poi in sorted(pois, key=lambda p: float(p['lon'])):
+    own = scenes.get(poi['name'], set())
+    for group in groups:
+      shared = own & set().union(*(scenes.get(p['name'], set()) for p in group))
+      if len(shared) < MIN_SHARED_SCENES * len(own):
+        continue
+      west, south, east, north = merged_bounds(group + [poi])
+      (px, py) = pixel_size(group[0])
+      if ((east - west) / px) * ((north - south) / py) <= MAX_DOWNLOAD_PIXELS:
+        group.append(poi)
+        break
+    else:
+      groups.append([poi])
+  return groups
+
+
+def crop(bands, bounds, poi_bounds, shape):
+  """Cut one poi out of a merged download.
+  Args:
+    bands (dict): {band: 2d array} covering bounds, north up.
+    bounds (list): [west, south, east, north] of the merged download.
+    poi_bounds (list): [west, south, east, north] of the poi.
+    shape (tuple): (height, width) of the poi's own downloads, the window is resampled (nearest) to it.
+  Returns:
+    dict: {band: 2d array}
+  """
+  height, width = next(iter(bands.values())).shape
+  px = (bounds[2] - bounds[0]) / width
+  py = (bounds[3] - bounds[1]) / height
+  cols = np.floor((poi_bounds[0] - bounds[0] + (np.arange(shape[1]) + 0.5) * (poi_bounds[2] - poi_bounds[0]) / shape[1]) / px).astype(int)
+  rows = np.floor((bounds[3] - poi_bounds[3] + (np.arange(shape[0]) + 0.5) * (poi_bounds[3] - poi_bounds[1]) / shape[0]) / py).astype(int)
+  window = np.ix_(np.clip(rows, 0, height - 1), np.clip(cols, 0, width - 1))
+  return {band: values[window] for band, values in bands.items()}
+
+
+def has_data(bands):
+  """False for a crop the scene does not cover (masked pixels come back as 0 or nan)."""
+  return any(bool(np.any(np.isfinite(v) & (v != 0))) for v in bands.values())
+
+
+def update_shared_cubes(imageries, workers=4):
+  """Fill the SceneCubes of a group of nearby pois with one download per scene.
+  The collection is queried once for the merged aoi, every missing scene is downloaded once for all pois and cropped
+  locally into each cube the scene covers. All pois need the same date range, the download uses the resolution of the
+  first poi.
+  Args:
+    imageries (list): Imagery objects with set_poi and col_final set, e.g. one group of group_pois.
+    workers (int, optional): Parallel downloads. Defaults to 4.
+  Returns:
+    dict: 'scenes' (in the date range), 'downloads' and 'stored' (scene crops added to cubes).
+  """
+  pois = [imagery.poi for imagery in imageries]
+  bounds = merged_bounds(pois)
+  (px, py) = pixel_size(pois[0])
+  region = ee.Geometry.Rectangle(bounds)
+  first = imageries[0]
+  col = first.col_final.filterDate(first.poi['start_date'], first.poi['end_date']).filterBounds(region)
+  col = col.map(lambda image: image.clip(region)).sort('system:time_start')
+  metadata = prefetch_metadata(col, date_format='YYYY-MM-dd', metrics=first.metrics, properties=TRACK_PROPERTIES)
+  tracks = scene_tracks(metadata)
+  images = col.toList(metadata['count'])
+  cubes = [imagery.open_cube() for imagery in imageries]
+  missing = [i for i, name in enumerate(metadata['names']) if not all(cube.has(name) for cube in cubes)]
+  # bounds instead of the geometry, so the download is split into tiles
+  vis_params = {
+    'region': bounds,
+    'dimensions': dimensions((math.ceil((bounds[3] - bounds[1]) / py), math.ceil((bounds[2] - bounds[0]) / px))),
+    'crs': 'EPSG:4326',
+  }
+  stored = []
+
+  def download(i):
+    check_memory()
+    name = metadata['names'][i]
+    bands = fetch_band_array(ee.Image(images.get(i)), cubes[0].bands, vis_params, cache=first.cache, scene_id=name, metrics=first.metrics)
+    for poi, cube in zip(pois, cubes):
+      if cube.has(name):
+        continue
+      shape = tuple(cube.scenes[0]['shape'][1:]) if len(cube) else single_shape(poi)
+      tile = crop(bands, bounds, aoi_bounds(poi), shape)
+      if has_data(tile):
+        cube.append(name, tile, metadata['dates'][i], metadata['times'][i], track=tracks[i])
+        stored.append(name)
+
+  with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+    list(pool.map(download, missing))
+  return {'scenes': metadata['count'], 'downloads': len(missing), 'stored': len(stored)}
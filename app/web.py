@@ -1,54 +1,131 @@
 import streamlit as st
 import os
+import time
 import datetime
-import base64
-import geemap as gee
 import pandas as pd
-from imagery import Imagery
+from jobs import JobQueue
+from poi_catalog import POICatalog
+from limits import env_int, env_size
 from map import map_component
 
 # page config
 st.set_page_config(page_title="SARveillance", page_icon="🛰️")
 
+# contrast stretch options, None is the poi's saved server-side min/max stretch (see Imagery.load_poi_stretch)
+STRETCHES = {
+  'Saved per-POI min/max (fitted on its first run)': None,
+  'Local min/max of first scene': {'mode': 'minmax'},
+  'Local 2-98 percentile of first scene': {'mode': 'percentile', 'percentiles': [2, 98]},
+}
+# animation formats: label, mime type
+DOWNLOAD_FORMATS = {
+  'gif': ('GIF', 'image/gif'),
+  'webp': ('Animated WebP (smaller)', 'image/webp'),
+  'mp4': ('MP4 video', 'video/mp4'),
+}
+COMPOSITES = {
+  'VV / VH / VH-VV': ['VV', 'VH', 'VH-VV'],
+  'VV (grayscale)': ['VV'],
+  'VH (grayscale)': ['VH'],
+}
+
+# cached per server process, so a rerun does not repeat them. geemap (and with it
+# matplotlib, cartopy, ...) is only imported once a timeseries is generated
+@st.cache_resource
+def get_ee_session():
+  import geemap as gee
+  gee.ee_initialize()
+  return gee
+
+@st.cache_resource
+def load_poi_catalog(path, mtime):
+  # mtime is only part of the cache key, so an edited catalog is read again
+  return POICatalog.load(path)
+
+@st.cache_resource
+def load_css(path):
+  with open(path) as f:
+    return f.read()
+
+@st.cache_resource
+def get_base_collection():
+  get_ee_session()
+  from imagery import Imagery
+  imagery = Imagery()
+  imagery.get_collection()
+  return imagery.col_final
+
+@st.cache_data(show_spinner=False)
+def load_aoi_statistics(name, lat, lon, buffer, start_date, end_date, outpath):
+  from aoi_stats import aoi_statistics
+  from frame_cache import FrameCache
+  poi = {'name': name, 'lat': lat, 'lon': lon, 'buffer': buffer}
+  return aoi_statistics(get_base_collection(), [poi], start_date, end_date, cache=FrameCache(os.path.join(outpath, 'FrameCache')))
+
+@st.cache_resource
+def get_job_queue(outpath, max_workers, render_workers, memory_limit):
+  # one queue per server process, shared by all sessions
+  return JobQueue(outpath, max_workers=max_workers, render_workers=render_workers, memory_limit=memory_limit)
+
 class SARVEILLANCE():
 
   def __init__(self):
-    self.gee = gee
-    self.bases = []
+    self.gee = None
+    self.bases = None
+    # poi table, a csv, GeoJSON or npz file, see POICatalog.load
+    self.catalog_path = 'poi/poi_df.csv'
+    # pois listed next to the map around a clicked point
+    self.nearby_count = 10
     self.poi = None
-    self.imagery = None
+    self.jobs = None
+    self.incremental = False
+    self.show_timings = False
+    self.stretch = None
+    # half the side of the aoi in metres, see aoi_grid
+    self.buffer = 3000
+    self.changes = False
+    # webp / mp4 written next to the gif
+    self.formats = []
     # ugly attempt to get the data folder path
     self.outpath = os.path.abspath(os.path.join(__file__, '..', '..', 'data'))
     self.max_frames=30
+    # how to fit long time spans into max_frames, see imagery_utils.choose_decimation
+    self.decimation = 'auto'
+    # parallel downloads / render processes per request
+    self.workers = min(4, os.cpu_count() or 1)
+    # timeseries jobs running at the same time, and the memory each of them may use
+    self.job_workers = env_int('SARVEILLANCE_JOB_WORKERS', 2)
+    self.job_memory = env_size('SARVEILLANCE_JOB_MEMORY')
+    # seconds between job status checks
+    self.poll_interval = 2
 
   def run(self):
-    self.setup_gee()
     self.load_bases()
-    self.init_imagery()
+    self.init_jobs()
     self.init_gui()
 
   def setup_gee(self):
     # self.gee.ee.Authenticate()
-    self.gee.ee_initialize()
+    self.gee = get_ee_session()
 
 
   def load_bases(self):
     # load csv data with places of interest
-    self.bases = pd.read_csv("poi/poi_df.csv")
+    self.bases = load_poi_catalog(self.catalog_path, os.path.getmtime(self.catalog_path))
 
-  def init_imagery(self):
-    self.imagery = Imagery()
-    self.imagery.get_collection()
+  def init_jobs(self):
+    self.jobs = get_job_queue(self.outpath, self.job_workers, self.workers, self.job_memory)
 
   def create_poi(self, type, name, start_date, end_date, lat=None, lon=None):
     if type == 'preset':
-      poi_data = self.bases.loc[self.bases['Name'] == name]
+      poi_data = self.bases.get(name)
       self.poi = {
         'name': name,
-        'lat': poi_data['lat'].values[0],
-        'lon': poi_data['lon'].values[0],
+        'lat': poi_data['lat'],
+        'lon': poi_data['lon'],
         'start_date': start_date,
-        'end_date': end_date
+        'end_date': end_date,
+        'buffer': self.buffer
       }
     elif type == 'custom':
       try:
@@ -62,21 +139,21 @@ class SARVEILLANCE():
         'lat': float(lat),
         'lon': float(lon),
         'start_date': start_date,
-        'end_date': end_date
+        'end_date': end_date,
+        'buffer': self.buffer
       }
     else:
       st.error('Error')
 
   def load_custom_css(self):
-    with open('app/custom.css') as f:
-      st.markdown(f'<style>{f.read()}</style>', unsafe_allow_html=True)
+    st.markdown(f"<style>{load_css('app/custom.css')}</style>", unsafe_allow_html=True)
 
   def init_gui(self):
     # load custom css
     self.load_custom_css()
 
     # prepare initial form data
-    poi_list = self.bases['Name'].tolist()
+    poi_list = self.bases.names.tolist()
     poi_list.insert(0, '---')
 
     # header
@@ -99,11 +176,18 @@ class SARVEILLANCE():
         lon_input = st.empty()
         lon = lon_input.text_input('Longitude (enter or click map)', '', placeholder='longitude')
 
-      # call map component and watch for return values
-      coordinates = map_component(key='map')
+      # call map component and watch for return values, the pois near the last click are drawn on the map
+      clicked = st.session_state.get('map')
+      nearby = self.bases.nearest(clicked[0], clicked[1], k=self.nearby_count) if clicked else []
+      coordinates = map_component(key='map', nearby=nearby)
       if coordinates:
         lat = lat_input.text_input('Select Latitude', value=coordinates[0])
         lon = lon_input.text_input('Select Longitude', value=coordinates[1])
+        if coordinates != clicked:
+          nearby = self.bases.nearest(coordinates[0], coordinates[1], k=self.nearby_count)
+        if nearby:
+          st.caption('Known locations nearby')
+          st.table(pd.DataFrame([{'name': p['name'], 'km': round(p['distance_km'], 1), 'lat': p['lat'], 'lon': p['lon']} for p in nearby]))
 
     # date picker for start & end date (form element)
     today = datetime.date.today()
@@ -116,6 +200,8 @@ class SARVEILLANCE():
     # format the dates and set class variables
     start_date = start_date.isoformat()
     end_date = end_date.isoformat()
+    # side of the square area around the location, the resolution follows from the 10 m Sentinel-1 pixels
+    self.buffer = st.slider('Area size (km)', 1, 40, 6) * 500
 
     if custom_name != '' and lat != '' and lon != '':
       self.create_poi('custom', custom_name, start_date, end_date, lat, lon)
@@ -126,56 +212,157 @@ class SARVEILLANCE():
       st.stop()
 
     if self.poi:
-      st.markdown(f"<div class='st-ae st-af st-ag st-ah st-ai st-aj st-ak st-al st-am st-b8 st-ao st-ap st-aq st-ar st-as st-at st-au st-av st-aw st-ax st-ay st-az st-b9 st-b1 st-b2 st-b3 st-b4 st-b5 st-b6' style='flex-direction: column;'><h6>Location: {self.poi['name']}</h6>Coordinates: [{self.poi['lat']}, {self.poi['lon']}]<br />Timespan: {self.poi['start_date']} - {self.poi['end_date']}</div><br />", unsafe_allow_html=True)
+      st.markdown(f"<div class='st-ae st-af st-ag st-ah st-ai st-aj st-ak st-al st-am st-b8 st-ao st-ap st-aq st-ar st-as st-at st-au st-av st-aw st-ax st-ay st-az st-b9 st-b1 st-b2 st-b3 st-b4 st-b5 st-b6' style='flex-direction: column;'><h6>Location: {self.poi['name']}</h6>Coordinates: [{self.poi['lat']}, {self.poi['lon']}]<br />Area: {2 * self.poi['buffer'] / 1000:g} km x {2 * self.poi['buffer'] / 1000:g} km<br />Timespan: {self.poi['start_date']} - {self.poi['end_date']}</div><br />", unsafe_allow_html=True)
+
+      self.incremental = st.checkbox('Reuse frames from earlier runs for this location (only render new scenes)')
+      self.show_timings = st.checkbox('Show timing breakdown')
+      self.changes = st.checkbox('Detect changes between scenes (downloads the raw values once)')
+      self.formats = st.multiselect('Also create', list(DOWNLOAD_FORMATS)[1:], format_func=lambda f: DOWNLOAD_FORMATS[f][0])
+      # reused frames keep the stretch they were rendered with
+      self.stretch = None
+      if not self.incremental:
+        with st.expander('Contrast stretch'):
+          col_stretch, col_composite = st.columns(2)
+          with col_stretch:
+            stretch = STRETCHES[st.selectbox('Stretch', list(STRETCHES))]
+          with col_composite:
+            bands = COMPOSITES[st.selectbox('Bands (local stretch only)', list(COMPOSITES))]
+          # local stretches reuse the downloaded raw values, so changing them is cheap
+          self.stretch = dict(stretch, bands=bands) if stretch is not None else None
+          if stretch is None and st.button('Refit the saved min/max on the next run'):
+            self.reset_stretch()
 
       # on submit
-      if st.button('Generate SAR Timeseries'):
-        self.generate()
+      col_generate, col_stats = st.columns(2)
+      with col_generate:
+        if st.button('Generate SAR Timeseries'):
+          self.generate()
+      with col_stats:
+        if st.button('Backscatter statistics only (no images)'):
+          st.session_state['stats_poi'] = self.stats_key()
+
+      if st.session_state.get('stats_poi') == self.stats_key():
+        self.show_statistics()
+      self.show_job()
 
 
   def generate(self):
-    with st.spinner('Loading timeseries... this may take a couple of minutes'):
-      self.imagery.set_poi(self.poi, self.outpath)
-      (err, msg) = self.imagery.generate_timeseries_gif(max_frames=self.max_frames)
+    # fail here rather than in the job if Earth Engine is not set up
+    self.setup_gee()
+    job = self.jobs.submit(self.poi, self.max_frames, incremental=self.incremental, decimation=self.decimation, stretch=self.stretch, changes=self.changes, formats=self.formats)
+    st.session_state['job_id'] = job.id
+
+  def reset_stretch(self):
+    # the saved stretch and the products rendered with it go, the next run fits it on its first scene
+    from imagery import Imagery
+    imagery = Imagery()
+    imagery.set_poi(dict(self.poi), self.outpath)
+    try:
+      imagery.reset_poi_stretch()
+    finally:
+      imagery.discard_run()
+    st.session_state.pop('job_id', None)
+    st.info(f"The saved stretch of {self.poi['name']} is fitted again on the first scene of the next run.")
 
+  def stats_key(self):
+    return (self.poi['name'], float(self.poi['lat']), float(self.poi['lon']), self.poi['buffer'], self.poi['start_date'], self.poi['end_date'])
+
+  def show_statistics(self):
+    with st.spinner('Computing AOI statistics...'):
+      df = load_aoi_statistics(*self.stats_key(), self.outpath)
+    if len(df) == 0:
+      st.error('No Sentinel-1 scenes found for this location and time span. Please choose a longer period!')
+      return
+    st.caption(f"Backscatter over the {2 * self.poi['buffer'] / 1000:g} km x {2 * self.poi['buffer'] / 1000:g} km area per scene (dB)")
+    bands = st.multiselect('Bands', ['VV', 'VH', 'VH-VV'], default=['VV', 'VH'])
+    stat = st.selectbox('Statistic', ['mean', 'median', 'p10', 'p90'])
+    st.line_chart(df.set_index('date')[[f'{band}_{stat}' for band in bands]])
+    col_csv, col_parquet = st.columns(2)
+    with col_csv:
+      st.download_button('Download CSV', df.to_csv(index=False), file_name='aoi_stats.csv', mime='text/csv')
+    with col_parquet:
+      try:
+        st.download_button('Download Parquet', df.to_parquet(index=False), file_name='aoi_stats.parquet', mime='application/octet-stream')
+      except ImportError:
+        st.caption('Parquet export needs pyarrow')
+
+  def show_job(self):
+    job = self.jobs.get(st.session_state.get('job_id'))
+    # only show the job belonging to the current form values
+    if job is None or job.key != JobQueue.job_key(self.poi, self.max_frames, self.incremental, self.decimation, self.stretch, self.changes, self.formats):
+      return
+
+    if job.status in ('queued', 'running'):
+      self.display_progress(job)
+      time.sleep(self.poll_interval)
+      st.rerun()
+
+    (err, msg, gif_loc, timings, changes) = job.result
+    if timings and self.show_timings:
+      self.display_timings(timings)
     if err:
       st.error(msg)
       st.stop()
     else:
       st.success('Done!')
-      self.display_gif()
-      self.show_download()
-
-  def display_gif(self):
-    # poi data
-    base_name = self.poi['name']
-    base_path = os.path.join(self.outpath, 'BaseTimeseries', base_name)
-    if not os.path.exists(base_path):
-      os.makedirs(base_path)
-    gif_loc = f'{base_path}/{base_name}.gif'
-    file_ = open(gif_loc, "rb")
-    contents = file_.read()
-    data_url = base64.b64encode(contents).decode("utf-8")
-    file_.close()
-    st.markdown(
-    f'<img align="left" width="704" height="704" src="data:image/gif;base64,{data_url}" alt="Base Timeseries">',
-    unsafe_allow_html=True)
-
-  def show_download(self):
-    # poi data
-    base_name = self.poi['name']  
-    base_path = os.path.join(self.outpath, 'BaseTimeseries', base_name)
-    if not os.path.exists(base_path):
-      os.makedirs(base_path) 
-    gif_loc = f'{base_path}/{base_name}.gif'
-
-    with open(gif_loc, "rb") as file:
-      btn = st.download_button(
-        label="Download image",
-        data=file,
-        file_name="timeseries.gif",
-        mime="image/gif"
-        )
+      if msg:
+        st.info(msg)
+      if changes:
+        col_gif, col_changes = st.columns(2)
+        with col_gif:
+          self.display_gif(gif_loc, width=None)
+        with col_changes:
+          self.display_changes(changes)
+      else:
+        self.display_gif(gif_loc)
+      self.show_download(gif_loc)
+
+  def display_progress(self, job):
+    progress = job.progress
+    if job.status == 'queued' or progress is None:
+      st.info(f'Timeseries job {job.id} is {job.status}... this may take a couple of minutes')
+      return
+    if progress['stage'] == 'rendering' and progress['total']:
+      st.progress(progress['done'] / progress['total'])
+      st.info(f"Rendered {progress['done']}/{progress['total']} frames")
+    else:
+      st.info(f"Timeseries job {job.id}: {progress['stage']}...")
+    # the latest frame, so the first results show up long before the gif is done
+    if progress.get('preview') and os.path.exists(progress['preview']):
+      st.image(progress['preview'], caption='Latest frame')
+
+  def display_timings(self, timings):
+    with st.expander(f"Timing breakdown ({timings['total_seconds']:.1f}s total)", expanded=True):
+      stages = pd.DataFrame([
+        {'stage': name, 'seconds': round(stage['seconds'], 2), 'calls': stage['count']}
+        for name, stage in sorted(timings['stages'].items(), key=lambda s: -s[1]['seconds'])
+      ])
+      st.table(stages)
+      if timings['counters']:
+        st.table(pd.DataFrame([{'counter': name, 'value': value} for name, value in sorted(timings['counters'].items())]))
+
+  def display_changes(self, changes):
+    st.image(changes['map'], caption=f"Largest change per pixel, pixels above {changes['threshold']} dB count as changed")
+    st.table(pd.DataFrame([
+      {'date': r['date'], 'changed %': round(100 * r['changed_fraction'], 1), 'mean dB': round(r['mean_change_db'], 2)}
+      for r in changes['ranked']
+    ]))
+
+  def display_gif(self, gif_loc, width=704):
+    # served as a media file by path instead of inlining the gif into the page
+    st.image(gif_loc, width=width, caption='Base Timeseries')
+
+  def show_download(self, gif_loc):
+    for fmt, (label, mime) in DOWNLOAD_FORMATS.items():
+      path = gif_loc[:-len('gif')] + fmt
+      if os.path.exists(path):
+        with open(path, "rb") as file:
+          st.download_button(
+            label=f"Download {label}",
+            data=file,
+            file_name=f"timeseries.{fmt}",
+            mime=mime
+            )
 
 
 if __name__ == '__main__':
@@ -0,0 +1,61 @@
+"""Drive EEClient against the local fake thumbnail server, which answers 429 above a concurrency quota.
+
+    python benchmarks/bench_ee_client.py --requests 100 --quota 4 --concurrency 2 4 8 16 --latency 0.2
+
+For each client concurrency it reports throughput, the 429s the server sent
+and the client's retries. A concurrency at the quota keeps it saturated
+without any 429s; above it the retries with backoff still complete every request.
+"""
+import os
+import sys
+import time
+import argparse
+
+from fake_ee import ThumbnailServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+from ee_client import EEClient
+
+
+def run(server, requests, concurrency, timeout, retries):
+  client = EEClient(concurrency=concurrency, timeout=timeout, retries=retries, backoff=0.05)
+  server.inflight['throttled'] = 0
+  start = time.perf_counter()
+  try:
+    contents = client.run(client.gather([client.get(f'{server.url}/thumb/{i}') for i in range(requests)]))
+  finally:
+    client.close()
+  seconds = time.perf_counter() - start
+  return {
+    'concurrency': concurrency,
+    'seconds': seconds,
+    'requests_per_second': requests / seconds,
+    'bytes': sum(len(c) for c in contents),
+    'throttled': server.inflight['throttled'],
+    **client.stats,
+  }
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--requests', type=int, default=100)
+  parser.add_argument('--quota', type=int, default=4, help='requests the server serves at the same time')
+  parser.add_argument('--concurrency', type=int, nargs='+', default=[2, 4, 8, 16])
+  parser.add_argument('--latency', type=float, default=0.2, help='seconds per thumbnail')
+  parser.add_argument('--dims', type=int, default=100)
+  parser.add_argument('--timeout', type=float, default=10)
+  parser.add_argument('--retries', type=int, default=10)
+  args = parser.parse_args()
+
+  server = ThumbnailServer(args.latency, args.dims, max_concurrent=args.quota)
+  try:
+    print(f"{'concurrency':>11} {'seconds':>8} {'req/s':>7} {'429s':>6} {'retries':>7} {'failures':>8}")
+    for concurrency in args.concurrency:
+      r = run(server, args.requests, concurrency, args.timeout, args.retries)
+      print(f"{r['concurrency']:>11} {r['seconds']:>8.2f} {r['requests_per_second']:>7.1f} {r['throttled']:>6} {r['retries']:>7} {r['failures']:>8}")
+  finally:
+    server.shutdown()
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,152 @@
+"""Time each stage of the imagery pipeline against the local Earth Engine stand-in.
+
+    python benchmarks/bench_pipeline.py --frames 1 10 30 100 --latency 0.5 --out bench.json
+    python benchmarks/bench_pipeline.py --frames 30 --compare bench.json
+
+Every frame count runs in its own subprocess so peak RSS is measured per run.
+Stages: metadata (prefetch_metadata), download (fetch_thumbnail),
+plot (render_frame), save (png per frame), encode (gif writer), and
+pipeline (Imagery.generate_timeseries_gif end to end, with an empty cache).
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import resource
+import tempfile
+import datetime
+import subprocess
+from collections import defaultdict
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+POI = {
+  'name': 'Benchmark',
+  'lat': 52.73937,
+  'lon': 32.02741,
+  'start_date': '2022-01-01',
+  'end_date': '2030-01-01',
+}
+
+
+def run_single(frames, latency, thumb_latency, dims):
+  import fake_ee
+  fake_ee.install()
+  sys.path.insert(0, os.path.join(HERE, '..', 'app'))
+  from PIL import Image
+  from imagery import Imagery
+  from encoders import FrameEncoder
+  from imagery_utils import prefetch_metadata, fetch_thumbnail, render_frame
+
+  server = fake_ee.ThumbnailServer(thumb_latency, dims)
+  fake_ee.configure(scenes=frames, latency=latency, thumb_url=server.url)
+  out_dir = tempfile.mkdtemp(prefix='sarveillance-bench-')
+  stages = defaultdict(float)
+  try:
+    imagery = Imagery()
+    imagery.get_collection()
+    imagery.set_poi(dict(POI), out_dir)
+    col_filtered = imagery.filtered_timeseries()
+    aoi = imagery.generate_base_aoi()
+
+    start = time.perf_counter()
+    metadata = prefetch_metadata(col_filtered, stretch_region=aoi)
+    stages['metadata'] = time.perf_counter() - start
+
+    vis_params = imagery.vis_params(metadata['minmax'])
+    region = imagery.plot_region()
+    images = col_filtered.toList(metadata['count'])
+    with FrameEncoder(out_gif=os.path.join(out_dir, 'stages.gif'), fps=2) as encoder:
+      for i in range(metadata['count']):
+        t0 = time.perf_counter()
+        thumbnail = fetch_thumbnail(fake_ee.Image(images.get(i)), vis_params, region)
+        t1 = time.perf_counter()
+        frame = render_frame(thumbnail, region, title=f"{POI['name']} {metadata['dates'][i]}", **imagery.plot_args())
+        t2 = time.perf_counter()
+        Image.fromarray(frame).save(os.path.join(out_dir, f'{i}.png'))
+        t3 = time.perf_counter()
+        encoder.append(frame)
+        t4 = time.perf_counter()
+        stages['download'] += t1 - t0
+        stages['plot'] += t2 - t1
+        stages['save'] += t3 - t2
+        stages['encode'] += t4 - t3
+
+    fake_ee.configure(scenes=frames, latency=latency, thumb_url=server.url)
+    start = time.perf_counter()
+    (err, msg) = imagery.generate_timeseries_gif(max_frames=frames, decimation=None)
+    stages['pipeline'] = time.perf_counter() - start
+    if err:
+      raise RuntimeError(msg)
+    round_trips = fake_ee.stats['round_trips']
+  finally:
+    server.shutdown()
+    shutil.rmtree(out_dir)
+
+  return {
+    'frames': frames,
+    'stages': dict(stages),
+    'frames_per_second': frames / stages['pipeline'],
+    'round_trips': round_trips,
+    # ru_maxrss is in KiB on Linux
+    'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+  }
+
+
+def compare(results, baseline_path):
+  with open(baseline_path) as f:
+    baseline = {r['frames']: r for r in json.load(f)['runs']}
+  for run in results['runs']:
+    base = baseline.get(run['frames'])
+    if base is None:
+      continue
+    print(f"{run['frames']} frames vs {baseline_path}:")
+    for stage, seconds in run['stages'].items():
+      if base['stages'].get(stage):
+        print(f"  {stage:10} {seconds:8.3f}s  ({seconds / base['stages'][stage]:.2f}x)")
+    print(f"  {'peak rss':10} {run['peak_rss_mb']:8.1f}MB ({run['peak_rss_mb'] / base['peak_rss_mb']:.2f}x)")
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--frames', type=int, nargs='+', default=[1, 10, 30, 100])
+  parser.add_argument('--latency', type=float, default=0.0, help='seconds per EE round-trip')
+  parser.add_argument('--thumb-latency', type=float, default=0.0, help='seconds per thumbnail download')
+  parser.add_argument('--dims', type=int, default=500)
+  parser.add_argument('--out', default='bench_pipeline.json', help='machine-readable results')
+  parser.add_argument('--compare', default=None, help='earlier results file to compare against')
+  parser.add_argument('--single', type=int, default=None, help=argparse.SUPPRESS)
+  args = parser.parse_args()
+
+  if args.single is not None:
+    print(json.dumps(run_single(args.single, args.latency, args.thumb_latency, args.dims)))
+    sys.exit(0)
+
+  runs = []
+  for frames in args.frames:
+    out = subprocess.run(
+      [sys.executable, os.path.abspath(__file__), '--single', str(frames), '--latency', str(args.latency),
+       '--thumb-latency', str(args.thumb_latency), '--dims', str(args.dims)],
+      check=True, capture_output=True, text=True)
+    run = json.loads(out.stdout.strip().splitlines()[-1])
+    runs.append(run)
+    stages = '  '.join(f"{k}={v:.2f}s" for k, v in run['stages'].items())
+    print(f"{frames:4d} frames: {run['frames_per_second']:.2f} frames/s, peak rss {run['peak_rss_mb']:.0f}MB  {stages}")
+
+  results = {
+    'created': datetime.datetime.now().isoformat(timespec='seconds'),
+    'python': platform.python_version(),
+    'cpus': os.cpu_count(),
+    'latency': args.latency,
+    'thumb_latency': args.thumb_latency,
+    'dims': args.dims,
+    'runs': runs,
+  }
+  with open(args.out, 'w') as f:
+    json.dump(results, f, indent=2)
+  print(f"results written to {args.out}")
+  if args.compare:
+    compare(results, args.compare)
@@ -0,0 +1,72 @@
+"""Compare sequential and parallel frame rendering against a local fake of the EE thumbnail endpoint.
+
+    python benchmarks/bench_render.py --frames 30 --workers 4 --latency 0.5
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+from fake_ee import ThumbnailServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+from imagery_utils import render_frames
+from encoders import FrameEncoder
+
+
+class FakeImage():
+  """Stands in for ee.Image: only getThumbUrl is needed by render_frames."""
+
+  def __init__(self, url, index):
+    self.url = url
+    self.index = index
+
+  def getThumbUrl(self, args):
+    return f'{self.url}/thumb/{self.index}'
+
+
+def run(url, frames, workers, out_dir, dims):
+  images = [FakeImage(url, i) for i in range(frames)]
+  titles = [f'Benchmark 2022-01-{str(i % 28 + 1).zfill(2)}' for i in range(frames)]
+  rendered = []
+  start = time.perf_counter()
+  with FrameEncoder(out_gif=os.path.join(out_dir, 'bench.gif'), fps=2) as encoder:
+    def on_frame(i, frame):
+      rendered.append(i)
+      encoder.append(frame, f'scene{i}')
+    render_frames(
+      images=images,
+      titles=titles,
+      vis_params={'dimensions': dims},
+      region=[32.4, 52.3, 31.6, 53.1],
+      on_frame=on_frame,
+      workers=workers,
+      verbose=False,
+      grid_interval=(0.2, 0.2),
+    )
+  elapsed = time.perf_counter() - start
+  assert rendered == list(range(frames))
+  return elapsed
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--frames', type=int, default=30)
+  parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+  parser.add_argument('--latency', type=float, default=0.5, help='seconds per thumbnail request')
+  parser.add_argument('--dims', type=int, default=500)
+  args = parser.parse_args()
+
+  server = ThumbnailServer(args.latency, args.dims)
+  results = {}
+  for workers in (1, args.workers):
+    out_dir = tempfile.mkdtemp(prefix='sarveillance-bench-')
+    try:
+      results[workers] = run(server.url, args.frames, workers, out_dir, args.dims)
+    finally:
+      shutil.rmtree(out_dir)
+    print(f'workers={workers}: {results[workers]:.2f}s ({args.frames / results[workers]:.2f} frames/s)')
+  server.shutdown()
+  print(f'speedup: {results[1] / results[args.workers]:.2f}x')
@@ -0,0 +1,83 @@
+"""Run many timeseries jobs one after another in one worker and watch its memory.
+
+    python benchmarks/bench_soak.py --jobs 100 --frames 10 --workers 2
+
+The jobs go through jobs.run_timeseries_job, like in a JobQueue worker, against
+the local Earth Engine stand-in, also in the render processes. The resident set
+size of the worker and its render processes is sampled after every job; after a
+warm-up it should stay flat. Exits with 1 if it grows by more than
+--max-growth-mb between the end of the warm-up and the last job.
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+POI = {
+  'name': 'Soak',
+  'lat': 52.73937,
+  'lon': 32.02741,
+  'start_date': '2022-01-01',
+  'end_date': '2030-01-01',
+}
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--jobs', type=int, default=100)
+  parser.add_argument('--frames', type=int, default=10)
+  parser.add_argument('--workers', type=int, default=1, help='render processes per job')
+  parser.add_argument('--dims', type=int, default=300)
+  parser.add_argument('--warmup', type=int, default=10, help='jobs before the baseline sample')
+  parser.add_argument('--max-growth-mb', type=float, default=50)
+  parser.add_argument('--out', default=None, help='write the rss samples as json')
+  args = parser.parse_args()
+
+  import fake_ee
+  fake_ee.install()
+  sys.path.insert(0, os.path.join(HERE, '..', 'app'))
+  import jobs
+  import imagery_utils
+  from imagery import Imagery
+  from limits import tree_rss
+  # the render processes of --workers > 1 import the app modules again
+  imagery_utils.render_initializer = fake_ee.install
+
+  server = fake_ee.ThumbnailServer(0.0, args.dims)
+  fake_ee.configure(scenes=args.frames, latency=0.0, thumb_url=server.url)
+  out_dir = tempfile.mkdtemp(prefix='sarveillance-soak-')
+  # what init_worker sets up, without a real Earth Engine session
+  jobs._imagery = Imagery()
+  jobs._imagery.get_collection()
+  samples = []
+  failed = 0
+  try:
+    for i in range(args.jobs):
+      job_id = f'soak{i:04d}'
+      (err, msg, gif, timings, report) = jobs.run_timeseries_job(job_id, dict(POI), out_dir, args.frames, args.workers, decimation=None)
+      failed += bool(err)
+      # job folders would otherwise fill the disk, the cache is kept like in production
+      shutil.rmtree(os.path.join(out_dir, 'BaseTimeseries', POI['name'], job_id), ignore_errors=True)
+      # the worker and any render processes it left running
+      samples.append(tree_rss() / 1024 ** 2)
+      if (i + 1) % 10 == 0:
+        print(f'{i + 1:4d} jobs: rss {samples[-1]:7.1f}MB')
+  finally:
+    server.shutdown()
+    shutil.rmtree(out_dir)
+
+  warm = samples[min(args.warmup, len(samples)) - 1]
+  growth = samples[-1] - warm
+  print(f'rss after warm-up {warm:.1f}MB, after {len(samples)} jobs {samples[-1]:.1f}MB (max {max(samples):.1f}MB), growth {growth:+.1f}MB, {failed} failed')
+  if args.out:
+    with open(args.out, 'w') as f:
+      json.dump({'rss_mb': samples, 'failed': failed, 'frames': args.frames, 'workers': args.workers}, f, indent=2)
+  sys.exit(1 if growth > args.max_growth_mb or failed else 0)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,77 @@
+"""Time the start of the web app and of a rerun, outside of a Streamlit server.
+
+    python benchmarks/bench_startup.py --runs 5
+
+Every measurement runs in a fresh interpreter:
+  import      importing app/web.py (what a cold start pays before the first page)
+  first run   the setup SARVEILLANCE.run does on the first page load
+  rerun       the same setup again, which is what every widget interaction pays
+  geemap      importing geemap alone, which web.py no longer does at start
+It also lists which heavy modules were loaded by the import and the first run.
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+HEAVY = ['geemap', 'ee', 'matplotlib', 'cartopy', 'cv2', 'imageio']
+
+APP = '''
+import sys, time, json
+sys.path.insert(0, 'app')
+start = time.perf_counter()
+import web
+imported = time.perf_counter()
+def setup():
+  sar = web.SARVEILLANCE()
+  sar.load_bases()
+  sar.init_jobs()
+  return sar
+setup()
+first = time.perf_counter()
+setup()
+rerun = time.perf_counter()
+print(json.dumps({
+  'import': imported - start,
+  'first run': first - imported,
+  'rerun': rerun - first,
+  'loaded': [m for m in %r if m in sys.modules],
+}))
+'''
+
+GEEMAP = '''
+import time, json
+start = time.perf_counter()
+import geemap
+print(json.dumps({'geemap': time.perf_counter() - start}))
+'''
+
+
+def measure(code):
+  out = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True)
+  return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--runs', type=int, default=5)
+  args = parser.parse_args()
+
+  results = [measure(APP % HEAVY) for _ in range(args.runs)]
+  try:
+    results = [dict(r, **measure(GEEMAP)) for r in results]
+  except subprocess.CalledProcessError:
+    print('geemap is not installed, skipping its import time')
+
+  for name in ['import', 'first run', 'rerun', 'geemap']:
+    if name in results[0]:
+      values = [r[name] for r in results]
+      print(f'{name:>10}: median {statistics.median(values) * 1000:8.1f} ms  (min {min(values) * 1000:.1f}, max {max(values) * 1000:.1f})')
+  print(f"heavy modules loaded at start: {', '.join(results[0]['loaded']) or 'none'}")
+
+
+if __name__ == '__main__':
+  main()
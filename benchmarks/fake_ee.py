@@ -0,0 +1,577 @@
+"""Local stand-in for the parts of the Earth Engine API used by the imagery pipeline.
+
+Install it before importing the app modules:
+
+    import fake_ee
+    fake_ee.install()
+    fake_ee.configure(scenes=30, latency=0.5, thumb_url=server_url)
+
+Processes started with spawn import the app modules again, run install()
+in them first, e.g. as imagery_utils.render_initializer.
+
+Everything is evaluated on the client. Every getInfo() and getThumbUrl()
+call counts as one round-trip and sleeps for the configured latency.
+Thumbnails are served by ThumbnailServer and are deterministic per scene.
+"""
+import re
+import sys
+import json
+import time
+import math
+import calendar
+import datetime
+import threading
+from io import BytesIO
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+from PIL import Image as PILImage
+
+__version__ = '0.0.0-fake'
+
+config = {
+  'scenes': 30,
+  'latency': 0.0,
+  'thumb_url': 'http://127.0.0.1:0',
+  'start': '2022-01-01',
+  'revisit_days': 2,
+}
+stats = {'round_trips': 0}
+_stats_lock = threading.Lock()
+
+
+def install():
+  """Make `import ee` load this module in the current process."""
+  sys.modules['ee'] = sys.modules[__name__]
+
+
+def configure(**kwargs):
+  config.update(kwargs)
+  stats['round_trips'] = 0
+
+
+def _round_trip():
+  with _stats_lock:
+    stats['round_trips'] += 1
+  time.sleep(config['latency'])
+
+
+def _millis(value):
+  if isinstance(value, ComputedObject):
+    return _millis(value.value)
+  if isinstance(value, str):
+    day = datetime.datetime.strptime(value[:10], '%Y-%m-%d').replace(tzinfo=datetime.timezone.utc)
+    return int(day.timestamp() * 1000)
+  return int(value)
+
+
+def _resolve(value):
+  if isinstance(value, ComputedObject):
+    return _resolve(value.value)
+  if isinstance(value, dict):
+    return {k: _resolve(v) for k, v in value.items()}
+  if isinstance(value, (list, tuple)):
+    return [_resolve(v) for v in value]
+  return value
+
+
+def Initialize(*args, **kwargs):
+  pass
+
+
+class EEException(Exception):
+  pass
+
+
+class ComputedObject():
+
+  def __init__(self, value=None):
+    self.value = value
+
+  def getInfo(self):
+    _round_trip()
+    return _resolve(self)
+
+  def serialize(self):
+    return json.dumps(_resolve(self), sort_keys=True, default=repr)
+
+
+class Number(ComputedObject):
+
+  def gt(self, other):
+    return Number(_resolve(self) > _resolve(other))
+
+  def multiply(self, other):
+    return Number(_resolve(self) * _resolve(other))
+
+  def divide(self, other):
+    return Number(_resolve(self) / _resolve(other))
+
+  def subtract(self, other):
+    return Number(_resolve(self) - _resolve(other))
+
+  def ceil(self):
+    return Number(math.ceil(_resolve(self)))
+
+  def format(self, pattern='%s'):
+    return String(pattern % _resolve(self))
+
+
+class String(ComputedObject):
+
+  def cat(self, other):
+    return String(_resolve(self) + _resolve(other))
+
+
+class Dictionary(ComputedObject):
+
+  def __init__(self, value=None):
+    super().__init__(dict(value or {}))
+
+  def getNumber(self, key):
+    return Number(self.value[key])
+
+
+class List(ComputedObject):
+
+  def __init__(self, value=None):
+    super().__init__(list(value or []))
+
+  def get(self, index):
+    return self.value[_resolve(index)]
+
+  def map(self, fn):
+    return List([fn(v) for v in self.value])
+
+  def size(self):
+    return Number(len(self.value))
+
+  @staticmethod
+  def sequence(start, end):
+    return List(range(int(_resolve(start)), int(_resolve(end)) + 1))
+
+
+class Date(ComputedObject):
+
+  def __init__(self, value):
+    super().__init__(_millis(value))
+
+  def format(self, fmt='YYYY-MM-dd'):
+    day = datetime.datetime.fromtimestamp(self.value / 1000, tz=datetime.timezone.utc)
+    pattern = fmt.replace('YYYY', '%Y').replace('MM', '%m').replace('dd', '%d')
+    return String(day.strftime(pattern))
+
+  def millis(self):
+    return Number(self.value)
+
+  def _datetime(self):
+    return datetime.datetime.fromtimestamp(self.value / 1000, tz=datetime.timezone.utc)
+
+  def advance(self, delta, unit):
+    delta = _resolve(delta)
+    if unit in _UNIT_MILLIS:
+      return Date(self.value + int(delta * _UNIT_MILLIS[unit]))
+    months = delta * (12 if unit == 'year' else 1)
+    return Date(int(_add_months(self._datetime(), int(months)).timestamp() * 1000))
+
+  def difference(self, start, unit):
+    """Fractional number of units from start to this date, months count calendar months like Earth Engine."""
+    start = Date(start)
+    if unit in _UNIT_MILLIS:
+      return Number((self.value - start.value) / _UNIT_MILLIS[unit])
+    months = 0
+    while start.advance(months + 1, 'month').value <= self.value:
+      months += 1
+    period_start = start.advance(months, 'month').value
+    period_end = start.advance(months + 1, 'month').value
+    months += (self.value - period_start) / (period_end - period_start)
+    return Number(months / 12 if unit == 'year' else months)
+
+
+_UNIT_MILLIS = {'second': 1000, 'minute': 60000, 'hour': 3600000, 'day': 86400000, 'week': 7 * 86400000}
+
+
+def _add_months(day, months):
+  month = day.month - 1 + months
+  year = day.year + month // 12
+  month = month % 12 + 1
+  return day.replace(year=year, month=month, day=min(day.day, calendar.monthrange(year, month)[1]))
+
+
+class Filter():
+
+  def __init__(self, kind, name=None, value=None):
+    self.kind = kind
+    self.name = name
+    self.value = value
+
+  @staticmethod
+  def listContains(name, value):
+    return Filter('pass')
+
+  @staticmethod
+  def eq(name, value):
+    return Filter('pass')
+
+  @staticmethod
+  def gt(name, value):
+    return Filter('gt', name, value)
+
+  def test(self, image):
+    if self.kind == 'gt':
+      return image.props[self.name] > _resolve(self.value)
+    return True
+
+
+class Geometry(ComputedObject):
+
+  @staticmethod
+  def Point(coords):
+    return Geometry({'type': 'Point', 'coordinates': list(coords)})
+
+  @staticmethod
+  def Rectangle(coords):
+    return Geometry({'type': 'Rectangle', 'coordinates': list(coords)})
+
+  def buffer(self, distance):
+    return Geometry({'type': 'Buffer', 'of': self.value, 'distance': distance})
+
+  def bounds(self):
+    return Geometry({'type': 'Bounds', 'of': self.value})
+
+
+class Reducer():
+  """outputs are the suffixes the reducer appends to the band names."""
+
+  def __init__(self, outputs=()):
+    self.outputs = list(outputs)
+
+  @staticmethod
+  def minMax():
+    return Reducer(['min', 'max'])
+
+  @staticmethod
+  def mean():
+    return Reducer(['mean'])
+
+  @staticmethod
+  def median():
+    return Reducer(['median'])
+
+  @staticmethod
+  def percentile(percentiles):
+    return Reducer([f'p{p}' for p in percentiles])
+
+  def combine(self, other, outputPrefix='', sharedInputs=False):
+    return Reducer(self.outputs + other.outputs)
+
+
+class Feature(ComputedObject):
+
+  def __init__(self, geometry, properties=None):
+    super().__init__({'type': 'Feature', 'geometry': geometry, 'properties': dict(_resolve(properties) or {})})
+
+  @property
+  def props(self):
+    return self.value['properties']
+
+  def set(self, *args):
+    feature = Feature(self.value['geometry'], self.props)
+    feature.props.update(dict(zip(args[::2], [_resolve(v) for v in args[1::2]])))
+    return feature
+
+  def toDictionary(self):
+    return Dictionary(self.props)
+
+
+class FeatureCollection(ComputedObject):
+
+  def __init__(self, features):
+    super().__init__({'type': 'FeatureCollection', 'features': list(features)})
+
+  @property
+  def features(self):
+    return self.value['features']
+
+  def geometry(self):
+    return Geometry({'type': 'Union', 'of': [f.value['geometry'] for f in self.features]})
+
+  def filterBounds(self, geometry):
+    return self
+
+  def map(self, fn):
+    return FeatureCollection(fn(f) for f in self.features)
+
+
+class Algorithms():
+
+  @staticmethod
+  def If(condition, true_case, false_case):
+    return _If(condition, true_case, false_case)
+
+
+class _If(ComputedObject):
+
+  def __init__(self, condition, true_case, false_case):
+    super().__init__(None)
+    self.condition = condition
+    self.cases = (true_case, false_case)
+
+  @property
+  def value(self):
+    return self.cases[0] if _resolve(self.condition) else self.cases[1]
+
+  @value.setter
+  def value(self, _):
+    pass
+
+
+class Image(ComputedObject):
+  """A synthetic scene. Band math and clipping keep the scene unchanged."""
+
+  def __new__(cls, scene=None):
+    if isinstance(scene, Image):
+      return scene
+    return super().__new__(cls)
+
+  def __init__(self, scene=None):
+    if isinstance(scene, Image):
+      return
+    super().__init__(None)
+    self.props = dict(scene or {})
+
+  def select(self, *args):
+    image = Image(self.props)
+    image.bands = args[0] if len(args) == 1 and isinstance(args[0], list) else list(args)
+    return image
+
+  def get(self, prop):
+    return self.props.get(prop)
+
+  def date(self):
+    return Date(self.props['system:time_start'])
+
+  def geometry(self):
+    return Geometry({'type': 'Footprint', 'of': self.props.get('index')})
+
+  def subtract(self, other):
+    return self
+
+  def rename(self, *args):
+    return self
+
+  def addBands(self, other):
+    return self
+
+  def clip(self, geometry):
+    return self
+
+  def set(self, *args):
+    image = Image(self.props)
+    image.props.update(dict(zip(args[::2], [_resolve(v) for v in args[1::2]])))
+    return image
+
+  def reduceRegion(self, reducer, geometry=None, *args, **kwargs):
+    return Dictionary({
+      'VV_min': -25.0, 'VV_max': 5.0,
+      'VH_min': -32.0, 'VH_max': -2.0,
+      'VH-VV_min': -15.0, 'VH-VV_max': 2.0,
+    })
+
+  def reduceRegions(self, collection, reducer, scale=None, *args, **kwargs):
+    """Made up statistics in dB that depend on the scene and band, percentiles spread around the mean."""
+    offsets = {'min': -10.0, 'max': 10.0, 'mean': 0.0, 'median': 0.5}
+    levels = {'VV': -12.0, 'VH': -19.0, 'VH-VV': -7.0}
+    bands = getattr(self, 'bands', None) or ['VV', 'VH']
+    features = []
+    for feature in collection.features:
+      stats = {}
+      for band in bands:
+        base = levels.get(band, -10.0) + 0.1 * self.props.get('index', 0)
+        for output in reducer.outputs:
+          stats[f'{band}_{output}'] = base + offsets.get(output, (int(output[1:]) - 50) / 10 if output.startswith('p') else 0.0)
+      features.append(feature.set(*[v for item in stats.items() for v in item]))
+    return FeatureCollection(features)
+
+  def getThumbUrl(self, params):
+    _round_trip()
+    return f"{config['thumb_url']}/thumb/{self.props['index']}"
+
+  def getDownloadURL(self, params):
+    _round_trip()
+    return f"{config['thumb_url']}/npy/{self.props['index']}"
+
+
+class ImageCollection(ComputedObject):
+
+  def __init__(self, source=None):
+    if isinstance(source, (list, List)):
+      images = _resolve_images(source)
+    else:
+      start = _millis(config['start'])
+      step = config['revisit_days'] * 86400000
+      images = []
+      for i in range(config['scenes']):
+        time_start = start + i * step
+        day = datetime.datetime.fromtimestamp(time_start / 1000, tz=datetime.timezone.utc)
+        images.append(Image({
+          'index': i,
+          'system:index': f"S1A_IW_GRDH_1SDV_{day.strftime('%Y%m%dT%H%M%S')}_FAKE{str(i).zfill(4)}",
+          'system:time_start': time_start,
+          # alternating ascending and descending passes, like a site covered by two tracks
+          'orbitProperties_pass': 'ASCENDING' if i % 2 == 0 else 'DESCENDING',
+          'relativeOrbitNumber_start': 15 if i % 2 == 0 else 88,
+        }))
+    super().__init__(images)
+
+  @staticmethod
+  def fromImages(images):
+    return ImageCollection(images)
+
+  def _with(self, images):
+    return ImageCollection(list(images))
+
+  def filter(self, f):
+    return self._with(i for i in self.value if f.test(i))
+
+  def filterDate(self, start, end=None):
+    start = _millis(start)
+    end = _millis(end) if end is not None else float('inf')
+    return self._with(i for i in self.value if start <= i.props['system:time_start'] < end)
+
+  def filterBounds(self, geometry):
+    return self
+
+  def map(self, fn):
+    return self._with(fn(i) for i in self.value)
+
+  def sort(self, prop, ascending=True):
+    return self._with(sorted(self.value, key=lambda i: i.props[prop], reverse=not ascending))
+
+  def limit(self, count, prop=None, ascending=True):
+    images = self.sort(prop, ascending).value if prop is not None else self.value
+    return self._with(images[:count])
+
+  def first(self):
+    return self.value[0] if self.value else Image()
+
+  def size(self):
+    return Number(len(self.value))
+
+  def aggregate_array(self, prop):
+    return List(i.props[prop] for i in self.value)
+
+  def toList(self, count):
+    return List(self.value[:_resolve(count)])
+
+  def median(self):
+    return self.value[0] if self.value else Image()
+
+  def aggregate_max(self, prop):
+    return Number(max((i.props[prop] for i in self.value), default=None))
+
+  def flatten(self):
+    """Of a collection mapped to FeatureCollections, e.g. by reduceRegions."""
+    return FeatureCollection(f for fc in self.value for f in fc.features)
+
+
+def _resolve_images(source):
+  return list(source.value if isinstance(source, List) else source)
+
+
+def fake_thumbnail(index, dims):
+  """Deterministic speckle-like rgb pixels for a scene, encoded as png."""
+  rng = np.random.default_rng(index)
+  pixels = rng.gamma(2.0, 40.0, size=(dims, dims, 3)).clip(0, 255).astype(np.uint8)
+  buf = BytesIO()
+  PILImage.fromarray(pixels).save(buf, format='png')
+  return buf.getvalue()
+
+
+def fake_bands(index, dims):
+  """Deterministic VV/VH backscatter in dB for a scene, encoded like an NPY download."""
+  rng = np.random.default_rng(index)
+  values = np.zeros((dims, dims), dtype=[('VV', '<f4'), ('VH', '<f4')])
+  values['VV'] = 10 * np.log10(rng.gamma(1.0, 0.05, size=(dims, dims)) + 1e-4)
+  values['VH'] = values['VV'] - 7 + rng.normal(0, 1, size=(dims, dims))
+  buf = BytesIO()
+  np.save(buf, values)
+  return buf.getvalue()
+
+
+class ThumbnailHandler(BaseHTTPRequestHandler):
+  latency = 0.0
+  dims = 500
+  # like Earth Engine's quota: requests above this many in flight get a 429
+  max_concurrent = None
+  inflight = None
+
+  def do_GET(self):
+    match = re.search(r'/(thumb|npy)/(\d+)$', self.path)
+    if match is None:
+      self.send_error(404)
+      return
+    if self.max_concurrent is not None:
+      with self.inflight['lock']:
+        throttled = self.inflight['count'] >= self.max_concurrent
+        if not throttled:
+          self.inflight['count'] += 1
+      if throttled:
+        self.inflight['throttled'] += 1
+        self.send_error(429)
+        return
+    try:
+      self._serve(match)
+    finally:
+      if self.max_concurrent is not None:
+        with self.inflight['lock']:
+          self.inflight['count'] -= 1
+
+  def _serve(self, match):
+    time.sleep(self.latency)
+    if match.group(1) == 'thumb':
+      (body, content_type) = (fake_thumbnail(int(match.group(2)), self.dims), 'image/png')
+    else:
+      (body, content_type) = (fake_bands(int(match.group(2)), self.dims), 'application/octet-stream')
+    self.send_response(200)
+    self.send_header('Content-Type', content_type)
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, *args):
+    pass
+
+
+class ThumbnailServer():
+  """Serves fake thumbnails on a local port in a background thread."""
+
+  def __init__(self, latency=0.0, dims=500, handler=ThumbnailHandler, max_concurrent=None):
+    self.inflight = {'lock': threading.Lock(), 'count': 0, 'throttled': 0}
+    handler = type('Handler', (handler,), {'latency': latency, 'dims': dims, 'max_concurrent': max_concurrent, 'inflight': self.inflight})
+    self.server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+    threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+  def shutdown(self):
+    self.server.shutdown()
+    self.server.server_close()
+
+
+class _Anything():
+  """Placeholder for ee attributes the pipeline does not use (e.g. touched while importing geemap)."""
+
+  def __init__(self, *args, **kwargs):
+    pass
+
+  def __call__(self, *args, **kwargs):
+    return _Anything()
+
+  def __getattr__(self, name):
+    return _Anything()
+
+
+def __getattr__(name):
+  if name.startswith('__'):
+    raise AttributeError(name)
+  return _Anything()
@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+from aoi_grid import (aoi_bounds, frame_shape, dimensions, parse_dimensions, split_tiles, window_bounds,
+  tile_params, polygon, mosaic, fetch_tiled, grid_interval, DEFAULT_BUFFER, MAX_DIMENSION)
+
+POI = {'name': 'Kursk', 'lat': 51.7, 'lon': 36.2}
+
+
+def test_aoi_bounds_default_and_buffer():
+  west, south, east, north = aoi_bounds(POI)
+  assert west < 36.2 < east and south < 51.7 < north
+  # 3 km north and south of the poi
+  assert (north - south) * 111320.0 == pytest.approx(2 * DEFAULT_BUFFER)
+  assert aoi_bounds(dict(POI, buffer=10000))[3] - 51.7 == pytest.approx(10000 / 111320.0)
+
+
+def test_frame_shape_native_scale():
+  # a 6 km square at 10 m pixels
+  (height, width) = frame_shape(aoi_bounds(POI))
+  assert height == pytest.approx(600, abs=1)
+  assert width == pytest.approx(600, abs=2)
+
+
+def test_frame_shape_is_capped():
+  shape = frame_shape(aoi_bounds(dict(POI, buffer=40000)))
+  assert max(shape) == MAX_DIMENSION
+  assert frame_shape([0, 0, 1e-6, 1e-6]) == (1, 1)
+
+
+def test_dimensions_round_trip():
+  assert dimensions((300, 400)) == '400x300'
+  assert parse_dimensions('400x300') == (300, 400)
+  assert parse_dimensions(1000) is None
+
+
+@pytest.mark.parametrize('shape,tile', [((10, 10), 4), ((1024, 1024), 1024), ((2500, 1300), 1024), ((1, 7), 3)])
+def test_split_tiles_cover_shape_once(shape, tile):
+  covered = np.zeros(shape, dtype=int)
+  for (row, col, height, width) in split_tiles(shape, tile):
+    assert 0 < height <= tile and 0 < width <= tile
+    covered[row:row + height, col:col + width] += 1
+  assert (covered == 1).all()
+
+
+def test_window_bounds_tile_the_bounds():
+  bounds = [10.0, 50.0, 11.0, 51.0]
+  windows = split_tiles((100, 200), 64)
+  assert window_bounds(bounds, (100, 200), (0, 0, 100, 200)) == pytest.approx(bounds)
+  west, south, east, north = window_bounds(bounds, (100, 200), windows[0])
+  assert (west, north) == pytest.approx((10.0, 51.0))
+  assert (east, south) == pytest.approx((10.0 + 64 / 200, 51.0 - 64 / 100))
+
+
+def test_tile_params_leaves_small_or_unsplittable_requests():
+  params = {'region': [10.0, 50.0, 11.0, 51.0], 'dimensions': '500x400'}
+  (shape, tiles) = tile_params(params)
+  assert shape == (400, 500)
+  assert tiles == [((0, 0, 400, 500), dict(params, region=polygon(params['region'])))]
+  geometry = {'region': 'geometry', 'dimensions': '5000x5000'}
+  assert tile_params(geometry) == (None, [(None, geometry)])
+
+
+def test_fetch_tiled_mosaics_in_place():
+  shape = (50, 70)
+  full = np.arange(shape[0] * shape[1]).reshape(shape)
+  bounds = [0.0, 0.0, 7.0, 5.0]
+
+  def fetch(params):
+    # cut the tile's pixels out of `full` from its polygon
+    ring = np.array(params['region'][0])
+    (w, h) = (int(v) for v in params['dimensions'].split('x'))
+    col = int(round(ring[:, 0].min() / 0.1))
+    row = int(round((5.0 - ring[:, 1].max()) / 0.1))
+    return {'VV': full[row:row + h, col:col + w]}
+
+  result = fetch_tiled(fetch, {'region': bounds, 'dimensions': dimensions(shape)}, workers=3, tile_size=16)
+  assert np.array_equal(result['VV'], full)
+
+
+def test_mosaic_resamples_tiles_of_the_wrong_size():
+  out = mosaic((4, 4), [(0, 0, 4, 4)], [np.ones((2, 2), dtype=np.uint8)])
+  assert out.shape == (4, 4) and (out == 1).all()
+
+
+def test_grid_interval():
+  assert grid_interval([0, 0, 0.1, 0.1]) == (0.02, 0.02)
+  assert grid_interval([0, 0, 2, 1]) == (0.5, 0.5)
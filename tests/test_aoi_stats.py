@@ -0,0 +1,39 @@
+from pandas.testing import assert_frame_equal
+import fake_ee
+import aoi_stats
+from imagery import Imagery
+from frame_cache import FrameCache
+from aoi_stats import aoi_statistics, statistic_names, export_stats
+
+POIS = [{'name': 'b', 'lat': 51.0, 'lon': 11.0}, {'name': 'a', 'lat': 50.0, 'lon': 10.0}, {'name': 'c', 'lat': 52.0, 'lon': 12.0}]
+
+
+def collection():
+  imagery = Imagery()
+  imagery.get_collection()
+  return imagery.col_final
+
+
+def test_statistics_table(monkeypatch):
+  fake_ee.configure(scenes=6, latency=0.0)
+  monkeypatch.setattr(aoi_stats, 'CHUNK_SIZE', 2)
+  df = aoi_statistics(collection(), POIS, '2022-01-01', '2022-01-09')
+  # one round-trip per chunk of pois
+  assert fake_ee.stats['round_trips'] == 2
+  assert list(df.columns) == ['poi', 'date', 'time_start', 'scene'] + statistic_names()
+  assert len(df) == 3 * 4
+  assert list(df['poi']) == sorted(df['poi'])
+  assert (df['VV_p10'] < df['VV_median']).all() and (df['VV_median'] < df['VV_p90']).all()
+
+
+def test_statistics_are_cached_for_past_ranges(tmp_path):
+  fake_ee.configure(scenes=4, latency=0.0)
+  cache = FrameCache(str(tmp_path / 'cache'))
+  first = aoi_statistics(collection(), POIS[:1], '2022-01-01', '2022-02-01', cache=cache)
+  fake_ee.configure(scenes=4, latency=0.0)
+  again = aoi_statistics(collection(), POIS[:1], '2022-01-01', '2022-02-01', cache=cache)
+  assert fake_ee.stats['round_trips'] == 0
+  # read back from csv
+  assert_frame_equal(again, first)
+  path = export_stats(first, str(tmp_path / 'stats.csv'))
+  assert open(path).readline().startswith('poi,date,time_start,scene,VV_mean')
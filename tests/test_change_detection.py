@@ -0,0 +1,73 @@
+import numpy as np
+from datacube import SceneCube
+from change_detection import smooth, log_ratio, change_scores, rank_dates, detect_changes, scene_tracks
+
+
+def test_smooth_keeps_shape_and_constants():
+  images = np.full((2, 3, 5, 6), -12.0, dtype=np.float32)
+  assert smooth(images).shape == images.shape
+  assert np.allclose(smooth(images), -12.0)
+  assert smooth(images, size=1) is images
+
+
+def test_log_ratio_is_the_db_difference():
+  stack = np.zeros((3, 2, 4, 4), dtype=np.float32)
+  stack[1] = -3.0
+  stack[2, 0] = -3.0
+  stack[2, 1] = 3.0
+  changes = log_ratio(stack, size=1)
+  assert changes.shape == (2, 4, 4)
+  assert np.allclose(changes[0], 3.0)
+  # averaged over the bands: no change in VV, 6 dB in VH
+  assert np.allclose(changes[1], 3.0)
+
+
+def test_log_ratio_ignores_missing_bands():
+  stack = np.zeros((2, 2, 3, 3), dtype=np.float32)
+  stack[1, 0] = 4.0
+  stack[:, 1] = np.nan
+  assert np.allclose(log_ratio(stack, size=1), 4.0)
+
+
+def test_change_scores_and_ranking():
+  changes = np.zeros((3, 2, 2), dtype=np.float32)
+  changes[1, 0] = 5.0
+  changes[2] = 1.0
+  means, fractions = change_scores(changes, threshold=3.0)
+  assert np.allclose(means, [0.0, 2.5, 1.0])
+  assert np.allclose(fractions, [0.0, 0.5, 0.0])
+  ranked = rank_dates(['d1', 'd2', 'd3'], fractions, means, top=2)
+  assert [r['date'] for r in ranked] == ['d2', 'd3']
+
+
+def cube_of(tmp_path, scenes):
+  cube = SceneCube(tmp_path, grid={'dimensions': '4x4'})
+  for day, (value, track) in enumerate(scenes, start=1):
+    cube.append(f's{day}', {'VV': np.full((4, 4), value, dtype=np.float32), 'VH': np.full((4, 4), value, dtype=np.float32)},
+      f'2022-01-{day:02d}', day, **({'track': track} if track else {}))
+  return cube
+
+
+def test_detect_changes_pairs_scenes_of_the_same_track(tmp_path):
+  # the tracks differ by 10 dB, within each track one change of 4 dB on the 4th
+  cube = cube_of(tmp_path, [(-10.0, 'A'), (-20.0, 'D'), (-10.0, 'A'), (-16.0, 'D'), (-10.0, 'A')])
+  report = detect_changes(cube, threshold=3.0)
+  assert report['dates'] == ['2022-01-03', '2022-01-04', '2022-01-05']
+  assert np.allclose(report['mean_change_db'], [0.0, 4.0, 0.0])
+  assert np.allclose(report['changed_fraction'], [0.0, 1.0, 0.0])
+  assert report['ranked'][0]['date'] == '2022-01-04'
+  assert np.allclose(report['max_change'], 4.0)
+  assert detect_changes(cube, '2022-01-02', '2022-01-05')['dates'] == ['2022-01-04']
+
+
+def test_detect_changes_without_a_pair(tmp_path):
+  assert detect_changes(cube_of(tmp_path / 'one', [(-10.0, 'A')])) is None
+  assert detect_changes(cube_of(tmp_path / 'two', [(-10.0, 'A'), (-20.0, 'D')])) is None
+  # scenes without a track are compared with each other
+  report = detect_changes(cube_of(tmp_path / 'untracked', [(-10.0, None), (-13.0, None)]))
+  assert np.allclose(report['mean_change_db'], [3.0])
+
+
+def test_scene_tracks():
+  metadata = {'orbitProperties_pass': ['ASCENDING', 'DESCENDING'], 'relativeOrbitNumber_start': [15, 88]}
+  assert scene_tracks(metadata) == ['ASCENDING_15', 'DESCENDING_88']
@@ -0,0 +1,55 @@
+import json
+import numpy as np
+from datacube import SceneCube
+
+GRID = {'lat': 1.0, 'lon': 2.0, 'dimensions': '4x3'}
+
+
+def bands(value, shape=(3, 4)):
+  return {'VV': np.full(shape, value, dtype=np.float32), 'VH': np.full(shape, value - 7, dtype=np.float32)}
+
+
+def test_append_keeps_time_order_and_metadata(tmp_path):
+  cube = SceneCube(tmp_path, grid=GRID)
+  cube.append('b', bands(-2.0), '2022-01-03', 300, track='ASCENDING_15')
+  cube.append('a', bands(-1.0), '2022-01-01', 100, track='DESCENDING_88')
+  cube.append('a', bands(-9.0), '2022-01-01', 100)
+  assert [s['id'] for s in cube.scenes] == ['a', 'b']
+  assert [s['track'] for s in cube.scenes] == ['DESCENDING_88', 'ASCENDING_15']
+  assert np.allclose(cube.read('a')[0], -1.0)
+  assert cube.read_bands('b')['VH'].shape == (3, 4)
+  assert np.allclose(cube.read_bands('b')['VH'], -9.0)
+
+
+def test_select_and_stack_by_date(tmp_path):
+  cube = SceneCube(tmp_path, grid=GRID)
+  for day in range(1, 5):
+    cube.append(f's{day}', bands(-day), f'2022-01-0{day}', day)
+  assert [s['id'] for s in cube.select('2022-01-02', '2022-01-04')] == ['s2', 's3']
+  stack = cube.stack(['VH'], '2022-01-02')
+  assert stack.shape == (3, 1, 3, 4)
+  assert np.allclose(stack[:, 0, 0, 0], [-9.0, -10.0, -11.0])
+  assert [scene['id'] for scene, _ in cube.iter_scenes(end_date='2022-01-03')] == ['s1', 's2']
+  assert cube.stack(start_date='2023-01-01').shape[0] == 0
+
+
+def test_other_grid_starts_over_and_reading_keeps_it(tmp_path):
+  cube = SceneCube(tmp_path, grid=GRID)
+  cube.append('a', bands(-1.0), '2022-01-01', 100)
+  assert len(SceneCube(tmp_path)) == 1
+  assert len(SceneCube(tmp_path, grid=GRID)) == 1
+  moved = SceneCube(tmp_path, grid=dict(GRID, lat=1.5))
+  assert len(moved) == 0
+  assert not (tmp_path / 'a.npy').exists()
+
+
+def test_set_meta_and_clear(tmp_path):
+  cube = SceneCube(tmp_path, grid=GRID)
+  cube.append('a', bands(-1.0), '2022-01-01', 100)
+  cube.append('b', bands(-1.0), '2022-01-02', 200)
+  cube.set_meta({'a': {'track': 'ASCENDING_15'}, 'missing': {'track': 'x'}})
+  index = json.loads((tmp_path / 'index.json').read_text())
+  assert [s.get('track') for s in index['scenes']] == ['ASCENDING_15', None]
+  cube.clear()
+  assert len(SceneCube(tmp_path, grid=GRID)) == 0
+  assert cube.bands == ['VV', 'VH']
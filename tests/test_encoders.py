@@ -0,0 +1,100 @@
+import os
+import numpy as np
+import pytest
+from PIL import Image, ImageSequence
+from encoders import GifWriter, OptimizedGifWriter, WebpWriter, FrameEncoder, fit_gif_budget
+
+
+def make_frames(count=10, shape=(24, 32)):
+  """A moving square on a flat background, its two colors fit any gif palette fitted on the first frame."""
+  frames = []
+  for i in range(count):
+    frame = np.zeros(shape + (3,), dtype=np.uint8)
+    frame[:] = (20, 40, 200)
+    frame[4:10, 2 * i:2 * i + 6] = (255, 255, 0)
+    frames.append(frame)
+  return frames
+
+
+def decode(path):
+  with Image.open(path) as animation:
+    return [(np.asarray(frame.convert('RGB')).astype(int), frame.info.get('duration')) for frame in ImageSequence.Iterator(animation)]
+
+
+@pytest.mark.parametrize('writer', [GifWriter, OptimizedGifWriter])
+def test_gif_writers_keep_frames_and_timing(tmp_path, writer):
+  frames = make_frames()
+  path = str(tmp_path / 'out.gif')
+  gif = writer(path, fps=4)
+  gif.append(frames[0])
+  # streamed: the first frame is on its way to the file before the next arrives
+  assert gif.file is not None and gif.file.tell() > 0
+  for frame in frames[1:]:
+    gif.append(frame)
+  gif.close()
+  decoded = decode(path)
+  assert len(decoded) == len(frames)
+  for (pixels, duration), frame in zip(decoded, frames):
+    assert duration == 250
+    assert np.array_equal(pixels, frame)
+
+
+def test_gif_writer_repeats_unchanged_frames(tmp_path):
+  frames = make_frames(2)
+  path = str(tmp_path / 'still.gif')
+  gif = OptimizedGifWriter(path, fps=2)
+  for frame in [frames[0], frames[0], frames[1]]:
+    gif.append(frame)
+  gif.close()
+  decoded = decode(path)
+  assert len(decoded) == 3
+  assert np.array_equal(decoded[1][0], frames[0])
+
+
+def test_webp_writer_spools_chunks(tmp_path):
+  frames = make_frames(WebpWriter.chunk_frames + 3)
+  path = str(tmp_path / 'out.webp')
+  webp = WebpWriter(path, fps=2)
+  for frame in frames:
+    webp.append(frame)
+  assert len(webp.chunks) == 1
+  webp.close()
+  assert sorted(os.listdir(tmp_path)) == ['out.webp']
+  decoded = decode(path)
+  assert len(decoded) == len(frames)
+  for (pixels, duration), frame in zip(decoded, frames):
+    assert duration == 500
+    # lossy in the end
+    assert np.abs(pixels - frame).mean() < 8
+
+
+@pytest.mark.parametrize('keep_frames', [True, False])
+def test_frame_encoder_writes_frame_files_only_when_asked(tmp_path, keep_frames):
+  frames_dir = tmp_path / 'frames'
+  frames_dir.mkdir()
+  out_gif = str(tmp_path / 'out.gif')
+  with FrameEncoder(out_gif=out_gif, out_webp=str(tmp_path / 'out.webp'), fps=2, frames_dir=str(frames_dir) if keep_frames else None,
+      first_index=5) as encoder:
+    for i, frame in enumerate(make_frames(3)):
+      encoder.append(np.dstack([frame, np.full(frame.shape[:2], 255, dtype=np.uint8)]), f'scene{i}')
+  assert encoder.frames == 3
+  assert len(decode(out_gif)) == len(decode(str(tmp_path / 'out.webp'))) == 3
+  if keep_frames:
+    assert sorted(os.listdir(frames_dir)) == ['005_scene0.png', '006_scene1.png', '007_scene2.png']
+    with Image.open(frames_dir / '006_scene1.png') as png:
+      assert np.array_equal(np.asarray(png), make_frames(3)[1])
+  else:
+    assert os.listdir(frames_dir) == []
+
+
+def test_fit_gif_budget_scales_down(tmp_path):
+  rng = np.random.default_rng(1)
+  path = str(tmp_path / 'noise.gif')
+  gif = OptimizedGifWriter(path, fps=2)
+  for _ in range(4):
+    gif.append(rng.integers(0, 255, (120, 160, 3), dtype=np.uint8))
+  gif.close()
+  budget = os.path.getsize(path) // 2
+  assert fit_gif_budget(path, budget, fps=2) <= budget
+  decoded = decode(path)
+  assert len(decoded) == 4 and decoded[0][0].shape[1] < 160
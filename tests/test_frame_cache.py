@@ -0,0 +1,63 @@
+import os
+import time
+from frame_cache import FrameCache
+
+
+def age(cache, key, seconds):
+  fname = cache._file(key)
+  t = time.time() - seconds
+  os.utime(fname, (t, t))
+
+
+def test_put_get(tmp_path):
+  cache = FrameCache(str(tmp_path))
+  key = cache.key('scene', region=[1, 2, 3, 4])
+  assert cache.get(key) is None
+  cache.put(key, b'pixels')
+  assert cache.get(key) == b'pixels'
+
+
+def test_scene_key_ignores_non_pixel_params(tmp_path):
+  cache = FrameCache(str(tmp_path))
+  params = {'region': [1, 2, 3, 4], 'dimensions': '10x10', 'min': [0], 'max': [1]}
+  assert cache.scene_key('a', params) == cache.scene_key('a', dict(params, framesPerSecond=2))
+  assert cache.scene_key('a', params) != cache.scene_key('b', params)
+  assert cache.scene_key('a', params) != cache.scene_key('a', dict(params, max=[2]))
+
+
+def test_evicts_least_recently_used(tmp_path):
+  cache = FrameCache(str(tmp_path), max_bytes=250)
+  keys = [cache.key(f'scene{i}') for i in range(3)]
+  for i, key in enumerate(keys[:2]):
+    cache.put(key, b'x' * 100)
+    age(cache, key, 100 - i)
+  # reading the oldest entry makes the other one the least recently used
+  cache.get(keys[0])
+  cache.put(keys[2], b'x' * 100)
+  assert cache.get(keys[0]) is not None
+  assert cache.get(keys[1]) is None
+  assert cache.get(keys[2]) is not None
+  assert cache.size() <= 250
+
+
+def test_running_total(tmp_path):
+  cache = FrameCache(str(tmp_path), max_bytes=10 ** 6)
+  cache.put(cache.key('a'), b'x' * 100)
+  cache.put(cache.key('b'), b'x' * 50)
+  # replacing an entry only counts the difference
+  cache.put(cache.key('a'), b'x' * 10)
+  assert cache.total == cache.size() == 60
+
+
+def test_rescans_for_entries_of_other_processes(tmp_path):
+  cache = FrameCache(str(tmp_path), max_bytes=150)
+  cache.rescan_interval = 2
+  other = FrameCache(str(tmp_path), max_bytes=10 ** 6)
+  cache.put(cache.key('a'), b'x' * 10)
+  other.put(other.key('b'), b'x' * 100)
+  other.put(other.key('c'), b'x' * 100)
+  age(other, other.key('b'), 100)
+  # the second put recounts from disk and evicts what the running total missed
+  cache.put(cache.key('d'), b'x' * 10)
+  assert cache.size() <= 150
+  assert cache.total == cache.size()
@@ -0,0 +1,79 @@
+import json
+import pytest
+import fake_ee
+from imagery import Imagery
+
+POI = {'name': 'Test', 'lat': 52.73937, 'lon': 32.02741, 'start_date': '2022-01-01', 'end_date': '2030-01-01'}
+
+
+@pytest.fixture
+def server():
+  server = fake_ee.ThumbnailServer(dims=24)
+  yield server
+  server.shutdown()
+
+
+def imagery_for(tmp_path, server, scenes):
+  fake_ee.configure(scenes=scenes, latency=0.0, thumb_url=server.url)
+  imagery = Imagery()
+  imagery.get_collection()
+  imagery.set_poi(dict(POI), str(tmp_path))
+  return imagery
+
+
+def test_update_cube_stores_tracks_and_is_bounded(tmp_path, server):
+  imagery = imagery_for(tmp_path, server, scenes=12)
+  assert imagery.update_cube(workers=2, max_scenes=4) == 4
+  scenes = imagery.open_cube().scenes
+  assert [s['id'][-4:] for s in scenes] == ['0000', '0003', '0006', '0009']
+  assert [s['track'] for s in scenes] == ['ASCENDING_15', 'DESCENDING_88', 'ASCENDING_15', 'DESCENDING_88']
+  assert imagery.update_cube(workers=2, max_scenes=4) == 0
+  assert imagery.update_cube(workers=2) == 8
+
+
+def test_update_cube_adds_missing_tracks(tmp_path, server):
+  imagery = imagery_for(tmp_path, server, scenes=2)
+  imagery.update_cube(workers=1)
+  cube = imagery.open_cube()
+  # as stored while rendering
+  for scene in cube.index['scenes']:
+    del scene['track']
+  cube._save_index()
+  imagery.update_cube(workers=1)
+  assert [s['track'] for s in imagery.open_cube().scenes] == ['ASCENDING_15', 'DESCENDING_88']
+
+
+def test_detect_changes_report(tmp_path, server):
+  imagery = imagery_for(tmp_path, server, scenes=8)
+  report = imagery.detect_changes(top=2, workers=2, max_scenes=6)
+  assert len(imagery.open_cube()) == 6
+  # six scenes of two alternating tracks give four pairs
+  assert len(report['dates']) == len(report['mean_change_db']) == len(report['changed_fraction']) == 4
+  assert len(report['ranked']) == 2
+  with open(report['map'], 'rb') as f:
+    assert f.read(8) == b'\x89PNG\r\n\x1a\n'
+  with open(imagery.outpath + '/changes.json') as f:
+    assert json.load(f)['dates'] == report['dates']
+
+
+def test_render_cube_gif_writes_the_extra_formats(tmp_path, server):
+  imagery = imagery_for(tmp_path, server, scenes=3)
+  imagery.formats = ('webp',)
+  imagery.update_cube(workers=1)
+  assert imagery.render_cube_gif(max_frames=2) == (False, None)
+  assert set(imagery.output_paths()) == {'gif', 'webp'}
+  assert imagery.load_poi_stretch() is not None
+
+
+def test_reset_poi_stretch(tmp_path, server):
+  imagery = imagery_for(tmp_path, server, scenes=2)
+  imagery.update_cube(workers=1)
+  key = imagery.product_key(source='cube')
+  imagery.render_cube_gif()
+  imagery.publish(key, source='cube')
+  assert imagery.store.get(imagery.poi, key) is not None
+  assert imagery.load_poi_stretch() is not None
+  assert imagery.reset_poi_stretch()
+  assert imagery.load_poi_stretch() is None
+  assert imagery.store.get(imagery.poi, key) is None
+  assert not imagery.reset_poi_stretch()
@@ -0,0 +1,90 @@
+import pytest
+import fake_ee
+from imagery import Imagery
+from imagery_utils import prefetch_metadata, choose_decimation, composite_span, decimate_collection, new_get_image_collection_gif
+
+
+POI = {'name': 'Test', 'lat': 52.73937, 'lon': 32.02741, 'start_date': '2022-01-01', 'end_date': '2030-01-01'}
+
+
+def filtered(tmp_path):
+  imagery = Imagery()
+  imagery.get_collection()
+  imagery.set_poi(dict(POI), str(tmp_path))
+  return imagery
+
+
+def test_prefetch_metadata_single_round_trip(tmp_path):
+  fake_ee.configure(scenes=5, latency=0.0)
+  imagery = filtered(tmp_path)
+  metadata = prefetch_metadata(imagery.filtered_timeseries(), stretch_region=imagery.generate_base_aoi())
+  assert fake_ee.stats['round_trips'] == 1
+  assert metadata['count'] == 5
+  assert len(metadata['names']) == len(metadata['dates']) == len(metadata['times']) == 5
+  assert metadata['dates'] == sorted(metadata['dates'])
+  assert set(metadata['minmax']) == {f'{b}_{m}' for b in ('VV', 'VH', 'VH-VV') for m in ('min', 'max')}
+  # size, names and dates plus six stretch values
+  assert metadata['round_trips_saved'] == 8
+
+
+def test_prefetch_metadata_without_stretch(tmp_path):
+  fake_ee.configure(scenes=3, latency=0.0)
+  metadata = prefetch_metadata(filtered(tmp_path).filtered_timeseries())
+  assert 'minmax' not in metadata
+  assert metadata['round_trips_saved'] == 2
+
+
+
+DAY = 86400000
+
+
+def span_metadata(count, days):
+  return {'count': count, 'times': [int(i * days * DAY / max(1, count - 1)) for i in range(count)]}
+
+
+def test_choose_decimation_by_span_and_count():
+  assert choose_decimation(span_metadata(10, 300), 10) is None
+  assert choose_decimation(span_metadata(30, 60), 10) == 'weekly'
+  assert choose_decimation(span_metadata(100, 200), 10) == 'monthly'
+  assert choose_decimation(span_metadata(500, 2000), 10) == 'sample'
+  assert choose_decimation(span_metadata(500, 2000), 10, 'weekly') == 'weekly'
+
+
+def test_composite_span_fits_max_frames():
+  assert composite_span(span_metadata(30, 60), 10, 'weekly') == 1
+  # 18 weeks into 5 frames
+  assert composite_span(span_metadata(60, 120), 5, 'weekly') == 4
+  assert composite_span(span_metadata(60, 120), 5, 'monthly') == 1
+  assert composite_span(span_metadata(300, 730), 5, 'monthly') == 5
+
+
+@pytest.mark.parametrize('strategy,max_frames', [('sample', 10), ('weekly', 10), ('weekly', 5), ('monthly', 3), ('monthly', 2)])
+def test_decimate_collection(tmp_path, strategy, max_frames):
+  fake_ee.configure(scenes=60, latency=0.0)
+  col = filtered(tmp_path).filtered_timeseries()
+  metadata = prefetch_metadata(col)
+  decimated = prefetch_metadata(decimate_collection(col, metadata, max_frames, strategy))
+  assert 0 < decimated['count'] <= max_frames
+  assert len(set(decimated['names'])) == decimated['count']
+  assert decimated['times'] == sorted(decimated['times'])
+  if strategy != 'sample':
+    composites = decimate_collection(col, metadata, max_frames, strategy).value
+    # every scene is in exactly one composite
+    assert sum(image.props['scenes'] for image in composites) == 60
+    assert all(name.startswith(strategy[0].upper()) for name in decimated['names'])
+
+
+def test_decimate_collection_unknown_strategy(tmp_path):
+  fake_ee.configure(scenes=5, latency=0.0)
+  col = filtered(tmp_path).filtered_timeseries()
+  with pytest.raises(ValueError):
+    decimate_collection(col, prefetch_metadata(col), 2, 'daily')
+
+
+def test_without_decimation_too_many_scenes_fail(tmp_path):
+  fake_ee.configure(scenes=12, latency=0.0)
+  imagery = filtered(tmp_path)
+  (err, msg) = new_get_image_collection_gif(imagery.filtered_timeseries(), str(tmp_path / 'out'), 'out.gif', {}, imagery.plot_region(),
+    max_frames=10, decimation=None, verbose=False)
+  assert err and '12 single frames' in msg
+  assert not (tmp_path / 'out' / 'out.gif').exists()
@@ -0,0 +1,80 @@
+import os
+import signal
+import pytest
+from concurrent.futures.process import BrokenProcessPool
+from jobs import JobQueue
+
+POI = {'name': 'Kursk', 'lat': 51.7, 'lon': 36.2, 'start_date': '2021-12-01', 'end_date': '2021-12-31'}
+
+
+def test_job_key_is_stable():
+  assert JobQueue.job_key(dict(POI), 30) == JobQueue.job_key(dict(POI), 30)
+  # coordinates are compared rounded, whatever type they come in
+  assert JobQueue.job_key(dict(POI, lat='51.7000000001'), 30) == JobQueue.job_key(dict(POI), 30)
+  assert JobQueue.job_key(dict(POI), 30, formats=['webp', 'mp4']) == JobQueue.job_key(dict(POI), 30, formats=('mp4', 'webp'))
+
+
+def test_job_key_covers_the_request():
+  base = JobQueue.job_key(dict(POI), 30)
+  variants = [
+    JobQueue.job_key(dict(POI, end_date='2022-01-31'), 30),
+    JobQueue.job_key(dict(POI, lon=36.3), 30),
+    JobQueue.job_key(dict(POI, buffer=10000), 30),
+    JobQueue.job_key(dict(POI), 60),
+    JobQueue.job_key(dict(POI), 30, incremental=True),
+    JobQueue.job_key(dict(POI), 30, decimation='weekly'),
+    JobQueue.job_key(dict(POI), 30, stretch={'mode': 'percentile'}),
+    JobQueue.job_key(dict(POI), 30, changes=True),
+    JobQueue.job_key(dict(POI), 30, formats=['webp']),
+  ]
+  assert base not in variants
+  assert len(set(variants)) == len(variants)
+
+
+def init_test_worker(outpath, memory_limit=None):
+  pass
+
+
+def run_test_job(job_id, poi, outpath, max_frames, workers, *args):
+  if poi['name'] == 'crash':
+    # like the kernel's OOM killer
+    os.kill(os.getpid(), signal.SIGKILL)
+  return (False, None, f"{poi['name']}.gif", {'frames': max_frames}, None)
+
+
+class LocalQueue(JobQueue):
+  initializer = staticmethod(init_test_worker)
+  target = staticmethod(run_test_job)
+
+
+@pytest.fixture
+def queue(tmp_path):
+  queue = LocalQueue(str(tmp_path), max_workers=1)
+  yield queue
+  queue.shutdown()
+
+
+def test_submit_runs_the_job(queue):
+  job = queue.submit(dict(POI), 30)
+  assert job.future.result(timeout=60)[2] == 'Kursk.gif'
+  assert job.status == 'done'
+  assert queue.get(job.id) is job
+  # a finished job is not reused, a new one starts
+  assert queue.submit(dict(POI), 30).id != job.id
+
+
+def test_submit_returns_the_running_job(queue):
+  first = queue.submit(dict(POI), 30)
+  second = queue.submit(dict(POI), 30)
+  assert first is second or first.future.done()
+  first.future.result(timeout=60)
+
+
+def test_submit_after_a_worker_died(queue):
+  job = queue.submit(dict(POI, name='crash'), 30)
+  assert isinstance(job.future.exception(timeout=60), BrokenProcessPool)
+  assert job.status == 'failed'
+  assert job.result[0] is True
+  # the queue starts a new pool instead of failing every later job
+  job = queue.submit(dict(POI), 30)
+  assert job.future.result(timeout=60)[0] is False
@@ -0,0 +1,106 @@
+import os
+import sys
+import time
+import subprocess
+import multiprocessing
+import numpy as np
+import pytest
+from limits import parse_size, env_size, descendants, current_rss, check_memory, MemoryWatchdog, ADDRESS_SPACE_FACTOR
+from encoders import FrameEncoder
+
+
+@pytest.mark.parametrize('value,expected', [
+  ('1048576', 1048576),
+  ('512k', 512 * 1024),
+  ('512M', 512 * 1024 ** 2),
+  ('2g', 2 * 1024 ** 3),
+  ('1.5G', int(1.5 * 1024 ** 3)),
+  ('4GiB', 4 * 1024 ** 3),
+  (' 3 gb ', 3 * 1024 ** 3),
+  ('1t', 1024 ** 4),
+  (2048, 2048),
+])
+def test_parse_size(value, expected):
+  assert parse_size(value) == expected
+
+
+@pytest.mark.parametrize('value', [None, '', '  '])
+def test_parse_size_empty(value):
+  assert parse_size(value) is None
+
+
+@pytest.mark.parametrize('value', ['lots', '2x', '-1g', '1 2'])
+def test_parse_size_invalid(value):
+  with pytest.raises(ValueError):
+    parse_size(value)
+
+
+def test_env_size(monkeypatch):
+  monkeypatch.setenv('SARVEILLANCE_TEST_SIZE', '3m')
+  assert env_size('SARVEILLANCE_TEST_SIZE') == 3 * 1024 ** 2
+  monkeypatch.delenv('SARVEILLANCE_TEST_SIZE')
+  assert env_size('SARVEILLANCE_TEST_SIZE', '1k') == 1024
+  assert env_size('SARVEILLANCE_TEST_SIZE') is None
+
+
+def test_descendants_finds_children():
+  child = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(30)'])
+  try:
+    assert child.pid in descendants()
+    assert current_rss(child.pid) > 0
+  finally:
+    child.kill()
+    child.wait()
+  assert child.pid not in descendants()
+  assert current_rss(child.pid) == 0
+
+
+def test_address_space_cap_leaves_room_above_the_budget():
+  # in its own process, the cap can not be raised again
+  script = (
+    'import sys, resource, numpy as np\n'
+    f'sys.path.insert(0, {os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")!r})\n'
+    'from limits import set_memory_limit\n'
+    'set_memory_limit(512 * 1024 ** 2)\n'
+    'print(resource.getrlimit(resource.RLIMIT_AS)[0])\n'
+    # more than the budget in address space, but not resident
+    'np.zeros(600 * 1024 ** 2, dtype=np.uint8)\n'
+  )
+  out = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True).stdout
+  assert int(out) == ADDRESS_SPACE_FACTOR * 512 * 1024 ** 2
+
+
+def test_watchdog_fails_a_job_without_children():
+  watchdog = MemoryWatchdog(1, interval=60)
+  with watchdog:
+    check_memory()
+    assert watchdog.check()
+    assert watchdog.tripped and watchdog.peak > 1
+    with pytest.raises(MemoryError):
+      check_memory()
+    with pytest.raises(MemoryError):
+      FrameEncoder().append(np.zeros((2, 2, 3), dtype=np.uint8))
+  # only while the job runs
+  check_memory()
+
+
+def test_watchdog_kills_child_processes():
+  child = multiprocessing.get_context('spawn').Process(target=time.sleep, args=(30,))
+  child.start()
+  try:
+    with MemoryWatchdog(1, interval=60) as watchdog:
+      assert watchdog.check()
+    child.join(10)
+    assert child.exitcode == -9
+  finally:
+    child.kill()
+    child.join()
+
+
+def test_watchdog_below_the_limit():
+  with MemoryWatchdog(1024 ** 4, interval=0.01) as watchdog:
+    time.sleep(0.05)
+    check_memory()
+  assert not watchdog.tripped and watchdog.peak > 0
+  with MemoryWatchdog(None) as watchdog:
+    assert watchdog.thread is None
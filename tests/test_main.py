@@ -0,0 +1,23 @@
+import pytest
+from main import parse_args
+
+BATCH = ['batch', '2022-01-01', '2022-06-01', '/tmp/out']
+
+
+def test_batch_args():
+  args = parse_args(BATCH + ['--share-scenes', '--formats', 'webp', 'mp4'])
+  assert args.share_scenes and args.formats == ['webp', 'mp4'] and args.decimation == 'auto'
+  assert parse_args(BATCH + ['--decimation', 'monthly']).decimation == 'monthly'
+
+
+@pytest.mark.parametrize('decimation', ['weekly', 'monthly', 'none'])
+def test_share_scenes_rejects_composites(decimation):
+  with pytest.raises(SystemExit):
+    parse_args(BATCH + ['--share-scenes', '--decimation', decimation])
+  assert parse_args(BATCH + ['--share-scenes', '--decimation', 'sample']).decimation == 'sample'
+
+
+def test_refit_stretch_flag():
+  assert parse_args(BATCH + ['--refit-stretch']).refit_stretch
+  assert not parse_args(BATCH).refit_stretch
+  assert not parse_args(['Kursk'] + BATCH[1:]).refit_stretch
@@ -0,0 +1,110 @@
+import os
+import time
+import pytest
+from output_store import OutputStore
+from jobs import JobQueue
+
+POI = {'name': 'Klintsy / North', 'lat': 52.75, 'lon': 32.24, 'start_date': '2021-12-01', 'end_date': '2021-12-31'}
+
+
+def run_files(folder, name, size=100):
+  os.makedirs(folder, exist_ok=True)
+  path = os.path.join(folder, name)
+  with open(path, 'wb') as f:
+    f.write(b'x' * size)
+  return [path]
+
+
+def set_used(folder, seconds_ago):
+  t = time.time() - seconds_ago
+  os.utime(os.path.join(folder, 'product.json'), (t, t))
+
+
+def test_key():
+  assert OutputStore.key(POI, formats=['mp4']) == OutputStore.key(dict(POI), formats=['mp4'])
+  assert OutputStore.key(POI, formats=['mp4']) != OutputStore.key(POI, formats=['webp'])
+  assert OutputStore.key(POI) != OutputStore.key(dict(POI, end_date='2022-01-31'))
+  assert OutputStore.key(POI) != OutputStore.key(dict(POI, buffer=10000))
+
+
+def test_publish_and_get(tmp_path):
+  store = OutputStore(str(tmp_path / 'Products'))
+  key = OutputStore.key(POI)
+  assert store.get(POI, key) is None
+  files = run_files(str(tmp_path / 'run'), 'Klintsy.gif')
+  folder = store.publish(POI, key, files, params={'max_frames': 30})
+  assert store.get(POI, key) == folder
+  assert sorted(os.listdir(folder)) == ['Klintsy.gif', 'product.json']
+  # moved, not copied, and the poi name is made safe for a folder
+  assert not os.path.exists(files[0])
+  assert os.path.basename(os.path.dirname(folder)) == 'Klintsy_North'
+  assert os.listdir(store.staging) == []
+
+
+def test_publish_keeps_the_first_product(tmp_path):
+  store = OutputStore(str(tmp_path / 'Products'))
+  key = OutputStore.key(POI)
+  first = store.publish(POI, key, run_files(str(tmp_path / 'a'), 'Klintsy.gif', 10))
+  second = store.publish(POI, key, run_files(str(tmp_path / 'b'), 'Klintsy.gif', 20))
+  assert first == second
+  assert os.path.getsize(os.path.join(first, 'Klintsy.gif')) == 10
+  assert os.listdir(store.staging) == []
+
+
+def test_gc_removes_least_recently_used(tmp_path):
+  store = OutputStore(str(tmp_path / 'Products'), max_bytes=10 ** 6)
+  folders = []
+  for i in range(3):
+    poi = dict(POI, end_date=f'2022-0{i + 1}-01')
+    folders.append(store.publish(poi, OutputStore.key(poi), run_files(str(tmp_path / f'run{i}'), 'p.gif', 1000)))
+    set_used(folders[-1], 1000 - i)
+  # reading the oldest product makes it the most recently used
+  poi = dict(POI, end_date='2022-01-01')
+  assert store.get(poi, OutputStore.key(poi)) == folders[0]
+  store.max_bytes = store.size() - 1
+  assert store.gc() > 0
+  assert [os.path.exists(f) for f in folders] == [True, False, True]
+  assert store.size() <= store.max_bytes
+
+
+def test_gc_keeps_products_younger_than_min_age(tmp_path):
+  store = OutputStore(str(tmp_path / 'Products'), max_bytes=0)
+  folder = store.publish(POI, OutputStore.key(POI), run_files(str(tmp_path / 'run'), 'p.gif'))
+  assert os.path.exists(folder)
+  set_used(folder, store.min_age + 1)
+  store.gc()
+  assert not os.path.exists(folder)
+
+
+@pytest.fixture
+def queue(tmp_path):
+  queue = JobQueue(str(tmp_path))
+  yield queue
+  queue.shutdown()
+
+
+def test_collect_runs(tmp_path, queue):
+  poi_path = tmp_path / 'BaseTimeseries' / 'Kursk'
+  old = time.time() - queue.run_retention - 10
+  kept = ['incremental', 'stretch.json', '0123456789ab']
+  for name in ['fedcba987654', 'run-x1y2', 'incremental', '0123456789ab']:
+    run_files(str(poi_path / name), 'progress.json')
+  (poi_path / 'stretch.json').write_text('{}')
+  for name in ['fedcba987654', 'run-x1y2', 'incremental']:
+    folder = poi_path / name
+    os.utime(folder / 'progress.json', (old, old))
+    os.utime(folder, (old, old))
+  assert queue.collect_runs() == 2
+  assert sorted(os.listdir(poi_path)) == sorted(kept)
+
+
+def test_remove_drops_every_product_of_the_poi(tmp_path):
+  store = OutputStore(str(tmp_path / 'Products'))
+  other = dict(POI, name='Other')
+  for i, poi in enumerate([POI, dict(POI, end_date='2022-01-31'), other]):
+    store.publish(poi, OutputStore.key(poi), run_files(str(tmp_path / f'run{i}'), 'a.gif'))
+  assert store.remove(POI) == 2
+  assert store.get(POI, OutputStore.key(POI)) is None
+  assert store.get(other, OutputStore.key(other)) is not None
+  assert os.listdir(store.staging) == []
+  assert store.remove(dict(POI, name='Unknown')) == 0
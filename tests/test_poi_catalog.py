@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+from poi_catalog import POICatalog, haversine_km
+
+
+@pytest.fixture
+def catalog():
+  rng = np.random.default_rng(0)
+  lats = rng.uniform(40, 60, 2000)
+  lons = rng.uniform(20, 50, 2000)
+  return POICatalog([f'poi{i}' for i in range(2000)], lats, lons, kind=np.arange(2000) % 3)
+
+
+def brute_nearest(catalog, lat, lon, k):
+  distances = haversine_km(lat, lon, catalog.lats, catalog.lons)
+  return [str(catalog.names[i]) for i in np.argsort(distances, kind='stable')[:k]]
+
+
+def test_names_are_unique_first_wins():
+  catalog = POICatalog(['a', 'b', 'a'], [1, 2, 3], [4, 5, 6])
+  assert len(catalog) == 2
+  assert catalog.get('a')['lat'] == 1
+  assert 'b' in catalog and catalog.get('c') is None
+
+
+def test_get_keeps_extra_columns(catalog):
+  assert catalog.get('poi5') == {'name': 'poi5', 'lat': catalog.lats[5], 'lon': catalog.lons[5], 'kind': 2}
+
+
+@pytest.mark.parametrize('lat,lon', [(50, 35), (40.1, 20.1), (59.9, 49.9), (10, 0), (50, 120)])
+def test_nearest_matches_brute_force(catalog, lat, lon):
+  found = catalog.nearest(lat, lon, k=5)
+  assert [p['name'] for p in found] == brute_nearest(catalog, lat, lon, 5)
+  distances = [p['distance_km'] for p in found]
+  assert distances == sorted(distances)
+
+
+def test_nearest_max_km(catalog):
+  found = catalog.nearest(50, 35, k=50, max_km=40)
+  assert all(p['distance_km'] <= 40 for p in found)
+  assert len(found) == int((haversine_km(50, 35, catalog.lats, catalog.lons) <= 40).sum())
+  assert catalog.nearest(0, 0, k=3, max_km=10) == []
+
+
+def test_nearest_empty_catalog():
+  assert POICatalog([], [], []).nearest(50, 35) == []
+
+
+def test_bbox_matches_brute_force(catalog):
+  west, south, east, north = 30.2, 45.5, 33.7, 48.1
+  inside = (catalog.lats >= south) & (catalog.lats <= north) & (catalog.lons >= west) & (catalog.lons <= east)
+  assert sorted(p['name'] for p in catalog.bbox(west, south, east, north)) == sorted(catalog.names[inside])
+  # a box over the whole catalog falls back to every cell
+  assert len(catalog.bbox(-180, -90, 180, 90)) == len(catalog)
+
+
+def test_npz_round_trip(catalog, tmp_path):
+  path = str(tmp_path / 'catalog.npz')
+  catalog.save_npz(path)
+  loaded = POICatalog.load(path)
+  assert len(loaded) == len(catalog)
+  assert loaded.get('poi7') == catalog.get('poi7')
+
+
+@pytest.fixture
+def pacific():
+  rng = np.random.default_rng(1)
+  lats = rng.uniform(-20, 20, 3000)
+  lons = (rng.uniform(160, 200, 3000) + 180) % 360 - 180
+  return POICatalog([f'p{i}' for i in range(3000)], lats, lons)
+
+
+@pytest.mark.parametrize('lat,lon', [(0, 179.95), (0, -179.95), (5, 180), (-10, -180), (10, 170), (0, 0)])
+def test_nearest_across_the_antimeridian(pacific, lat, lon):
+  assert [p['name'] for p in pacific.nearest(lat, lon, k=5)] == brute_nearest(pacific, lat, lon, 5)
+
+
+def test_nearest_finds_the_other_side_first():
+  catalog = POICatalog(['east', 'west', 'far'], [0, 0, 0], [179.9, -179.9, 178.0])
+  found = catalog.nearest(0, 179.99, k=2)
+  assert [p['name'] for p in found] == ['east', 'west']
+  assert found[1]['distance_km'] < 15
+  assert [p['name'] for p in catalog.nearest(0, -179.99, k=1, max_km=20)] == ['west']
+
+
+def test_bbox_across_the_antimeridian(pacific):
+  west, south, east, north = 175.5, -5, -172.25, 8
+  inside = (pacific.lats >= south) & (pacific.lats <= north) & ((pacific.lons >= west) | (pacific.lons <= east))
+  found = sorted(p['name'] for p in pacific.bbox(west, south, east, north))
+  assert len(found) > 0 and found == sorted(pacific.names[inside])
+  # up to the antimeridian from either side
+  assert len(pacific.bbox(170, -20, 180, 20)) == int((pacific.lons >= 170).sum())
+  assert len(pacific.bbox(-180, -20, -170, 20)) == int((pacific.lons <= -170).sum())
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+import fake_ee
+from imagery import Imagery
+from shared_scenes import poi_scenes, group_pois, crop, has_data, update_shared_cubes
+
+
+def poi(name, lat, lon):
+  return {'name': name, 'lat': lat, 'lon': lon, 'start_date': '2022-01-01', 'end_date': '2030-01-01'}
+
+
+def test_group_pois_by_shared_scenes_and_size():
+  pois = [poi('a', 50.0, 10.0), poi('b', 50.01, 10.01), poi('far', 50.0, 11.0), poi('other', 50.0, 10.02)]
+  scenes = {'a': {1, 2, 3, 4}, 'b': {2, 3, 4}, 'far': {1, 2, 3, 4}, 'other': {7, 8}}
+  groups = group_pois(pois, scenes)
+  assert [[p['name'] for p in group] for group in groups] == [['a', 'b'], ['other'], ['far']]
+
+
+def test_group_pois_needs_enough_shared_scenes():
+  pois = [poi('a', 50.0, 10.0), poi('b', 50.0, 10.01)]
+  assert len(group_pois(pois, {'a': {1, 2}, 'b': {2, 3, 4}})) == 2
+  assert len(group_pois(pois, {'a': {1, 2}, 'b': {1, 2, 3, 4}})) == 1
+
+
+def test_crop_cuts_the_poi_window():
+  values = np.arange(16, dtype=np.float32).reshape(4, 4)
+  tile = crop({'VV': values}, [0, 0, 4, 4], [1, 1, 3, 3], (2, 2))
+  assert np.array_equal(tile['VV'], values[1:3, 1:3])
+  # resampled to the poi's own shape
+  assert crop({'VV': values}, [0, 0, 4, 4], [0, 0, 4, 4], (8, 8))['VV'].shape == (8, 8)
+
+
+def test_has_data():
+  assert not has_data({'VV': np.zeros((2, 2)), 'VH': np.full((2, 2), np.nan)})
+  assert has_data({'VV': np.array([[0.0, -12.5]]), 'VH': np.zeros((1, 2))})
+
+
+def test_poi_scenes_one_round_trip():
+  fake_ee.configure(scenes=4, latency=0.0)
+  col = fake_ee.ImageCollection('COPERNICUS/S1_GRD')
+  scenes = poi_scenes(col, [poi('a', 50.0, 10.0), poi('b', 50.0, 10.01)], '2022-01-01', '2022-01-05')
+  assert fake_ee.stats['round_trips'] == 1
+  assert scenes['a'] == scenes['b'] and len(scenes['a']) == 2
+
+
+@pytest.fixture
+def server():
+  server = fake_ee.ThumbnailServer(dims=48)
+  yield server
+  server.shutdown()
+
+
+def test_update_shared_cubes_downloads_every_scene_once(tmp_path, server):
+  fake_ee.configure(scenes=3, latency=0.0, thumb_url=server.url)
+  imageries = []
+  for p in [poi('a', 50.0, 10.0), poi('b', 50.0, 10.01)]:
+    imagery = Imagery()
+    imagery.get_collection()
+    imagery.set_poi(p, str(tmp_path))
+    imageries.append(imagery)
+  assert update_shared_cubes(imageries, workers=2) == {'scenes': 3, 'downloads': 3, 'stored': 6}
+  for imagery in imageries:
+    cube = imagery.open_cube()
+    assert [s['track'] for s in cube.scenes] == ['ASCENDING_15', 'DESCENDING_88', 'ASCENDING_15']
+    assert tuple(cube.scenes[0]['shape'][1:]) == imagery.frame_shape()
+  assert update_shared_cubes(imageries, workers=2)['downloads'] == 0